@@ -0,0 +1,384 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2014 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+# Authors:
+#   Alvaro del Castillo <acs@bitergia.com>
+#
+
+""" Performance benchmarks of the report over the testing databases
+
+Each report stage, metric and study of each data source is a benchmark
+case run in its own process, recording its wall time, number of queries,
+rows fetched and peak RSS. The results of each run are appended to a JSON
+history file and compared with the previous runs to find regressions.
+"""
+
+import json, logging, os, platform, resource, shutil, subprocess, sys
+import tempfile, time, traceback
+from optparse import OptionParser
+
+benchmarks_dir = os.path.dirname(os.path.abspath(__file__))
+root_dir = os.path.dirname(benchmarks_dir)
+testing_dir = os.path.join(root_dir, "testing")
+
+# Dumps in testing/db and the automator database each one is loaded into
+dumps_dbs = {"source_code": "db_cvsanaly",
+             "tickets": "db_bicho",
+             "reviews": "db_gerrit",
+             "mailing_lists": "db_mlstats",
+             "irc": "db_irc",
+             "mediawiki": "db_mediawiki",
+             "downloads": "db_downloads",
+             "releases": "db_releases",
+             "qaforums": "db_qaforums"}
+
+# Report stages benchmarked, filters_merge only exists when sharding
+bench_stages = ['evol', 'agg', 'top', 'people', 'people_identifiers',
+                'filters', 'studies']
+
+# Measures compared with the history and the minimum change reported for each
+measures = {"time": 0.05, "queries": 1, "rows": 100, "peak_rss": 1024}
+
+counters = {"queries": 0, "rows": 0}
+
+def read_options():
+    parser = OptionParser(usage="usage: %prog [options]",
+                          version="%prog 0.1")
+    parser.add_option("-c", "--config-file",
+                      action="store",
+                      dest="config_file",
+                      default=os.path.join(testing_dir, "automator.conf"),
+                      help="Automator config file")
+    parser.add_option("-m", "--metrics",
+                      action="store",
+                      dest="metrics_path",
+                      default=os.path.join(root_dir, "vizgrimoire", "metrics"),
+                      help="Path to the metrics modules to be loaded")
+    parser.add_option("--load",
+                      action="store_true",
+                      dest="load",
+                      help="Load the testing/db dumps before running")
+    parser.add_option("--data-source",
+                      action="store",
+                      dest="data_source",
+                      help="Only run the benchmarks of this data source")
+    parser.add_option("--stages",
+                      action="store",
+                      dest="stages",
+                      default=",".join(bench_stages),
+                      help="Report stages to benchmark (empty for none)")
+    parser.add_option("--no-metrics",
+                      action="store_true",
+                      dest="no_metrics",
+                      help="Don't benchmark each metric class")
+    parser.add_option("--no-studies",
+                      action="store_true",
+                      dest="no_studies",
+                      help="Don't benchmark each study")
+    parser.add_option("--history",
+                      action="store",
+                      dest="history",
+                      default=os.path.join(benchmarks_dir, "history.json"),
+                      help="JSON file with the results of all runs")
+    parser.add_option("--label",
+                      action="store",
+                      dest="label",
+                      help="Label of the run, the git commit by default")
+    parser.add_option("--baseline",
+                      action="store",
+                      dest="baseline",
+                      default="5",
+                      help="Number of previous runs compared with")
+    parser.add_option("--threshold",
+                      action="store",
+                      dest="threshold",
+                      default="0.2",
+                      help="Max increase allowed over the baseline (0.2 = 20%)")
+
+    (opts, args) = parser.parse_args()
+
+    if len(args) != 0:
+        parser.error("Wrong number of arguments")
+    return opts
+
+def init_env():
+    for dir in [os.path.join(root_dir, "vizgrimoire"),
+                os.path.join(root_dir, "vizgrimoire", "metrics"),
+                os.path.join(root_dir, "vizgrimoire", "analysis"),
+                os.path.join(root_dir, "vizGrimoireJS"),
+                root_dir]:
+        sys.path.append(dir)
+
+    # env vars for R
+    os.environ["LANG"] = ""
+    os.environ["R_LIBS"] = os.path.join(root_dir, "..", "r-lib")
+
+def load_dumps(automator):
+    """ Create the testing databases from the 7z dumps in testing/db """
+    user = automator['generic']['db_user']
+    env = dict(os.environ)
+    env['MYSQL_PWD'] = automator['generic']['db_password']
+    # The same server the report connects to
+    mysql = ["mysql", "-u", user, "-h", "127.0.0.1"]
+
+    for dump in sorted(dumps_dbs):
+        db = automator['generic'][dumps_dbs[dump]]
+        logging.info("Loading " + dump + " in " + db)
+        sql = "DROP DATABASE IF EXISTS %s; CREATE DATABASE %s" % (db, db)
+        subprocess.check_call(mysql + ["-e", sql], env=env)
+        path = os.path.join(testing_dir, "db", dump + ".mysql.7z")
+        unzip = subprocess.Popen(["7zr", "x", "-so", path],
+                                 stdout=subprocess.PIPE)
+        subprocess.check_call(mysql + [db], stdin=unzip.stdout, env=env)
+        unzip.stdout.close()
+        if unzip.wait() != 0:
+            raise Exception("Can't extract " + path)
+
+def count_queries():
+    """ Count the queries run and the rows fetched by all MySQLdb cursors """
+    from MySQLdb.cursors import BaseCursor
+
+    execute = BaseCursor.execute
+    executemany = BaseCursor.executemany
+    fetch_row = BaseCursor._fetch_row
+
+    def counted_execute(self, query, args=None):
+        # executemany falls back to execute for each row in some cases
+        if not getattr(self, '_in_executemany', False):
+            counters['queries'] += 1
+        return execute(self, query, args)
+
+    def counted_executemany(self, query, args):
+        counters['queries'] += 1
+        self._in_executemany = True
+        try:
+            return executemany(self, query, args)
+        finally:
+            self._in_executemany = False
+
+    def counted_fetch_row(self, size=1):
+        rows = fetch_row(self, size)
+        counters['rows'] += len(rows)
+        return rows
+
+    BaseCursor.execute = counted_execute
+    BaseCursor.executemany = counted_executemany
+    BaseCursor._fetch_row = counted_fetch_row
+
+def get_cases(opts):
+    """ Benchmark cases: (kind, data source, name) """
+    stages = [stage for stage in opts.stages.split(",") if stage != '']
+    for stage in stages:
+        if stage not in bench_stages:
+            logging.error(stage + " is not a report stage: " + ",".join(bench_stages))
+            sys.exit(1)
+
+    cases = []
+    for ds in Report.get_data_sources():
+        if opts.data_source and ds.get_name() != opts.data_source: continue
+        for stage in stages:
+            if stage == 'people_identifiers' and ds.get_name() != "scm": continue
+            cases.append(("stage", ds.get_name(), stage))
+        if not opts.no_metrics:
+            for metric in ds.get_metrics_set(ds):
+                cases.append(("metric_ts", ds.get_name(), metric.id))
+                cases.append(("metric_agg", ds.get_name(), metric.id))
+        if not opts.no_studies:
+            for study in Report.get_studies():
+                cases.append(("study", ds.get_name(), study.id))
+    return cases
+
+def get_case_name(case):
+    return ":".join(case)
+
+def run_case(case, params):
+    """ Run a case, in a worker process, returning its measures """
+    from metrics_filter import MetricFilters
+    import report_tool
+
+    (kind, ds_name, name) = case
+    ds = Report.get_data_source(ds_name)
+    metric_filters = MetricFilters(params['period'], params['startdate'],
+                                   params['enddate'], None, 10,
+                                   params['people_out'])
+    counters['queries'] = counters['rows'] = 0
+    error = None
+    start = time.time()
+    try:
+        if kind == "stage":
+            report_tool.create_report_stage(ds, name, None, params)
+        elif kind in ["metric_ts", "metric_agg"]:
+            metric = [m for m in ds.get_metrics_set(ds) if m.id == name][0]
+            metric.filters = metric_filters
+            if kind == "metric_ts": metric.get_ts()
+            else: metric.get_agg()
+        elif kind == "study":
+            study = [s for s in Report.get_studies() if s.id == name][0]
+            config = Report.get_config()['generic']
+            dsquery = ds.get_query_builder()
+            dbcon = dsquery(config['db_user'], config['db_password'],
+                            config[ds.get_db_name()], config['db_identities'])
+            study(dbcon, metric_filters).create_report(ds, params['destdir'])
+    except:
+        error = traceback.format_exc()
+    result = {"time": time.time() - start,
+              "queries": counters['queries'],
+              "rows": counters['rows'],
+              "peak_rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}
+    if error is not None: result['error'] = error
+    return result
+
+def run_cases(cases, params):
+    """ Run each case in a new process so its peak RSS and caches are its own """
+    from multiprocessing import Pool
+    from report_tool import init_report_worker
+
+    results = {}
+    for case in cases:
+        pool = Pool(1, init_report_worker)
+        try:
+            result = pool.apply(run_case, (case, params))
+        finally:
+            pool.terminate()
+            pool.join()
+        results[get_case_name(case)] = result
+        if 'error' in result:
+            logging.error(get_case_name(case) + " failed:\n" + result['error'])
+        else:
+            logging.info("%s %.2f secs %i queries %i rows %i KB" %
+                         (get_case_name(case), result['time'], result['queries'],
+                          result['rows'], result['peak_rss']))
+    return results
+
+def read_history(path):
+    if not os.path.isfile(path): return []
+    f = open(path)
+    try:
+        return json.load(f)
+    finally:
+        f.close()
+
+def write_history(path, history):
+    # Written in a temp file first so an interrupted run doesn't lose history
+    tmp_path = path + ".tmp"
+    f = open(tmp_path, "w")
+    try:
+        json.dump(history, f, sort_keys=True, indent=1)
+    finally:
+        f.close()
+    os.rename(tmp_path, path)
+
+def get_regressions(history, results, baseline, threshold):
+    """ Cases whose measures grew more than threshold over the baseline
+
+    The baseline of a measure is the median of the values in the last
+    baseline runs of the history where the case worked.
+    """
+    regressions = []
+    for case in sorted(results):
+        if 'error' in results[case]: continue
+        previous = [run['results'][case] for run in history
+                    if case in run['results'] and 'error' not in run['results'][case]]
+        previous = previous[-baseline:]
+        if len(previous) == 0: continue
+        for measure in sorted(measures):
+            values = sorted([result[measure] for result in previous])
+            median = values[len(values) / 2]
+            value = results[case][measure]
+            if value - median < measures[measure]: continue
+            if value > median * (1 + threshold):
+                regressions.append((case, measure, median, value))
+    return regressions
+
+def get_label():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"],
+                                       cwd=root_dir).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO,format='%(asctime)s %(message)s')
+
+    init_env()
+    from GrimoireUtils import getPeriod, read_main_conf, createJSON
+    from report import Report
+    import report_tool
+
+    opts = read_options()
+    automator = read_main_conf(opts.config_file)
+
+    if opts.load:
+        load_dumps(automator)
+
+    Report.init(opts.config_file, opts.metrics_path)
+    count_queries()
+
+    start_date = automator['r']['start_date']
+    if 'end_date' not in automator['r']:
+        end_date = time.strftime('%Y-%m-%d')
+    else:
+        end_date = automator['r']['end_date']
+    if 'period' not in automator['r']:
+        period = getPeriod("months")
+    else:
+        period = getPeriod(automator['r']['period'])
+    people_out = None
+    if 'people_out' in automator['r']:
+        people_out = automator['r']['people_out'].split(",")
+
+    # report_tool functions use the globals set in its main
+    report_tool.Report = Report
+    report_tool.createJSON = createJSON
+    report_tool.period = period
+
+    destdir = tempfile.mkdtemp(prefix="grimoirelib_bench_")
+    params = {'period': period, 'startdate': "'"+start_date+"'",
+              'enddate': "'"+end_date+"'", 'destdir': destdir,
+              'npeople': automator['generic'].get('people_number', "10"),
+              'identities_db': automator['generic']['db_identities'],
+              'people_out': people_out, 'filters_parts': 1}
+
+    try:
+        results = run_cases(get_cases(opts), params)
+    finally:
+        shutil.rmtree(destdir)
+        Report.close()
+
+    history = read_history(opts.history)
+    regressions = get_regressions(history, results, int(opts.baseline),
+                                  float(opts.threshold))
+    label = opts.label
+    if label is None: label = get_label()
+    history.append({"date": time.strftime('%Y-%m-%d %H:%M:%S'),
+                    "label": label,
+                    "host": platform.node(),
+                    "config": os.path.abspath(opts.config_file),
+                    "results": results})
+    write_history(opts.history, history)
+
+    total = sum([result['time'] for result in results.values()])
+    logging.info("%i cases run in %.2f secs" % (len(results), total))
+    errors = [case for case in results if 'error' in results[case]]
+    if errors:
+        logging.error("Failed cases: " + ", ".join(sorted(errors)))
+    for (case, measure, median, value) in regressions:
+        logging.error("Regression in %s %s: %s (baseline %s)" %
+                      (case, measure, value, median))
+    if regressions: sys.exit(1)
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2014 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+# Authors:
+#         Alvaro del Castillo <acs@bitergia.com>
+#
+
+"""Tests for the filter reports of the data sources"""
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+for path in ['../../vizgrimoire', '../../vizgrimoire/metrics']:
+    if not path in sys.path:
+        sys.path.insert(0, path)
+
+from data_source import DataSource
+from filter import Filter
+from query_builder import ITSQuery
+
+
+class FakeDS(DataSource):
+    """ Data source with dates of the items in the tickets of each company """
+
+    tickets = {"company1": ["2012-01-01", "2013-01-01"],
+               "company2": ["2012-06-01"],
+               "company3": []}
+    grouped = True
+    queries = []
+
+    @staticmethod
+    def _get_date(type_analysis, function, field):
+        FakeDS.queries.append(type_analysis)
+        if type_analysis[1] is not None:
+            dates = FakeDS.tickets[type_analysis[1][1:-1]]
+            if len(dates) == 0: return {field: None}
+            return {field: function(dates)}
+        if not FakeDS.grouped: return None
+        items = [item for item in FakeDS.tickets if len(FakeDS.tickets[item]) > 0]
+        return {"name": items,
+                field: [function(FakeDS.tickets[item]) for item in items]}
+
+    @staticmethod
+    def get_date_init(startdate, enddate, identities_db, type_analysis):
+        return FakeDS._get_date(type_analysis, min, "first_date")
+
+    @staticmethod
+    def get_date_end(startdate, enddate, identities_db, type_analysis):
+        return FakeDS._get_date(type_analysis, max, "last_date")
+
+    @staticmethod
+    def get_query_builder():
+        return ITSQuery
+
+    @staticmethod
+    def get_evolutionary_data(period, startdate, enddate, identities_db, filter_ = None):
+        FakeDS.queries.append(filter_.get_items())
+        return {"name": ["company1", "company2"], "month": [1], "opened": [[1], [2]]}
+
+    @staticmethod
+    def get_agg_data(period, startdate, enddate, identities_db, filter_ = None):
+        return {"name": ["company1", "company2"], "opened": [1, 2]}
+
+
+class TestFilterItems(unittest.TestCase):
+
+    def setUp(self):
+        FakeDS.grouped = True
+        FakeDS.queries = []
+        self.items = ["company3", "company1", "company2"]
+        self.items_analysis = [Filter("company", item).get_type_analysis()
+                               for item in self.items]
+
+    def get_date_items(self):
+        return DataSource.get_date_items(FakeDS, "'2010-01-01'", "'2014-01-01'",
+                                         "db_identities", self.items,
+                                         self.items_analysis, "name")
+
+    def test_date_items_grouped(self):
+        dates = self.get_date_items()
+        self.assertEqual(2, len(FakeDS.queries))
+        self.assertEqual(self.items, dates['name'])
+        self.assertEqual([None, "2012-01-01", "2012-06-01"], dates['first_date'])
+        self.assertEqual([None, "2013-01-01", "2012-06-01"], dates['last_date'])
+
+    def test_date_items_per_item(self):
+        grouped = self.get_date_items()
+        FakeDS.grouped = False
+        FakeDS.queries = []
+        self.assertEqual(grouped, self.get_date_items())
+        self.assertEqual(2 + 2 * len(self.items), len(FakeDS.queries))
+
+    def test_filter_items_data_shard(self):
+        shard_items = ["company2", "company3"]
+        data = DataSource.get_filter_items_data(FakeDS, Filter("company"), shard_items,
+                                                "month", "'2010-01-01'",
+                                                "'2014-01-01'", "db_identities")
+        # The filter all data is got only for the shard items
+        self.assertEqual([shard_items], FakeDS.queries)
+        self.assertEqual(["company2"], data.keys())
+        self.assertEqual(({"month": [1], "opened": [2]}, {"opened": 2}),
+                         data["company2"])
+
+
+class TestMergeItemsList(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_path = tempfile.mkdtemp(prefix='items_list_')
+        self.filename = os.path.join(self.tmp_path, "scm-repos.json")
+        self.shards = []
+        for (shard, positions, items) in [((1, 2), [0, 2], ["a", "c"]),
+                                          ((2, 2), [1], ["b"])]:
+            name = DataSource.get_shard_filename(self.filename, shard)
+            with open(name, "w") as f:
+                json.dump({"positions": positions, "items_list": items}, f)
+            self.shards.append(name)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_path)
+
+    def test_merge(self):
+        DataSource.merge_items_list(self.filename, (2, 2))
+        with open(self.filename) as f:
+            self.assertEqual(["a", "b", "c"], json.load(f))
+        self.assertEqual(["scm-repos.json"], os.listdir(self.tmp_path))
+
+    def test_merged_by_other_process(self):
+        # Other process claimed the merge after all the shards were found
+        isfile = os.path.isfile
+        os.path.isfile = lambda name: True
+        try:
+            os.rename(self.shards[0], self.shards[0] + ".merging-other-1")
+            DataSource.merge_items_list(self.filename, (2, 2))
+        finally:
+            os.path.isfile = isfile
+        self.assertFalse(os.path.exists(self.filename))
+        self.assertTrue(os.path.exists(self.shards[1]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2014 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+# Authors:
+#         Alvaro del Castillo <acs@bitergia.com>
+#
+
+"""Tests for the pool of database connections"""
+
+import sys
+import threading
+import unittest
+
+if not '../../vizgrimoire/metrics' in sys.path:
+    sys.path.insert(0, '../../vizgrimoire/metrics')
+
+import MySQLdb
+
+from db_pool import DBPool, DBPoolTimeout
+
+
+class FakeConnection(object):
+
+    def __init__(self):
+        self.alive = True
+        self.closed = False
+
+    def ping(self):
+        if not self.alive:
+            raise MySQLdb.OperationalError(2006, "MySQL server has gone away")
+
+    def close(self):
+        self.closed = True
+
+    def autocommit(self, on):
+        self.autocommit_on = on
+
+    def cursor(self):
+        return FakeCursor()
+
+
+class FakeCursor(object):
+
+    def execute(self, sql):
+        pass
+
+    def close(self):
+        pass
+
+
+class FakeDBPool(DBPool):
+
+    def _connect(self):
+        return FakeConnection()
+
+
+class TestDBPool(unittest.TestCase):
+
+    def test_get_pool(self):
+        pool1 = DBPool.get_pool("root", "", "db_test_pool")
+        pool2 = DBPool.get_pool("root", "", "db_test_pool")
+        pool3 = DBPool.get_pool("root", "", "db_test_pool", port=3307)
+        self.assertIs(pool1, pool2)
+        self.assertIsNot(pool1, pool3)
+
+    def test_autocommit(self):
+        connect = MySQLdb.connect
+        MySQLdb.connect = lambda **kwargs: FakeConnection()
+        try:
+            db = DBPool("root", "", "db_test").checkout()
+        finally:
+            MySQLdb.connect = connect
+        self.assertTrue(db.autocommit_on)
+
+    def test_lazy_connect(self):
+        pool = FakeDBPool("root", "", "db_test", min_size=1, max_size=2)
+        self.assertEqual(0, pool.get_size())
+        db = pool.checkout()
+        self.assertEqual(1, pool.get_size())
+        pool.checkin(db)
+        self.assertIs(db, pool.checkout())
+
+    def test_max_size(self):
+        pool = FakeDBPool("root", "", "db_test", min_size=1, max_size=2)
+        db1 = pool.checkout()
+        db2 = pool.checkout()
+        self.assertRaises(DBPoolTimeout, pool.checkout, 0.1)
+        pool.checkin(db1)
+        self.assertIs(db1, pool.checkout(0.1))
+        pool.checkin(db2, broken=True)
+        self.assertTrue(db2.closed)
+        self.assertEqual(1, pool.get_size())
+
+    def test_health_check(self):
+        pool = FakeDBPool("root", "", "db_test")
+        db = pool.checkout()
+        pool.checkin(db)
+        db.alive = False
+        db_new = pool.checkout()
+        self.assertIsNot(db, db_new)
+        self.assertTrue(db.closed)
+        self.assertEqual(1, pool.get_size())
+
+    def test_prune_idle(self):
+        pool = FakeDBPool("root", "", "db_test", min_size=1, max_size=3,
+                          max_idle=0)
+        dbs = [pool.checkout() for i in range(0, 3)]
+        for db in dbs: pool.checkin(db)
+        self.assertEqual(1, pool.get_idle())
+        self.assertEqual(1, pool.get_size())
+
+    def test_threads(self):
+        pool = FakeDBPool("root", "", "db_test", max_size=2)
+        in_use = []
+        errors = []
+        lock = threading.Lock()
+
+        def worker():
+            for i in range(0, 50):
+                with pool.connection() as db:
+                    with lock:
+                        if db in in_use: errors.append(db)
+                        in_use.append(db)
+                    with lock:
+                        in_use.remove(db)
+
+        threads = [threading.Thread(target=worker) for i in range(0, 5)]
+        for t in threads: t.start()
+        for t in threads: t.join()
+        self.assertEqual([], errors)
+        self.assertTrue(pool.get_size() <= 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2014 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+# Authors:
+#         Alvaro del Castillo <acs@bitergia.com>
+#
+
+"""Tests for the distribution of values streamed from the database"""
+
+import math
+import random
+import sys
+import unittest
+
+if not '../../vizgrimoire/metrics' in sys.path:
+    sys.path.insert(0, '../../vizgrimoire/metrics')
+
+from numpy import average, median, percentile
+
+from distribution import QuantileSketch, get_distribution, get_distribution_by_period
+
+
+class TestQuantileSketch(unittest.TestCase):
+
+    def test_exact(self):
+        values = [random.random() * 100 for i in range(0, 999)]
+        data = get_distribution(values + [None], [75, 90], capacity=1000)
+        self.assertEqual(median(values), data['median'])
+        self.assertEqual(average(values), data['avg'])
+        self.assertEqual(percentile(values, 90), data['p90'])
+
+    def test_empty(self):
+        data = get_distribution([], [95])
+        self.assertTrue(math.isnan(data['median']))
+        self.assertTrue(math.isnan(data['p95']))
+
+    def test_bounded(self):
+        values = range(0, 100000)
+        random.shuffle(values)
+        sketch = QuantileSketch(capacity=500)
+        for value in values: sketch.add(value)
+        self.assertFalse(sketch.is_exact())
+        self.assertTrue(sum([len(level) for level in sketch.levels]) <= 500 * len(sketch.levels))
+        self.assertEqual(average(values), sketch.get_avg())
+        for q in [10, 50, 95]:
+            self.assertTrue(abs(sketch.get_percentile(q) - q * 1000) < 1000)
+
+    def test_by_period(self):
+        rows = [(24157, 3), (24156, 1), (24157, 1), (24156, None), (24157, 8)]
+        data = get_distribution_by_period(iter(rows), 'month', [75])
+        self.assertEqual([24156, 24157], data['month'])
+        self.assertEqual([1, 3], data['median'])
+        self.assertEqual([1, 4], data['avg'])
+        self.assertEqual([1, 5.5], data['p75'])
+
+
+if __name__ == "__main__":
+    unittest.main()
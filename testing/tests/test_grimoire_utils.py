@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2014 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+# Authors:
+#         Alvaro del Castillo <acs@bitergia.com>
+#
+
+"""Tests for the GrimoireUtils helpers"""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from datetime import datetime
+from decimal import Decimal
+
+for path in ['../../vizgrimoire', '../../vizgrimoire/metrics']:
+    if not path in sys.path:
+        sys.path.insert(0, path)
+
+import numpy
+
+from GrimoireUtils import completePeriodIds, completePeriodIdsMulti, createJSON
+from GrimoireUtils import medianAndAvgByPeriod, get_groups_tops
+
+
+class TestCompletePeriodIds(unittest.TestCase):
+
+    def test_months(self):
+        ts = {'month': [2014*12+3, 2014*12+1], 'commits': [5, 2]}
+        ts = completePeriodIds(ts, 'month', "'2014-01-15'", "'2014-05-01'")
+        self.assertEqual([2, 0, 5, 0], ts['commits'])
+        self.assertEqual([0, 1, 2, 3], ts['id'])
+        self.assertEqual(['Jan 2014', 'Feb 2014', 'Mar 2014', 'Apr 2014'], ts['date'])
+        self.assertEqual(u'1388534400', ts['unixtime'][0])
+
+    def test_weeks(self):
+        ts = {'week': [201402], 'commits': [float('nan')]}
+        ts = completePeriodIds(ts, 'week', "'2014-01-01'", "'2014-01-20'")
+        self.assertEqual([201401, 201402, 201403], ts['week'])
+        self.assertEqual([0, 0, 0], ts['commits'])
+
+    def test_days(self):
+        ts = {'unixtime': [1388620800], 'commits': [3]}
+        ts = completePeriodIds(ts, 'day', "'2014-01-01'", "'2014-01-04'")
+        self.assertEqual([0, 3, 0], ts['commits'])
+        self.assertEqual(['01 Jan 2014', '02 Jan 2014', '03 Jan 2014'], ts['date'])
+
+    def test_multi(self):
+        series = [{'year': [2013*12], 'commits': [1]},
+                  {'year': [], 'authors': []},
+                  {}]
+        series = completePeriodIdsMulti(series, 'year', "'2012-01-01'", "'2014-01-01'")
+        self.assertEqual([0, 1], series[0]['commits'])
+        self.assertEqual([0, 0], series[1]['authors'])
+        self.assertEqual(series[0]['unixtime'], series[1]['unixtime'])
+        self.assertEqual({}, series[2])
+
+
+class TestMedianAndAvgByPeriod(unittest.TestCase):
+
+    def test_unsorted(self):
+        dates = [datetime(2014, 2, 3), datetime(2014, 1, 5), datetime(2014, 2, 1),
+                 datetime(2014, 1, 31), datetime(2014, 2, 27)]
+        values = [Decimal('4'), 2, 1, None, 10]
+        data = medianAndAvgByPeriod('month', dates, values)
+        self.assertEqual([2014*12+1, 2014*12+2], data['month'])
+        self.assertEqual([2, 4], data['median'])
+        self.assertEqual([2, 5], data['avg'])
+        self.assertEqual([2, 1], data['min'])
+        self.assertEqual([2, 10], data['max'])
+        self.assertEqual([1, 3], data['count'])
+
+    def test_periods(self):
+        dates = [datetime(2013, 12, 30, 10), datetime(2014, 1, 1, 23)]
+        data = medianAndAvgByPeriod('week', dates, [1, 3])
+        self.assertEqual([201401], data['week'])
+        self.assertEqual([2], data['median'])
+        data = medianAndAvgByPeriod('day', dates, [1, 3])
+        self.assertEqual([1388361600, 1388534400], data['unixtime'])
+        data = medianAndAvgByPeriod('year', dates, [1, 3])
+        self.assertEqual([2013*12, 2014*12], data['year'])
+
+    def test_columnar(self):
+        # Columns from DSQuery.ExecuteQueryColumnar
+        dates = numpy.array([datetime(2014, 1, 5), datetime(2014, 1, 8)], dtype=object)
+        data = medianAndAvgByPeriod('month', dates, numpy.array([1.0, float('nan')]))
+        self.assertEqual([2014*12+1], data['month'])
+        self.assertEqual([1], data['count'])
+        self.assertIsNone(medianAndAvgByPeriod('month', dates[:0], numpy.array([])))
+
+
+class TestGroupsTops(unittest.TestCase):
+
+    def test_tops(self):
+        groups = {'nova': set([1, 2]), 'swift': set([3]), 'docs': set([4]),
+                  'empty': set()}
+        rows = [(1, (10, 'ann'), 3), (2, (10, 'ann'), 2), (2, (11, 'bob'), 5),
+                (1, (12, 'cid'), 1), (3, (11, 'bob'), 7), (4, (12, 'cid'), 1)]
+        tops = get_groups_tops(groups, iter(rows), ['commits', 'id', 'name'], 2,
+                               lambda row: (-row[0], row[1]))
+        self.assertEqual({'commits': [5, 5], 'id': [10, 11], 'name': ['ann', 'bob']},
+                         tops['nova'])
+        self.assertEqual({'commits': 7, 'id': 11, 'name': 'bob'}, tops['swift'])
+        self.assertEqual({'commits': [], 'id': [], 'name': []}, tops['empty'])
+
+
+class TestCreateJSON(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_path = tempfile.mkdtemp(prefix='create_json_')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_path)
+
+    def test_encoding(self):
+        data = {'commits': [Decimal('1.5'), 2.34567, float('nan')],
+                'first_date': datetime(2014, 1, 2, 3, 4, 5),
+                'name': 'NaN', 'avg': {'value': Decimal('0.125')}}
+        filepath = os.path.join(self.tmp_path, 'scm-static.json')
+        createJSON(data, filepath)
+        self.assertEqual(['scm-static.json'], os.listdir(self.tmp_path))
+        self.assertEqual('{"avg": {"value": 0.13}, "commits": [1.5, 2.35, "NA"], '
+                         '"first_date": "2014-01-02 03:04:05", "name": "NaN"}',
+                         open(filepath).read())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2014 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+# Authors:
+#         Alvaro del Castillo <acs@bitergia.com>
+#
+
+"""Tests for the checkpointed replay of the tickets states"""
+
+import calendar
+import datetime
+import re
+import sys
+import unittest
+
+for path in ['../../vizgrimoire', '../../vizgrimoire/metrics',
+             '../../vizgrimoire/analysis']:
+    if not path in sys.path:
+        sys.path.insert(0, path)
+
+from its_states import TicketsStates
+from metrics_filter import MetricFilters
+from query_builder import DSQuery
+
+
+class FakeQuery(DSQuery):
+    """ Query builder with an issues log and the checkpoint tables """
+
+    def __init__(self, log):
+        self.database = "db_test_its_states"
+        self.log = log # (id, issue_id, status, date)
+        self.checkpoints = {}
+        self.issues = {}
+        self.backlog = {}
+        self.log_queries = []
+
+    @staticmethod
+    def get_udate(date):
+        return calendar.timegm(datetime.datetime.strptime(date, "%Y-%m-%d").timetuple())
+
+    def _get_rows(self, table, checkpoint):
+        if table == "tickets_states_issues": rows = self.issues
+        else: rows = self.backlog
+        return sorted([key for key in rows if key[0] == checkpoint])
+
+    def ExecuteUpdate(self, sql, rows = None, table = None):
+        if sql.startswith("CREATE"): return
+        if sql.startswith("DELETE"):
+            checkpoint = re.search("checkpoint = '(.*)'", sql).group(1)
+            if table == "tickets_states_checkpoint":
+                self.checkpoints.pop(checkpoint, None)
+            for key in self._get_rows(table, checkpoint):
+                if table == "tickets_states_issues": del self.issues[key]
+                else: del self.backlog[key]
+        elif table == "tickets_states_checkpoint":
+            for row in rows: self.checkpoints[row[0]] = row[1:]
+        elif table == "tickets_states_issues":
+            for row in rows: self.issues[row[:2]] = row[2]
+        else:
+            for row in rows: self.backlog[row[:3]] = row[3]
+
+    def ExecuteQuery(self, sql):
+        if "FROM tickets_states_checkpoint" in sql:
+            checkpoint = re.search("checkpoint = '(.*)'", sql).group(1)
+            if checkpoint not in self.checkpoints: return {}
+            return dict(zip(["last_id", "last_udate", "enddate", "log_rows"],
+                            self.checkpoints[checkpoint]))
+        if "FROM tickets_states_issues" in sql:
+            checkpoint = re.search("checkpoint = '(.*)'", sql).group(1)
+            keys = self._get_rows("tickets_states_issues", checkpoint)
+            return {"issue_id": [key[1] for key in keys],
+                    "status": [self.issues[key] for key in keys]}
+        if "FROM tickets_states_backlog" in sql:
+            checkpoint = re.search("checkpoint = '(.*)'", sql).group(1)
+            keys = self._get_rows("tickets_states_backlog", checkpoint)
+            return {"unixtime": [key[1] for key in keys],
+                    "status": [key[2] for key in keys],
+                    "tickets": [self.backlog[key] for key in keys]}
+
+        (start, end) = re.search("date >= '(.*?)' AND date < '(.*?)'", sql).groups()
+        log = [entry for entry in self.log if start <= entry[3] < end]
+        if "COUNT(*)" in sql:
+            last_id = int(re.search(r"id <= (\d+)", sql).group(1))
+            return {"log_rows": len([entry for entry in log if entry[0] <= last_id])}
+        delta = re.search(r"id > (\d+) OR date >= '(.*?)'", sql)
+        if delta is not None:
+            log = [entry for entry in log if entry[0] > int(delta.group(1))
+                   or entry[3] >= delta.group(2)]
+        log = sorted(log, key = lambda entry: (entry[3], entry[0]))
+        self.log_queries.append(len(log))
+        return {"id": [entry[0] for entry in log],
+                "issue_id": [entry[1] for entry in log],
+                "status": [entry[2] for entry in log],
+                "udate": [FakeQuery.get_udate(entry[3]) for entry in log]}
+
+
+class TestTicketsStates(unittest.TestCase):
+
+    states = ["new", "open", "closed"]
+
+    def setUp(self):
+        self.log = [(1, 1, "new", "2014-01-05"), (2, 2, "new", "2014-01-10"),
+                    (3, 1, "open", "2014-01-20"), (4, 3, "new", "2014-02-03"),
+                    (5, 2, "closed", "2014-02-15"), (6, 1, "closed", "2014-03-02"),
+                    (7, 3, "open", "2014-03-10"), (8, 4, "new", "2014-04-01")]
+
+    def get_backlog(self, db, enddate):
+        filters = MetricFilters("month", "'2014-01-01'", enddate, [])
+        return TicketsStates(db, filters).get_backlog(self.states, "bugzilla")
+
+    def get_full_replay(self, enddate):
+        return self.get_backlog(FakeQuery(list(self.log)), enddate)
+
+    def test_checkpoint(self):
+        db = FakeQuery([entry for entry in self.log if entry[3] < "2014-03-01"])
+        first = self.get_backlog(db, "'2014-03-01'")
+        self.assertEqual(first, self.get_full_replay("'2014-03-01'"))
+        self.assertEqual([0, 1], first["closed"])
+        # January is closed: its backlog is saved for each state
+        self.assertEqual(3, len(db.backlog))
+
+        # Only the new entries are replayed, reusing the closed periods
+        db.log = list(self.log)
+        data = self.get_backlog(db, "'2014-05-01'")
+        self.assertEqual([5, 3], db.log_queries)
+        self.assertEqual(self.get_full_replay("'2014-05-01'"), data)
+
+    def test_delta_after_enddate(self):
+        # Entries with old ids but after the checkpoint end date are replayed
+        self.log[5] = (9, 1, "closed", "2014-03-02")
+        self.log[6] = (2, 3, "open", "2014-03-10")
+        self.log[1] = (10, 2, "new", "2014-01-10")
+        db = FakeQuery(list(self.log))
+        self.get_backlog(db, "'2014-03-01'")
+        data = self.get_backlog(db, "'2014-05-01'")
+        self.assertEqual([5, 3], db.log_queries)
+        self.assertEqual(self.get_full_replay("'2014-05-01'"), data)
+
+    def test_rows_changed(self):
+        db = FakeQuery(list(self.log))
+        self.get_backlog(db, "'2014-03-01'")
+        # A replayed entry removed from the log: the checkpoint is rebuilt
+        del self.log[4]
+        db.log = list(self.log)
+        data = self.get_backlog(db, "'2014-05-01'")
+        self.assertEqual([5, 7], db.log_queries)
+        self.assertEqual(self.get_full_replay("'2014-05-01'"), data)
+        # and the rebuilt one is used by the next run
+        self.assertEqual(data, self.get_backlog(db, "'2014-05-01'"))
+        self.assertEqual(0, db.log_queries[-1])
+
+
+if __name__ == "__main__":
+    unittest.main()
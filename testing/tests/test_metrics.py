@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2014 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+# Authors:
+#         Alvaro del Castillo <acs@bitergia.com>
+#
+
+"""Tests for the generic behaviour of the metrics"""
+
+import sys
+import unittest
+
+for path in ['../../vizgrimoire', '../../vizgrimoire/metrics']:
+    if not path in sys.path:
+        sys.path.insert(0, path)
+
+from metrics import Metrics
+from metrics_filter import MetricFilters
+from query_builder import DSQuery, SCRQuery
+from scr_metrics import Merged, TimeToReview
+
+
+class FakeQuery(DSQuery):
+    """ Query builder returning the results of results(sql) """
+
+    def __init__(self, results):
+        self.database = "db_test_metrics"
+        self.results = results
+        self.queries = []
+
+    def ExecuteQuery(self, sql):
+        self.queries.append(sql)
+        return self.results(sql)
+
+
+class FakeSCRQuery(SCRQuery, FakeQuery):
+
+    def __init__(self, results):
+        FakeQuery.__init__(self, results)
+        self._filter_submitter_id = None
+
+    def ExecuteQueryStream(self, sql):
+        self.queries.append(sql)
+        return iter(self.results(sql))
+
+
+class Commits(Metrics):
+    id = "commits"
+
+    def _get_sql(self, evolutionary):
+        return self.db.GetSQLGlobal(" s.date ", "count(distinct(s.id)) as commits",
+                                    "scmlog s", "", self.filters.startdate,
+                                    self.filters.enddate)
+
+
+class Pending(Metrics):
+    """ Like SCR Pending: its values are not got from _get_sql """
+    id = "pending"
+
+    def get_agg(self):
+        # Days in the period
+        return {"pending": int(self.filters.enddate[-3:-1]) - int(self.filters.startdate[-3:-1])}
+
+
+class TestTrendsMulti(unittest.TestCase):
+
+    def setUp(self):
+        self.filters = MetricFilters("month", "'2014-01-01'", "'2014-02-01'", None)
+
+    def test_one_query(self):
+        def results(sql):
+            return {"commits_last_7": 10, "commits_prev_7": 5,
+                    "commits_last_14": 12, "commits_prev_14": None}
+        db = FakeQuery(results)
+        data = Commits(db, self.filters).get_trends_multi("'2014-01-29'", [7, 14])
+        self.assertEqual(1, len(db.queries))
+        self.assertEqual(10, data['commits_7'])
+        self.assertEqual(5, data['diff_netcommits_7'])
+        self.assertEqual(12, data['commits_14'])
+        self.assertEqual(12, data['diff_netcommits_14'])
+
+    def test_own_get_agg(self):
+        db = FakeQuery(lambda sql: self.fail("No queries expected: " + sql))
+        data = Pending(db, self.filters).get_trends_multi("'2014-01-29'", [7, 14])
+        self.assertEqual(7, data['pending_7'])
+        self.assertEqual(0, data['diff_netpending_7'])
+        self.assertEqual(14, data['pending_14'])
+
+    def test_start_in_filters(self):
+        # Merged reviews are filtered by the submission date too
+        Metrics._memo_results = {}
+        db = FakeSCRQuery(lambda sql: {"merged": 1})
+        merged = Merged(db, self.filters)
+        data = merged.get_trends_multi("'2014-01-29'", [7, 14])
+        self.assertEqual(1, data['merged_7'])
+        queries = []
+        for (start, end) in [("'2014-01-22'", "'2014-01-29'"), ("'2014-01-15'", "'2014-01-22'"),
+                             ("'2014-01-15'", "'2014-01-29'"), ("'2014-01-01'", "'2014-01-15'")]:
+            merged.filters = MetricFilters("month", start, end, None)
+            queries.append(merged._get_sql(False))
+        self.assertEqual(queries, db.queries)
+
+
+class TestTimeToReview(unittest.TestCase):
+
+    def test_report_fields(self):
+        # The SCR report data has only the median and avg review times
+        filters = MetricFilters("month", "'2014-01-01'", "'2014-02-01'", None)
+        db = FakeSCRQuery(lambda sql: [(1.0,), (2.0,), (6.0,)])
+        data = TimeToReview(db, filters).get_agg()
+        self.assertEqual({"review_time_days_median": 2.0,
+                          "review_time_days_avg": 3.0}, data)
+
+
+class TestItemsTs(unittest.TestCase):
+
+    def get_items_ts(self, data):
+        return Metrics._get_items_ts(data, "name", "month",
+                                     "'2014-01-01'", "'2014-04-01'")
+
+    def test_missing_periods(self):
+        data = {"name": ["a", "b", "a", "b", "a"],
+                "month": [24169, 24170, 24171, 24171, 24175],
+                "commits": [1, 2, 3, float('nan'), 4]}
+        ts = self.get_items_ts(data)
+        self.assertEqual(["a", "b"], ts["name"])
+        self.assertEqual([[1, 0, 3], [0, 2, 0]], ts["commits"])
+        self.assertEqual([24169, 24170, 24171], ts["month"])
+        self.assertEqual([0, 1, 2], ts["id"])
+        self.assertEqual(3, len(ts["unixtime"]))
+
+    def test_one_row(self):
+        # ExecuteQuery returns scalars for one row
+        ts = self.get_items_ts({"name": "a", "month": 24170, "commits": 5})
+        self.assertEqual(["a"], ts["name"])
+        self.assertEqual([[0, 5, 0]], ts["commits"])
+        self.assertEqual([24169, 24170, 24171], ts["month"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2014 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+# Authors:
+#         Alvaro del Castillo <acs@bitergia.com>
+#
+
+"""Tests for the incremental refresh of the people lifecycle"""
+
+import re
+import sys
+import unittest
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+for path in ['../../vizgrimoire', '../../vizgrimoire/metrics',
+             '../../vizgrimoire/analysis']:
+    if not path in sys.path:
+        sys.path.insert(0, path)
+
+from contributors_new_gone import ContributorsNewGoneSCM
+from metrics_filter import MetricFilters
+from people_lifecycle import PeopleLifecycle
+from query_builder import DSQuery, SCMQuery
+
+
+class FakePool(object):
+    """ Connections whose cursors only run GET_LOCK and RELEASE_LOCK """
+
+    def __init__(self, locks):
+        self.locks = locks # lock name: holder
+        self.result = None
+
+    @contextmanager
+    def connection(self):
+        yield self
+
+    def cursor(self):
+        return self
+
+    def execute(self, sql, params):
+        if sql.startswith("SELECT GET_LOCK"):
+            self.result = 0
+            if params[0] not in self.locks:
+                self.locks[params[0]] = self
+                self.result = 1
+        else:
+            del self.locks[params[0]]
+            self.result = 1
+
+    def fetchone(self):
+        return (self.result,)
+
+    def close(self):
+        pass
+
+
+class FakeQuery(DSQuery):
+    """ Query builder with the commits of the people and the lifecycle tables """
+
+    def __init__(self, commits, identities, locks = None):
+        self.database = "db_test_people_lifecycle"
+        self.commits = commits # (id, author_id, date)
+        self.identities = identities # people_id: upeople_id
+        if locks is None: locks = {}
+        self.pool = FakePool(locks)
+        self.state = {}
+        self.lifecycle = {}
+        self.updates = []
+
+    def get_lifecycle(self, first_id, last_id):
+        """ upeople_id: (first date, last date, actions) of the commits """
+        lifecycle = {}
+        for (id, author_id, date) in self.commits:
+            if id <= first_id or id > last_id: continue
+            upeople_id = self.identities[author_id]
+            (first, last, actions) = lifecycle.get(upeople_id, (date, date, 0))
+            lifecycle[upeople_id] = (min(first, date), max(last, date), actions + 1)
+        return lifecycle
+
+    def ExecuteQuery(self, sql):
+        if "FROM people_upeople" in sql:
+            return {"total": len(self.identities),
+                    "hash": hash(tuple(sorted(self.identities.items())))}
+        if "FROM people_lifecycle_state" in sql:
+            if not "scm" in self.state: return {}
+            return dict(zip(["filters", "identities", "last_id", "actions"],
+                            self.state["scm"]))
+        if "MAX(id)" in sql:
+            return {"max_id": max([commit[0] for commit in self.commits])}
+        last_id = int(re.search(r"scmlog.id <= (\d+)", sql).group(1))
+        return {"actions": len([c for c in self.commits if c[0] <= last_id])}
+
+    def ExecuteUpdate(self, sql, rows = None, table = None):
+        if sql.startswith("CREATE"): return
+        self.updates.append(sql.split()[0])
+        if table == "people_lifecycle_state":
+            if sql.startswith("DELETE"): self.state = {}
+            else: self.state[rows[0][0]] = rows[0][1:]
+        elif sql.startswith("DELETE"):
+            self.lifecycle = {}
+        else:
+            first_id = int(re.search(r"scmlog.id > (\d+)", sql).group(1))
+            last_id = int(re.search(r"scmlog.id <= (\d+)", sql).group(1))
+            for (upeople_id, new) in self.get_lifecycle(first_id, last_id).items():
+                if upeople_id in self.lifecycle:
+                    old = self.lifecycle[upeople_id]
+                    new = (min(old[0], new[0]), max(old[1], new[1]), old[2] + new[2])
+                self.lifecycle[upeople_id] = new
+
+
+class TestPeopleLifecycle(unittest.TestCase):
+
+    def setUp(self):
+        self.commits = [(1, 1, "2014-01-05"), (2, 2, "2014-01-10"),
+                        (3, 1, "2014-02-01")]
+        self.identities = {1: 1, 2: 2, 3: 3}
+
+    def get_full_build(self, db):
+        return db.get_lifecycle(0, max([commit[0] for commit in db.commits]))
+
+    def test_incremental(self):
+        db = FakeQuery(self.commits, self.identities)
+        self.assertTrue(PeopleLifecycle(db, "scm").refresh())
+        self.assertEqual(self.get_full_build(db), db.lifecycle)
+
+        db.commits += [(4, 3, "2014-03-01"), (5, 1, "2014-03-02")]
+        db.updates = []
+        self.assertTrue(PeopleLifecycle(db, "scm").refresh())
+        # Only the new commits are aggregated
+        self.assertEqual(["DELETE", "INSERT", "INSERT"], db.updates)
+        self.assertEqual(self.get_full_build(db), db.lifecycle)
+        self.assertEqual(("2014-01-05", "2014-03-02", 3), db.lifecycle[1])
+
+        # Nothing to do without new commits
+        db.updates = []
+        self.assertTrue(PeopleLifecycle(db, "scm").refresh())
+        self.assertEqual([], db.updates)
+
+    def test_identities_changed(self):
+        db = FakeQuery(self.commits, self.identities)
+        PeopleLifecycle(db, "scm").refresh()
+        # The identity of people 2 is merged with the one of people 1
+        db.identities = {1: 1, 2: 1, 3: 3}
+        db.updates = []
+        self.assertTrue(PeopleLifecycle(db, "scm").refresh())
+        self.assertEqual(["DELETE", "DELETE", "INSERT", "INSERT"], db.updates)
+        self.assertEqual({1: ("2014-01-05", "2014-02-01", 3)}, db.lifecycle)
+
+    def test_lock(self):
+        locks = {}
+        other = FakeQuery(self.commits, self.identities, locks)
+        db = FakeQuery(self.commits, self.identities, locks)
+        with other.lock("db_test_people_lifecycle.people_lifecycle_scm"):
+            # Concurrent refresh
+            self.assertFalse(PeopleLifecycle(db, "scm").refresh())
+            self.assertEqual([], db.updates)
+        self.assertEqual({}, locks)
+        self.assertTrue(PeopleLifecycle(db, "scm").refresh())
+        self.assertEqual({}, locks)
+
+
+class FakeSCMQuery(SCMQuery, FakeQuery):
+    pass
+
+
+class TestContributorsNewGone(unittest.TestCase):
+
+    def setUp(self):
+        # People 1 and 2 are aliases of the same identity
+        self.commits = [(1, 1, "2013-06-01"), (2, 4, "2013-07-01"),
+                        (3, 2, "2014-03-01"), (4, 3, "2014-03-15")]
+        self.identities = {1: 1, 2: 1, 3: 3, 4: 4}
+        self.filters = MetricFilters("month", "'2013-01-01'", "'2014-04-01'", [])
+
+    def get_people(self, db, sql):
+        """ people_id of the identities in the new or gone people list """
+        if "FROM people_lifecycle_scm" in sql:
+            lifecycle = db.lifecycle
+        else:
+            self.assertTrue("GROUP BY pup.upeople_id" in sql)
+            lifecycle = db.get_lifecycle(0, len(db.commits))
+        (date, days) = re.search(r"DATE_SUB\('(.*?)', INTERVAL (\d+) DAY\)", sql).groups()
+        limit = datetime.strptime(date, "%Y-%m-%d") - timedelta(int(days))
+        limit = limit.strftime("%Y-%m-%d")
+        if "first_date >=" in sql:
+            upeople = [u for (u, (first, last, n)) in lifecycle.items()
+                       if limit <= first < date]
+        else:
+            upeople = [u for (u, (first, last, n)) in lifecycle.items() if last < limit]
+        return sorted([p for (p, u) in db.identities.items() if u in upeople])
+
+    def get_lists(self, locks):
+        db = FakeSCMQuery(self.commits, self.identities, locks)
+        study = ContributorsNewGoneSCM(db, self.filters)
+        return (self.get_people(db, study.GetNewPeopleListSQL(90)),
+                self.get_people(db, study.GetGonePeopleListSQL(180)),
+                self.get_people(db, study.GetNewPeopleTotalListSQL(90)))
+
+    def test_lists(self):
+        lists = self.get_lists({})
+        self.assertEqual(([3], [4], [3]), lists)
+        # The actions are aggregated if the table can't be refreshed
+        self.assertEqual(lists, self.get_lists({"db_test_people_lifecycle.people_lifecycle_scm": None}))
+
+
+if __name__ == "__main__":
+    unittest.main()
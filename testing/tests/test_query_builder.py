@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2014 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+# Authors:
+#         Alvaro del Castillo <acs@bitergia.com>
+#
+
+"""Tests for the generic query builder"""
+
+import sys
+import unittest
+from contextlib import contextmanager
+from datetime import datetime
+from decimal import Decimal
+
+for path in ['../../vizgrimoire', '../../vizgrimoire/metrics']:
+    if not path in sys.path:
+        sys.path.insert(0, path)
+
+import numpy
+from MySQLdb.constants import FIELD_TYPE
+
+from query_builder import DSQuery
+
+
+class FakeCursor(object):
+    """ Cursor returning rows, recording the sizes of the fetches """
+
+    def __init__(self, description, rows):
+        self.description = description
+        self.rows = rows
+        self.fetches = []
+
+    def execute(self, sql):
+        pass
+
+    def fetchmany(self, size):
+        self.fetches.append(size)
+        rows = self.rows[:size]
+        self.rows = self.rows[size:]
+        return rows
+
+    def close(self):
+        pass
+
+
+class FakePool(object):
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    @contextmanager
+    def connection(self):
+        yield self
+
+    def cursor(self):
+        return self._cursor
+
+
+class TestGetSQLTrends(unittest.TestCase):
+
+    def setUp(self):
+        self.db = DSQuery("root", "", "db_test_builder")
+        self.periods = [("last_7", "'2014-01-08'", "'2014-01-15'"),
+                        ("prev_7", "'2014-01-01'", "'2014-01-08'")]
+
+    def test_rewrite(self):
+        sql = self.db.GetSQLGlobal(" s.date ", "count(distinct(s.id)) as commits",
+                                   "scmlog s", "s.id IN (SELECT commit_id FROM actions)",
+                                   "'2014-01-01'", "'2014-01-15'")
+        sql = self.db.GetSQLTrends(sql, "'2014-01-01'", "'2014-01-15'", self.periods)
+        self.assertEqual("SELECT count(DISTINCT CASE WHEN  s.date >='2014-01-08' AND "
+                         " s.date <'2014-01-15' THEN (s.id) END) AS commits_last_7, "
+                         "count(DISTINCT CASE WHEN  s.date >='2014-01-01' AND "
+                         " s.date <'2014-01-08' THEN (s.id) END) AS commits_prev_7 "
+                         "FROM scmlog s WHERE  s.date >='2014-01-01' AND  s.date <'2014-01-15'"
+                         " AND s.id IN (SELECT commit_id FROM actions)", sql)
+
+    def test_not_supported(self):
+        fields = "count(distinct(s.id))/count(distinct(s.author_id)) as commits_author"
+        sql = self.db.GetSQLGlobal("s.date", fields, "scmlog s", "",
+                                   "'2014-01-01'", "'2014-01-15'")
+        self.assertIsNone(self.db.GetSQLTrends(sql, "'2014-01-01'", "'2014-01-15'",
+                                               self.periods))
+        sql = "SELECT COUNT(*) AS commits FROM scmlog WHERE date > '2014-01-01'"
+        self.assertIsNone(self.db.GetSQLTrends(sql, "'2014-01-01'", "'2014-01-15'",
+                                               self.periods))
+
+    def test_start_in_filters(self):
+        sql = self.db.GetSQLGlobal("ie.mod_date", "count(distinct(i.issue)) as merged",
+                                   "issues i", "i.submitted_on >= '2014-01-01'",
+                                   "'2014-01-01'", "'2014-01-15'")
+        self.assertIsNone(self.db.GetSQLTrends(sql, "'2014-01-01'", "'2014-01-15'",
+                                               self.periods))
+
+
+class TestExecuteQueryColumnar(unittest.TestCase):
+
+    description = (("id", FIELD_TYPE.LONG), ("time", FIELD_TYPE.NEWDECIMAL),
+                   ("date", FIELD_TYPE.DATETIME))
+
+    def setUp(self):
+        self.fetch_size = DSQuery._fetch_size
+        self.db = DSQuery("root", "", "db_test_builder")
+
+    def tearDown(self):
+        DSQuery._fetch_size = self.fetch_size
+
+    def execute(self, rows):
+        self.cursor = FakeCursor(self.description, rows)
+        self.db.pool = FakePool(self.cursor)
+        return self.db.ExecuteQueryColumnar("SELECT id, time, date FROM issues")
+
+    def test_types(self):
+        data = self.execute([(1, Decimal("0.50"), datetime(2014, 1, 1)),
+                             (2, None, datetime(2014, 1, 2))])
+        self.assertEqual(numpy.dtype('l'), data['id'].dtype)
+        self.assertEqual([1, 2], data['id'].tolist())
+        self.assertEqual(numpy.float64, data['time'].dtype)
+        self.assertEqual(0.5, data['time'][0])
+        self.assertTrue(numpy.isnan(data['time'][1]))
+        self.assertEqual(object, data['date'].dtype)
+        self.assertEqual(datetime(2014, 1, 2), data['date'][1])
+
+    def test_null_ints_chunks(self):
+        DSQuery._fetch_size = 2
+        rows = [(i, Decimal(i), datetime(2014, 1, i)) for i in range(1, 6)]
+        rows[3] = (None, Decimal(4), datetime(2014, 1, 4))
+        data = self.execute(rows)
+        self.assertEqual([2, 2, 2, 2], self.cursor.fetches)
+        # A NULL in the second chunk turns the ints already read into floats
+        self.assertEqual(numpy.float64, data['id'].dtype)
+        self.assertEqual([1.0, 2.0, 3.0], data['id'][:3].tolist())
+        self.assertTrue(numpy.isnan(data['id'][3]))
+        self.assertEqual(5.0, data['id'][4])
+        self.assertEqual([1.0, 2.0, 3.0, 4.0, 5.0], data['time'].tolist())
+
+    def test_single_and_no_rows(self):
+        data = self.execute([(7, Decimal("1.5"), datetime(2014, 1, 1))])
+        self.assertEqual([7], data['id'].tolist())
+        data = self.execute([])
+        self.assertEqual(0, len(data['id']))
+        self.assertEqual(numpy.dtype('l'), data['id'].dtype)
+        self.assertEqual(0, len(data['date']))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2014 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+# Authors:
+#         Alvaro del Castillo <acs@bitergia.com>
+#
+
+"""Tests for the persistent cache of query results"""
+
+import os
+import shutil
+import signal
+import sys
+import tempfile
+import unittest
+
+for path in ['../../vizgrimoire', '../../vizgrimoire/metrics']:
+    if not path in sys.path:
+        sys.path.insert(0, path)
+
+from query_cache import QueryCache
+
+
+class FakeDB(object):
+    """ Answers the information_schema queries and counts the others """
+
+    def __init__(self):
+        self.tables = {('db', 'scmlog'): ['2014-01-01 00:00:00', None],
+                       ('db', 'actions'): [None, 100],
+                       ('ids', 'upeople'): [None, None],
+                       ('db', 'action_files'): 'VIEW'}
+        self.max_id = {('ids', 'upeople'): 10}
+        self.executed = []
+
+    def execute(self, sql):
+        if 'table_type' in sql:
+            res = {'table_schema': [], 'table_name': [], 'table_type': []}
+            for (schema, table) in self.tables:
+                if "'" + schema + "'" not in sql: continue
+                res['table_schema'].append(schema)
+                res['table_name'].append(table)
+                view = self.tables[(schema, table)] == 'VIEW'
+                res['table_type'].append('VIEW' if view else 'BASE TABLE')
+            return res
+        if 'update_time' in sql:
+            res = {'table_schema': [], 'table_name': [],
+                   'update_time': [], 'auto_increment': []}
+            for (schema, table) in self.tables:
+                if "table_name='%s'" % table not in sql: continue
+                res['table_schema'].append(schema)
+                res['table_name'].append(table)
+                res['update_time'].append(self.tables[(schema, table)][0])
+                res['auto_increment'].append(self.tables[(schema, table)][1])
+            return res
+        if 'MAX(id)' in sql:
+            for table in self.max_id:
+                if "%s.%s" % table in sql: return {'max_id': self.max_id[table]}
+            raise Exception("Unknown column 'id'")
+        self.executed.append(sql)
+        return {'commits': len(self.executed)}
+
+
+class TestQueryCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_path = tempfile.mkdtemp(prefix='query_cache_')
+        self.cache = QueryCache(os.path.join(self.tmp_path, 'cache.db'),
+                                max_entries=2, tables_ttl=0)
+        self.db = FakeDB()
+
+    def tearDown(self):
+        self.cache.close()
+        shutil.rmtree(self.tmp_path)
+
+    def test_get_tables(self):
+        sql = """SELECT COUNT(s.id) FROM scmlog s, ids.upeople u
+                 WHERE s.id IN (SELECT commit_id FROM actions)"""
+        tables = self.cache.get_tables(sql, 'db', self.db.execute)
+        self.assertEqual([('db', 'actions'), ('db', 'scmlog'), ('ids', 'upeople')],
+                         tables)
+        sql = "SELECT COUNT(*) FROM action_files"
+        self.assertIsNone(self.cache.get_tables(sql, 'db', self.db.execute))
+
+    def test_hit(self):
+        sql = "SELECT COUNT(s.id) AS commits FROM scmlog s"
+        res1 = self.cache.execute('db', sql, self.db.execute)
+        res2 = self.cache.execute('db', "SELECT  COUNT(s.id) AS commits\n FROM scmlog s",
+                                  self.db.execute)
+        self.assertEqual(res1, res2)
+        self.assertEqual(1, len(self.db.executed))
+        self.cache.execute('other', sql, self.db.execute)
+        self.assertEqual(2, len(self.db.executed))
+
+    def test_normalize_sql(self):
+        sql = "SELECT  COUNT(*)\n FROM people WHERE name = 'John  Smith' "
+        self.assertEqual("SELECT COUNT(*) FROM people WHERE name = 'John  Smith'",
+                         QueryCache.normalize_sql(sql))
+        for (name1, name2) in [("'John  Smith'", "'John Smith'"),
+                               ('"a\\"  b"', '"a\\" b"'),
+                               ("'it''s  me'", "'it''s me'")]:
+            sql = "SELECT COUNT(*) FROM people WHERE name = %s"
+            self.assertNotEqual(QueryCache.get_key('db', sql % name1),
+                                QueryCache.get_key('db', sql % name2))
+
+    def test_invalidation(self):
+        sql = "SELECT COUNT(a.id) AS commits FROM actions a, ids.upeople u"
+        self.cache.execute('db', sql, self.db.execute)
+        self.db.tables[('db', 'actions')][1] = 101
+        self.cache.execute('db', sql, self.db.execute)
+        self.db.max_id[('ids', 'upeople')] = 11
+        self.cache.execute('db', sql, self.db.execute)
+        self.cache.execute('db', sql, self.db.execute)
+        self.assertEqual(3, len(self.db.executed))
+
+    def test_invalidate_forked(self):
+        sql = "SELECT COUNT(s.id) AS commits FROM scmlog s"
+        self.cache.execute('db', sql, self.db.execute)
+        # Lock held by other thread of the parent when forking
+        self.cache._lock.acquire()
+        pid = os.fork()
+        if pid == 0:
+            signal.alarm(5)
+            self.cache.invalidate('db', 'scmlog')
+            self.cache.close()
+            os._exit(0)
+        status = os.waitpid(pid, 0)[1]
+        self.cache._lock.release()
+        self.assertEqual(0, status)
+        self.cache.execute('db', sql, self.db.execute)
+        self.assertEqual(2, len(self.db.executed))
+
+    def test_not_cacheable(self):
+        for sql in ["SELECT COUNT(*) FROM action_files",
+                    "SELECT COUNT(*) FROM scmlog WHERE date > NOW()",
+                    "DELETE FROM scmlog"]:
+            self.cache.execute('db', sql, self.db.execute)
+            self.cache.execute('db', sql, self.db.execute)
+        self.assertEqual(6, len(self.db.executed))
+
+    def test_lru(self):
+        queries = ["SELECT %i FROM scmlog" % i for i in range(0, 3)]
+        for sql in queries:
+            self.cache.execute('db', sql, self.db.execute)
+        # The first query was evicted
+        self.cache.execute('db', queries[2], self.db.execute)
+        self.assertEqual(3, len(self.db.executed))
+        self.cache.execute('db', queries[0], self.db.execute)
+        self.assertEqual(4, len(self.db.executed))
+
+
+if __name__ == "__main__":
+    unittest.main()
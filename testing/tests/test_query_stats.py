@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2014 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+# Authors:
+#         Alvaro del Castillo <acs@bitergia.com>
+#
+
+"""Tests for the stats of the queries run"""
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+for path in ['../../vizgrimoire', '../../vizgrimoire/metrics']:
+    if not path in sys.path:
+        sys.path.insert(0, path)
+
+from query_stats import QueryStats
+
+
+class Metrics(object):
+    """ Runs queries like a metric would """
+
+    def __init__(self, stats):
+        self.stats = stats
+
+    def get_agg(self, sql, result):
+        return self.stats.execute('db', sql, lambda sql: result,
+                                  lambda sql: {'table': 'scmlog', 'rows': 10})
+
+
+class TestQueryStats(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_path = tempfile.mkdtemp(prefix='query_stats_')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_path)
+
+    def test_fingerprint(self):
+        sql = """SELECT count(*) FROM scmlog s
+                 WHERE s.date >= '2014-01-01' AND s.id IN (1, 2,3) LIMIT 10"""
+        self.assertEqual("SELECT count(*) FROM scmlog s WHERE s.date >= ? "
+                         "AND s.id IN (?+) LIMIT ?", QueryStats.get_fingerprint(sql))
+
+    def test_execute(self):
+        stats = QueryStats(self.tmp_path, slow_time = 0, explain = True)
+        metric = Metrics(stats)
+        result = {'name': ['a', 'bc'], 'commits': [1, 2]}
+        self.assertEqual(result, metric.get_agg("SELECT 1 FROM s WHERE id=1", result))
+        metric.get_agg("SELECT 1 FROM s WHERE id=2", {'commits': 3})
+        stats.execute('db', "CREATE VIEW v AS SELECT 1", lambda sql: None)
+
+        summary = stats.get_summary()
+        self.assertEqual(2, len(summary))
+        query = [s for s in summary if s['fingerprint'].startswith('SELECT')][0]
+        self.assertEqual(2, query['count'])
+        self.assertEqual(3, query['rows'])
+        self.assertEqual(3 + 8 * 3, query['bytes'])
+        self.assertEqual({'Metrics.get_agg': 2}, query['callers'])
+
+        # Only the first slow query of each fingerprint is explained
+        self.assertTrue('explain' in stats.slow_queries[0])
+        self.assertFalse('explain' in stats.slow_queries[1])
+
+        stats.write()
+        summary = json.load(open(os.path.join(self.tmp_path, 'query_stats.json')))
+        self.assertEqual(2, len(summary))
+        log = open(os.path.join(self.tmp_path, 'slow_queries.log')).read()
+        self.assertEqual(3, log.count('# Query_time'))
+        self.assertTrue('# EXPLAIN: rows\ttable\n# EXPLAIN: 10\tscmlog' in log)
+
+    def test_forked_processes(self):
+        stats = QueryStats(self.tmp_path, slow_time = 0)
+        metric = Metrics(stats)
+        metric.get_agg("SELECT 1 FROM s WHERE id=1", {'commits': 1})
+        pid = os.fork()
+        if pid == 0:
+            # Like a report worker
+            stats.reset()
+            metric.get_agg("SELECT 1 FROM s WHERE id=2", {'commits': 2})
+            metric.get_agg("SELECT 2 FROM s", {'commits': 3})
+            stats.write()
+            os._exit(0)
+        os.waitpid(pid, 0)
+        self.assertEqual(['query_stats.%i.json' % pid, 'slow_queries.%i.log' % pid],
+                         sorted(os.listdir(self.tmp_path)))
+
+        stats.write()
+        self.assertEqual(['query_stats.json', 'slow_queries.log'],
+                         sorted(os.listdir(self.tmp_path)))
+        summary = json.load(open(os.path.join(self.tmp_path, 'query_stats.json')))
+        counts = dict([(s['fingerprint'], s['count']) for s in summary])
+        self.assertEqual({'SELECT ? FROM s WHERE id=?': 2, 'SELECT ? FROM s': 1}, counts)
+        log = open(os.path.join(self.tmp_path, 'slow_queries.log')).read()
+        self.assertEqual(3, log.count('# Query_time'))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2014 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+# Authors:
+#         Alvaro del Castillo <acs@bitergia.com>
+#
+
+"""Tests for the evolutionary Territoriality"""
+
+import json
+import sys
+import unittest
+
+for path in ['../../vizgrimoire', '../../vizgrimoire/metrics',
+             '../../vizgrimoire/analysis']:
+    if not path in sys.path:
+        sys.path.insert(0, path)
+
+from metrics_filter import MetricFilters
+from query_builder import DSQuery
+from territoriality import Territoriality
+
+
+class FakeQuery(DSQuery):
+    """ Query builder with two repositories and their code actions """
+
+    def __init__(self):
+        self.database = "db_test_territoriality"
+        # month, file, person, repository
+        self.actions = [(24169, 10, 1, 1), (24169, 11, 1, 1),
+                        (24170, 11, 2, 1), (24170, 11, 1, 1),
+                        (24171, 10, 3, 2)]
+
+    def ExecuteQuery(self, sql):
+        return {"id": [1, 2], "name": ["nova.git", "swift.git"]}
+
+    def ExecuteQueryStream(self, sql):
+        return iter(self.actions)
+
+
+class TestTerritoriality(unittest.TestCase):
+
+    def setUp(self):
+        self.filters = MetricFilters("month", "'2014-01-01'", "'2014-04-01'", [])
+
+    def test_evol(self):
+        ts = Territoriality(FakeQuery(), self.filters).result_evol()
+        self.assertEqual([24169, 24170, 24171], ts['month'])
+        self.assertEqual([2, 1, 2], ts['territorial_files'])
+        self.assertEqual([2, 2, 3], ts['total_files'])
+        nova = ts['territoriality_repositories']['nova.git']
+        self.assertEqual([2, 1, 1], nova['territorial_files'])
+        self.assertEqual([1.0, 0.5, 0.5], nova['territoriality'])
+        swift = ts['territoriality_repositories']['swift.git']
+        self.assertEqual([0, 0, 1], swift['total_files'])
+        self.assertEqual([0, 0, 1.0], swift['territoriality'])
+
+    def test_scm_evolutionary_unchanged(self):
+        # SCM merges the studies get_ts with its metrics evolutionary data
+        metrics = json.load(open("../json/scm-evolutionary.json"))
+        studies = Territoriality(FakeQuery(), self.filters).get_ts(None)
+        evol = dict(metrics.items() + studies.items())
+        self.assertEqual(metrics, evol)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -31,6 +31,7 @@ from os.path import isfile, join
 import sys
 
 import locale
+import math
 import numpy as np
 from datetime import datetime
 
@@ -201,11 +202,8 @@ def its_report(dbcon, filters, sloc):
     #vizr.SetDBChannel(database=dbcon.database, user=dbcon.user, password=dbcon.password)
     #vizr.ReportTimeToCloseITS("bugzilla", "./")
     timeto = its.TimeToClose(dbcon, filters)
-    timeto_list = timeto.get_agg()
-    if not isinstance(timeto_list["timeto"], list):
-        timeto_list["timeto"] = [int(timeto_list["timeto"])]
-    dhesa = DHESA(timeto_list["timeto"])
-    its_fix_med_1m = dhesa.data["median"]
+    its_fix_med_1m = timeto.get_agg()["timeto_median"]
+    if math.isnan(its_fix_med_1m): its_fix_med_1m = 0
     its_fix_med_1m = its_fix_med_1m / 3600.0
     its_fix_med_1m = round(its_fix_med_1m / 24.0, 2)
 
@@ -36,8 +36,11 @@ def get_evol_report(startdate, enddate, identities_db):
 
 def create_evol_report(startdate, enddate, destdir, identities_db):
     for ds in Report.get_data_sources():
-        Report.connect_ds(ds)
-        ds.create_evolutionary_report (period, startdate, enddate, destdir, identities_db)
+        create_evol_report_ds(ds, startdate, enddate, destdir, identities_db)
+
+def create_evol_report_ds(ds, startdate, enddate, destdir, identities_db):
+    Report.connect_ds(ds)
+    ds.create_evolutionary_report (period, startdate, enddate, destdir, identities_db)
 
 def get_agg_report(startdate, enddate, identities_db):
     all_ds = {}
@@ -49,8 +52,11 @@ def get_agg_report(startdate, enddate, identities_db):
 
 def create_agg_report(startdate, enddate, destdir, identities_db):
     for ds in Report.get_data_sources():
-        Report.connect_ds(ds)
-        ds.create_agg_report (period, startdate, enddate, destdir, identities_db)
+        create_agg_report_ds(ds, startdate, enddate, destdir, identities_db)
+
+def create_agg_report_ds(ds, startdate, enddate, destdir, identities_db):
+    Report.connect_ds(ds)
+    ds.create_agg_report (period, startdate, enddate, destdir, identities_db)
 
 def get_top_report(startdate, enddate, identities_db, npeople):
     all_ds_top = {}
@@ -63,28 +69,41 @@ def get_top_report(startdate, enddate, identities_db, npeople):
 
 def create_top_report(startdate, enddate, destdir, npeople, identities_db):
     for ds in Report.get_data_sources():
-        logging.info("Creating TOP for " + ds.get_name())
-        Report.connect_ds(ds)
-        ds.create_top_report (startdate, enddate, destdir, npeople, identities_db)
+        create_top_report_ds(ds, startdate, enddate, destdir, npeople, identities_db)
+
+def create_top_report_ds(ds, startdate, enddate, destdir, npeople, identities_db):
+    logging.info("Creating TOP for " + ds.get_name())
+    Report.connect_ds(ds)
+    ds.create_top_report (startdate, enddate, destdir, npeople, identities_db)
 
 def create_reports_filters(period, startdate, enddate, destdir, npeople, identities_db):
     for ds in Report.get_data_sources():
-        Report.connect_ds(ds)
-        logging.info("Creating filter reports for " + ds.get_name())
-        for filter_ in Report.get_filters():
-            logging.info("-> " + filter_.get_name())
-            if filter_.get_name() in ["people2","company_off"]:
-                logging.info("---> Using new filter API")
-                ds.create_filter_report_all(filter_, period, startdate, enddate, 
-                                            destdir, npeople, identities_db)
-            else:
-                ds.create_filter_report(filter_, period, startdate, enddate, destdir, npeople, identities_db)
+        create_reports_filters_ds(ds, period, startdate, enddate, destdir, npeople, identities_db)
+
+def create_reports_filters_ds(ds, period, startdate, enddate, destdir, npeople, identities_db):
+    from data_source import DataSource
+
+    Report.connect_ds(ds)
+    logging.info("Creating filter reports for " + ds.get_name())
+    for filter_ in Report.get_filters():
+        logging.info("-> " + filter_.get_name())
+        if filter_.get_name() in ["people2","company_off"]:
+            # All items are generated at once, only once for all shards
+            if not DataSource.is_first_shard(): continue
+            logging.info("---> Using new filter API")
+            ds.create_filter_report_all(filter_, period, startdate, enddate, 
+                                        destdir, npeople, identities_db)
+        else:
+            ds.create_filter_report(filter_, period, startdate, enddate, destdir, npeople, identities_db)
 
 def create_report_people(startdate, enddate, destdir, npeople, identities_db):
     for ds in Report.get_data_sources():
-        Report.connect_ds(ds)
-        logging.info("Creating people for " + ds.get_name())
-        ds().create_people_report(period, startdate, enddate, destdir, npeople, identities_db)
+        create_report_people_ds(ds, startdate, enddate, destdir, npeople, identities_db)
+
+def create_report_people_ds(ds, startdate, enddate, destdir, npeople, identities_db):
+    Report.connect_ds(ds)
+    logging.info("Creating people for " + ds.get_name())
+    ds().create_people_report(period, startdate, enddate, destdir, npeople, identities_db)
 
 def create_reports_r(enddate, destdir):
     from rpy2.robjects.packages import importr
@@ -130,6 +149,10 @@ def create_people_identifiers(startdate, enddate, destdir):
     createJSON(people_data, destdir+"/people.json")
 
 def create_reports_studies(period, startdate, enddate, destdir):
+    for ds in Report.get_data_sources():
+        create_reports_studies_ds(ds, period, startdate, enddate, destdir)
+
+def create_reports_studies_ds(ds, period, startdate, enddate, destdir):
     from metrics_filter import MetricFilters
 
     db_identities= Report.get_config()['generic']['db_identities']
@@ -140,22 +163,186 @@ def create_reports_studies(period, startdate, enddate, destdir):
 
     metric_filters = MetricFilters(period, startdate, enddate, [])
 
+    ds_dbname = ds.get_db_name()
+    dbname = Report.get_config()['generic'][ds_dbname]
+    dsquery = ds.get_query_builder()
+    dbcon = dsquery(dbuser, dbpass, dbname, db_identities)
+    # logging.info(ds.get_name() + " studies active " + str(studies))
+    for study in studies:
+        # logging.info("Creating report for " + study.id + " for " + ds.get_name())
+        try:
+            obj = study(dbcon, metric_filters)
+            obj.create_report(ds, destdir)
+        except TypeError:
+            import traceback
+            logging.info(study.id + " does no support standard API. Not used.")
+            traceback.print_exc(file=sys.stdout)
+            continue
+
+def merge_reports_filters_ds(ds, destdir, parts):
+    """ Merge the items lists created by the parts of the filters stage """
+    from data_source import DataSource
+
+    for filter_ in Report.get_filters():
+        if filter_.get_name() in ["people2","company_off"]: continue
+        fn = os.path.join(destdir, filter_.get_filename(ds()))
+        DataSource.merge_items_list(fn, Report.get_shard(), parts)
+
+# Stages of the report, in the order they are run without --jobs
+report_stages = ['evol', 'agg', 'top', 'people', 'people_identifiers',
+                 'filters', 'filters_merge', 'studies']
+# Stages of a data source that must be finished before running a stage
+report_stages_deps = {'people': ['top'], 'filters_merge': ['filters']}
+
+def create_report_stage(ds, stage, part, params):
+    """ Create the report of one stage for a data source """
+    startdate = params['startdate']
+    enddate = params['enddate']
+    destdir = params['destdir']
+    npeople = params['npeople']
+    identities_db = params['identities_db']
+
+    if stage == 'evol':
+        create_evol_report_ds(ds, startdate, enddate, destdir, identities_db)
+    elif stage == 'agg':
+        create_agg_report_ds(ds, startdate, enddate, destdir, identities_db)
+    elif stage == 'top':
+        create_top_report_ds(ds, startdate, enddate, destdir, npeople, identities_db)
+    elif stage == 'people':
+        create_report_people_ds(ds, startdate, enddate, destdir, npeople, identities_db)
+    elif stage == 'people_identifiers':
+        create_people_identifiers(startdate, enddate, destdir)
+    elif stage == 'filters':
+        # Each part creates the filters reports for a subset of the items
+        Report.set_shard_part(part)
+        try:
+            create_reports_filters_ds(ds, params['period'], startdate, enddate,
+                                      destdir, npeople, identities_db)
+        finally:
+            Report.set_shard_part(None)
+    elif stage == 'filters_merge':
+        merge_reports_filters_ds(ds, destdir, params['filters_parts'])
+    elif stage == 'studies':
+        create_reports_studies_ds(ds, params['period'], startdate, enddate, destdir)
+    else:
+        raise Exception("Unknown report stage " + stage)
+
+def get_report_tasks(stages, filters_parts = 1):
+    """ Return the (data source, stage, part) tasks with the tasks each one needs
+
+    The filters stage is split in filters_parts tasks, each one creating the
+    reports for a part of the items, followed by a filters_merge task.
+    """
+    if 'filters' in stages and filters_parts > 1:
+        stages = stages + ['filters_merge']
+    tasks = {}
     for ds in Report.get_data_sources():
-        ds_dbname = ds.get_db_name()
-        dbname = Report.get_config()['generic'][ds_dbname]
-        dsquery = ds.get_query_builder()
-        dbcon = dsquery(dbuser, dbpass, dbname, db_identities)
-        # logging.info(ds.get_name() + " studies active " + str(studies))
-        for study in studies:
-            # logging.info("Creating report for " + study.id + " for " + ds.get_name())
+        ds_tasks = {}
+        for stage in stages:
+            # people identifiers are gathered only from scm
+            if stage == 'people_identifiers' and ds.get_name() != "scm": continue
+            if stage == 'filters' and filters_parts > 1:
+                parts = [(part, filters_parts) for part in range(1, filters_parts + 1)]
+            else:
+                parts = [None]
+            ds_tasks[stage] = [(ds.get_name(), stage, part) for part in parts]
+        for stage in ds_tasks:
+            deps = []
+            for dep in report_stages_deps.get(stage, []):
+                deps += ds_tasks.get(dep, [])
+            for task in ds_tasks[stage]:
+                tasks[task] = deps
+    return tasks
+
+def init_report_worker():
+    """ Each worker process opens its own connections to the databases """
+    import signal
+    import GrimoireSQL
+
+    # Ctrl-C is managed by the main process
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    GrimoireSQL.dbpool = {}
+    GrimoireSQL.cursor = None
+    Report.reset_query_stats()
+    # The logging from all workers goes to the same stream
+    for handler in logging.getLogger().handlers:
+        handler.setFormatter(logging.Formatter('%(asctime)s [%(processName)s] %(message)s'))
+
+def run_report_task(ds_name, stage, part, params):
+    """ Run a task in a worker returning (task, error traceback) """
+    import traceback
+
+    task = (ds_name, stage, part)
+    name = ds_name + " " + stage
+    if part is not None: name += " %i/%i" % part
+    start = time.time()
+    logging.info("Starting " + name)
+    try:
+        ds = Report.get_data_source(ds_name)
+        create_report_stage(ds, stage, part, params)
+    except:
+        return (task, traceback.format_exc())
+    # Worker processes don't close the Report
+    Report.write_query_stats()
+    logging.info("Finished %s in %.2f secs" % (name, time.time() - start))
+    return (task, None)
+
+def get_pool_workers(pool):
+    """ pids of the workers alive in a multiprocessing pool """
+    return set([worker.pid for worker in pool._pool if worker.exitcode is None])
+
+def run_report_tasks(tasks, params, jobs):
+    """ Run the tasks in a pool of jobs processes, stopping at the first error
+
+    The pool replaces a worker that dies, killed by a signal for example,
+    but its task is never finished: the run is stopped if it happens.
+    """
+    from multiprocessing import Pool
+    import Queue
+
+    logging.info("Running %i report tasks in %i processes" % (len(tasks), jobs))
+    pool = Pool(jobs, init_report_worker)
+    workers = get_pool_workers(pool)
+    finished = Queue.Queue()
+    pending = dict(tasks)
+    running = set()
+    done = set()
+
+    try:
+        while len(pending) > 0 or len(running) > 0:
+            # Tasks are queued following the order of the report stages
+            for task in sorted(pending.keys(),
+                               key=lambda t: (report_stages.index(t[1]), t[0], t[2])):
+                if [dep for dep in pending[task] if dep not in done]: continue
+                del pending[task]
+                running.add(task)
+                pool.apply_async(run_report_task, task + (params,),
+                                 callback=finished.put)
             try:
-                obj = study(dbcon, metric_filters)
-                obj.create_report(ds, destdir)
-            except TypeError:
-                import traceback
-                logging.info(study.id + " does no support standard API. Not used.")
-                traceback.print_exc(file=sys.stdout)
+                task, error = finished.get(True, 1)
+            except Queue.Empty:
+                died = workers - get_pool_workers(pool)
+                if len(died) > 0:
+                    logging.error("Report workers %s died. Tasks running: %s" %
+                                  (sorted(died), sorted(running)))
+                    pool.terminate()
+                    pool.join()
+                    sys.exit(1)
                 continue
+            if error is not None:
+                logging.error("Report task %s %s failed:\n%s" % (task[0], task[1], error))
+                pool.terminate()
+                pool.join()
+                sys.exit(1)
+            running.remove(task)
+            done.add(task)
+    except KeyboardInterrupt:
+        pool.terminate()
+        pool.join()
+        raise
+
+    pool.close()
+    pool.join()
 
 def set_data_source(ds_name):
     ds_ok = False
@@ -209,6 +396,17 @@ def set_study(study_id):
         logging.error(study_id + " study not available ")
         sys.exit(1)
 
+def set_shard(shard):
+    try:
+        shard, shards = [int(i) for i in shard.split("/")]
+    except ValueError:
+        shard, shards = 0, 0
+    if shards < 1 or shard < 1 or shard > shards:
+        logging.error(opts.shard + " is not a valid shard. Format: i/N with 1 <= i <= N")
+        sys.exit(1)
+    logging.info("Creating filters items for shard %i of %i" % (shard, shards))
+    Report.set_shard((shard, shards))
+
 def init_env():
     grimoirelib = os.path.join("..","vizgrimoire")
     metricslib = os.path.join("..","vizgrimoire","metrics")
@@ -269,23 +467,45 @@ if __name__ == '__main__':
         set_metric(opts.metric, opts.data_source)
     if (opts.study):
         set_study(opts.study)
-
-    if not opts.filter and not opts.study:
-        logging.info("Creating global evolution metrics...")
-        evol = create_evol_report(startdate, enddate, opts.destdir, identities_db)
-        logging.info("Creating global aggregated metrics...")
-        agg = create_agg_report(startdate, enddate, opts.destdir, identities_db)
-        if not opts.metric:
-            logging.info("Creating global top metrics...")
-            top = create_top_report(startdate, enddate, opts.destdir, opts.npeople, identities_db)
-            if (automator['r']['reports'].find('people')>-1):
-                create_report_people(startdate, enddate, opts.destdir, opts.npeople, identities_db)
-            # create_reports_r(end_date, opts.destdir)
-            create_people_identifiers(startdate, enddate, opts.destdir)
-
-    if not opts.study and not opts.no_filters and not opts.metric:
-        create_reports_filters(period, startdate, enddate, opts.destdir, opts.npeople, identities_db)
-    if not opts.filter and not opts.metric and not opts.item:
-        create_reports_studies(period, startdate, enddate, opts.destdir)
-
+    if (opts.shard):
+        set_shard(opts.shard)
+
+    jobs = int(opts.jobs)
+    if jobs > 1:
+        stages = []
+        if not opts.filter and not opts.study:
+            stages += ['evol', 'agg']
+            if not opts.metric:
+                stages += ['top']
+                if (automator['r']['reports'].find('people')>-1):
+                    stages += ['people']
+                stages += ['people_identifiers']
+        if not opts.study and not opts.no_filters and not opts.metric:
+            stages += ['filters']
+        if not opts.filter and not opts.metric and not opts.item:
+            stages += ['studies']
+        params = {'period': period, 'startdate': startdate, 'enddate': enddate,
+                  'destdir': opts.destdir, 'npeople': opts.npeople,
+                  'identities_db': identities_db, 'filters_parts': jobs}
+        run_report_tasks(get_report_tasks(stages, jobs), params, jobs)
+    else:
+        if not opts.filter and not opts.study:
+            logging.info("Creating global evolution metrics...")
+            evol = create_evol_report(startdate, enddate, opts.destdir, identities_db)
+            logging.info("Creating global aggregated metrics...")
+            agg = create_agg_report(startdate, enddate, opts.destdir, identities_db)
+            if not opts.metric:
+                logging.info("Creating global top metrics...")
+                top = create_top_report(startdate, enddate, opts.destdir, opts.npeople, identities_db)
+                if (automator['r']['reports'].find('people')>-1):
+                    create_report_people(startdate, enddate, opts.destdir, opts.npeople, identities_db)
+                # create_reports_r(end_date, opts.destdir)
+                create_people_identifiers(startdate, enddate, opts.destdir)
+
+        if not opts.study and not opts.no_filters and not opts.metric:
+            create_reports_filters(period, startdate, enddate, opts.destdir, opts.npeople, identities_db)
+        if not opts.filter and not opts.metric and not opts.item:
+            create_reports_studies(period, startdate, enddate, opts.destdir)
+
+    Report.close()
     logging.info("Report data source analysis OK")
@@ -118,6 +118,15 @@ def read_options():
                       action="store",
                       dest="metric",
                       help="Select metric from data source to be generated.")
+    parser.add_option("-j", "--jobs",
+                      action="store",
+                      dest="jobs",
+                      default="1",
+                      help="Number of processes used to generate data sources stages in parallel")
+    parser.add_option("--shard",
+                      action="store",
+                      dest="shard",
+                      help="Generate only the filters items of shard i/N, to split the report among N hosts")
 
     (opts, args) = parser.parse_args()
 
@@ -81,11 +81,10 @@ class DownloadsDS(DataSource):
                 # Tendencies
                 metrics_trends = DownloadsDS.get_metrics_core_trends()
 
-                for i in [7,30,365]:
-                    for item in all_metrics:
-                        if item.id not in metrics_trends: continue
-                        period_data = item.get_trends(enddate, i)
-                        data = dict(data.items() +  period_data.items())
+                for item in all_metrics:
+                    if item.id not in metrics_trends: continue
+                    period_data = item.get_trends_multi(enddate, [7,30,365])
+                    data = dict(data.items() +  period_data.items())
 
         if filter_ is not None: studies = {}
         else:
@@ -28,8 +28,13 @@ import re, sys
 
 # global vars to be moved to specific classes
 cursor = None
+cursor_db = None # database used by cursor
 # one connection per database
 dbpool = {}
+# QueryCache for ExecuteQuery results, None if disabled
+query_cache = None
+# QueryStats recording ExecuteQuery stats, None if disabled
+query_stats = None
 
 ##########
 #Generic functions to obtain FROM and WHERE clauses per type of report
@@ -97,8 +102,8 @@ def GetSQLPeriod(period, date, fields, tables, filters, start, end):
     # kind = ['year','month','week','day']
     iso_8601_mode = 3
     if (period == 'day'):
-        # Remove time so unix timestamp is start of day    
-        sql = 'SELECT UNIX_TIMESTAMP(DATE('+date+')) AS unixtime, '
+        # Remove time so unix timestamp is start of day (UTC)
+        sql = "SELECT TIMESTAMPDIFF(SECOND, '1970-01-01', DATE("+date+")) AS unixtime, "
     elif (period == 'week'):
         sql = 'SELECT YEARWEEK('+date+','+str(iso_8601_mode)+') AS week, '
     elif (period == 'month'):
@@ -216,6 +221,7 @@ def SetDBChannel (user=None, password=None, database=None,
                   host="127.0.0.1", port=3306, group=None):
     global cursor
     global dbpool
+    global cursor_db
 
     db = None
 
@@ -227,12 +233,34 @@ def SetDBChannel (user=None, password=None, database=None,
                                  db=database, host=host, port=port)
         else:
             db = MySQLdb.connect(read_default_group=group, db=database)
+        # See the rows written by the query builders connections
+        db.autocommit(True)
         dbpool[database] = db
 
     cursor = db.cursor()
     cursor.execute("SET NAMES 'utf8'")
+    cursor_db = database
+
+def SetQueryCache (cache):
+    global query_cache
+    query_cache = cache
+
+def SetQueryStats (stats):
+    global query_stats
+    query_stats = stats
 
 def ExecuteQuery (sql):
+    if query_stats is not None:
+        return query_stats.execute(cursor_db, sql, _ExecuteCachedQuery,
+                                   _ExecuteQuery)
+    return _ExecuteCachedQuery(sql)
+
+def _ExecuteCachedQuery (sql):
+    if query_cache is not None and cursor_db is not None:
+        return query_cache.execute(cursor_db, sql, _ExecuteQuery)
+    return _ExecuteQuery(sql)
+
+def _ExecuteQuery (sql):
     result = {}
     cursor.execute(sql)
     rows = cursor.rowcount
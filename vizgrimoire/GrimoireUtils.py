@@ -23,6 +23,7 @@
 # Misc utils
 
 import calendar
+import heapq
 from ConfigParser import SafeConfigParser
 from datetime import datetime, timedelta
 from dateutil.relativedelta import relativedelta
@@ -33,7 +34,8 @@ import math
 import rpy2.rinterface as rinterface
 from rpy2.robjects.vectors import StrVector
 import os,sys
-from numpy import average, median
+import numpy
+from numpy import average, median, ndarray
 
 def valRtoPython(val):
     if val is rinterface.NA_Character: val = None
@@ -63,7 +65,10 @@ def createTimeSeries(ts_data):
 def checkListArray(data):
     data_vars = data.keys()
     for key in (data_vars):
-        if not isinstance(data[key], (list)):
+        if isinstance(data[key], ndarray):
+            # Columnar results from DSQuery.ExecuteQueryColumnar
+            data[key] = data[key].tolist()
+        elif not isinstance(data[key], (list)):
             data[key] = [data[key]]
 
 # NaN converted to 0
@@ -76,72 +81,84 @@ def cleanNaN(ts_data):
     return ts_data
 
 
-def completePeriodIdsYears(ts_data, start, end):
-    data_vars = ts_data.keys()
-    new_ts_data =  createTimeSeries(ts_data)
-    checkListArray(ts_data)
+# Month names used in dates labels, independent of the locale
+month_names = ["Jan", "Feb", "Mar", "Apr", "May", "Jun",
+               "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
 
-    start_year = start.year * 12
-    years = end.year - start.year
+# Field with the period id of each row in the time series from SQL
+period_fields = {"day": "unixtime", "week": "week", "month": "month", "year": "year"}
 
+def getPeriodAxis(period, start, end):
+    """ Period ids, unixtimes and dates labels of all periods in [start, end] """
+    periods = []
+    dates = []
 
-    for i in range(0, years+1):
-        if (start_year+(i*12) in ts_data['year']) is False:
-            # Add new time point with all vars to zero
-            for key in (data_vars):
-                new_ts_data[key].append(0)
-            new_ts_data['year'].pop()
-            new_ts_data['year'].append(start_year+(i*12))
-        else:
-            # Add already existing data for the time point
-            index = ts_data['year'].index(start_year+(i*12))
-            for key in (data_vars):
-                new_ts_data[key].append(ts_data[key][index])
-
-        current =  start + relativedelta(years=i)
-        timestamp = calendar.timegm(current.timetuple())
-        new_ts_data['unixtime'].append(unicode(timestamp))
-        new_ts_data['id'].append(i)
-        new_ts_data['date'].append(datetime.strftime(current, "%b %Y"))
+    if period == "year":
+        start_year = start.year * 12
+        for i in range(0, end.year - start.year + 1):
+            periods.append(start_year + (i * 12))
+            dates.append(start + relativedelta(years=i))
+    elif period == "month":
+        start_month = start.year*12 + start.month
+        end_month = end.year*12 + end.month
+        # All data is from the complete month
+        start = start - timedelta(days=(start.day-1))
+        for i in range(0, end_month - start_month + 1):
+            periods.append(start_month + i)
+            dates.append(start + relativedelta(months=i))
+    elif period == "week":
+        # Start of the week
+        dayweek = start.isocalendar()[2]
+        new_week = start - relativedelta(days=dayweek-1)
+        while (new_week <= end):
+            periods.append(int(date2Week(new_week)))
+            dates.append(new_week)
+            new_week = new_week + relativedelta(weeks=1)
+    elif period == "day":
+        day = datetime(start.year, start.month, start.day)
+        while (day <= end):
+            periods.append(calendar.timegm(day.timetuple()))
+            dates.append(day)
+            day = day + timedelta(days=1)
+    else:
+        return None
 
-    return new_ts_data
+    unixtimes = [unicode(calendar.timegm(date.timetuple())) for date in dates]
+    labels = ["%s %i" % (month_names[date.month-1], date.year) for date in dates]
+    if period == "day":
+        labels = ["%02i %s" % (date.day, label) for (date, label) in zip(dates, labels)]
 
+    return (periods, unixtimes, labels)
 
-def completePeriodIdsMonths(ts_data, start, end):
-    data_vars = ts_data.keys()
-    new_ts_data =  createTimeSeries(ts_data)
+def completePeriodAxis(ts_data, period_field, axis):
+    """ Complete a time series with the periods in axis, filling with 0 """
+    periods, unixtimes, labels = axis
     checkListArray(ts_data)
 
-    start_month = start.year*12 + start.month
-    end_month = end.year*12 + end.month
-    months = end_month - start_month
-
-    # All data is from the complete month
-    start = start - timedelta(days=(start.day-1))
+    # Row for each period id, the first one if it is repeated
+    rows = {}
+    if period_field in ts_data:
+        for pos in range(len(ts_data[period_field])-1, -1, -1):
+            rows[ts_data[period_field][pos]] = pos
+    positions = [rows.get(period_id) for period_id in periods]
 
-    for i in range(0, months+1):
-        if (start_month+i in ts_data['month']) is False:
-            # Add new time point with all vars to zero
-            for key in (data_vars):
-                new_ts_data[key].append(0)
-            new_ts_data['month'].pop()
-            new_ts_data['month'].append(start_month+i)
-        else:
-            # Add already existing data for the time point
-            index = ts_data['month'].index(start_month+i)
-            for key in (data_vars):
-                new_ts_data[key].append(ts_data[key][index])
-
-        current =  start + relativedelta(months=i)
-        timestamp = calendar.timegm(current.timetuple())
-        new_ts_data['unixtime'].append(unicode(timestamp))
-        new_ts_data['id'].append(i)
-        import locale
-        locale.setlocale(locale.LC_ALL, "en_US.UTF-8")
-        new_ts_data['date'].append(datetime.strftime(current, "%b %Y"))
+    new_ts_data = {}
+    for key in ts_data:
+        values = ts_data[key]
+        new_ts_data[key] = [0 if pos is None else values[pos] for pos in positions]
+    new_ts_data[period_field] = list(periods)
+    new_ts_data['unixtime'] = list(unixtimes)
+    new_ts_data['id'] = range(0, len(periods))
+    new_ts_data['date'] = list(labels)
 
     return new_ts_data
 
+def completePeriodIdsYears(ts_data, start, end):
+    return completePeriodAxis(ts_data, "year", getPeriodAxis("year", start, end))
+
+def completePeriodIdsMonths(ts_data, start, end):
+    return completePeriodAxis(ts_data, "month", getPeriodAxis("month", start, end))
+
 def date2Week(date):
     # isocalendar: year weeknumber weekday
     week   = str(date.isocalendar()[0])
@@ -149,46 +166,13 @@ def date2Week(date):
     return week
 
 def completePeriodIdsWeeks(ts_data, start, end):
-    data_vars = ts_data.keys()
-    new_ts_data =  createTimeSeries(ts_data)
-    checkListArray(ts_data)
+    return completePeriodAxis(ts_data, "week", getPeriodAxis("week", start, end))
 
-    # Start of the week
-    dayweek = start.isocalendar()[2]
-    new_week = start - relativedelta(days=dayweek-1)
-    i = 0 # for ids in time series
-
-    while (new_week <= end):
-        new_week_txt = date2Week(new_week)
-        if (int(new_week_txt) in ts_data['week']) is False:
-            # Add new time point with all vars to zero
-            for key in (data_vars):
-                new_ts_data[key].append(0)
-            new_ts_data['week'].pop()
-            new_ts_data['week'].append(int(new_week_txt))
-        else:
-            # Add already existing data for the time point
-            index = ts_data['week'].index(int(new_week_txt))
-            for key in (data_vars):
-                new_ts_data[key].append(ts_data[key][index])
-            new_ts_data['week'].pop()
-            new_ts_data['week'].append(ts_data['week'][index])
-
-        timestamp = calendar.timegm(new_week.timetuple())
-        new_ts_data['unixtime'].append(unicode(timestamp))
-        new_ts_data['id'].append(i)
-        i += 1
-        new_ts_data['date'].append(datetime.strftime(new_week, "%b %Y"))
-        new_week = new_week + relativedelta(weeks=1)
+def completePeriodIdsDays(ts_data, start, end):
+    return completePeriodAxis(ts_data, "unixtime", getPeriodAxis("day", start, end))
 
-    return new_ts_data
-
-def completePeriodIds(ts_data, period, startdate, enddate):
-    # If already complete, return
-    if "id" in ts_data: return ts_data
-
-    if len(ts_data.keys()) == 0: return ts_data
-    new_ts_data = ts_data
+def getPeriodDates(startdate, enddate):
+    """ Start and end datetimes for the dates used in SQL queries """
     startdate = startdate.replace("'", "")
     enddate = enddate.replace("'", "")
     start = datetime.strptime(startdate, "%Y-%m-%d")
@@ -198,15 +182,28 @@ def completePeriodIds(ts_data, period, startdate, enddate):
     # GrimoireLib is using date >= startdate and date < enddate.
     # For this reason, a day is substracted from the end date
     end = end - timedelta(days=1)
+    return (start, end)
 
-    if period == "week":
-        new_ts_data = completePeriodIdsWeeks(ts_data, start, end)
-    elif period == "month":
-        new_ts_data = completePeriodIdsMonths(ts_data, start, end)
-    elif period == "year":
-        new_ts_data = completePeriodIdsYears(ts_data, start, end)
+def completePeriodIds(ts_data, period, startdate, enddate):
+    return completePeriodIdsMulti([ts_data], period, startdate, enddate)[0]
+
+def completePeriodIdsMulti(ts_list, period, startdate, enddate):
+    """ Complete a list of time series which share the same periods """
+    start, end = getPeriodDates(startdate, enddate)
+    axis = getPeriodAxis(period, start, end)
+
+    new_ts_list = []
+    for ts_data in ts_list:
+        # If already complete, return
+        if "id" in ts_data or len(ts_data.keys()) == 0:
+            new_ts_list.append(ts_data)
+            continue
+        new_ts_data = ts_data
+        if axis is not None:
+            new_ts_data = completePeriodAxis(ts_data, period_fields[period], axis)
+        new_ts_list.append(cleanNaN(new_ts_data))
 
-    return cleanNaN(new_ts_data)
+    return new_ts_list
 
 # Convert a R data frame to a python dictionary
 def dataFrame2Dict(data):
@@ -303,6 +300,47 @@ def convertDatetime(data):
                 data[i] = str(data[i])
     return data
 
+class ReportJSONEncoder(json.JSONEncoder):
+    """ JSON encoder for report data
+
+    Decimal values are encoded as floats, floats are rounded to
+    Metrics.max_decimals, datetimes are encoded as strings and NaN floats
+    as "NA", all of it while encoding so the data is walked only once.
+    """
+
+    def __init__(self, **kwargs):
+        from metrics import Metrics
+        kwargs.setdefault('sort_keys', True)
+        json.JSONEncoder.__init__(self, **kwargs)
+        self.max_decimals = Metrics.max_decimals
+
+    def default(self, o):
+        from decimal import Decimal
+        if isinstance(o, Decimal): return float(o)
+        if isinstance(o, datetime): return str(o)
+        return json.JSONEncoder.default(self, o)
+
+    def floatstr(self, o):
+        if o != o: return '"NA"'
+        if o == float('inf'): return 'Infinity'
+        if o == -float('inf'): return '-Infinity'
+        return json.encoder.FLOAT_REPR(round(o, self.max_decimals))
+
+    def iterencode(self, o, _one_shot=False):
+        if self.check_circular: markers = {}
+        else: markers = None
+        if self.ensure_ascii: _encoder = json.encoder.encode_basestring_ascii
+        else: _encoder = json.encoder.encode_basestring
+        if self.encoding != 'utf-8':
+            def _encoder(o, _orig_encoder=_encoder, _encoding=self.encoding):
+                if isinstance(o, str): o = o.decode(_encoding)
+                return _orig_encoder(o)
+        _iterencode = json.encoder._make_iterencode(
+            markers, self.default, _encoder, self.indent, self.floatstr,
+            self.key_separator, self.item_separator, self.sort_keys,
+            self.skipkeys, _one_shot)
+        return _iterencode(o, 0)
+
 # Until we use VizPy we will create JSON python files with _py
 def createJSON(data, filepath, check=False, skip_fields = []):
     check = False # for production mode
@@ -310,15 +348,23 @@ def createJSON(data, filepath, check=False, skip_fields = []):
     filepath_py = filepath_tokens[0]+"_py.json"
     filepath_r = filepath_tokens[0]+"_r.json"
 
-    checked_data = convertDatetime(roundDecimals(removeDecimals(data)))
-    json_data = json.dumps(checked_data, sort_keys=True)
-    json_data = json_data.replace('NaN','"NA"')
     if check == False: #forget about R JSON checking
-        jsonfile = open(filepath, 'w')
-        jsonfile.write(json_data)
-        jsonfile.close()
+        # Readers never see a partial file: write a temp one and rename it
+        filepath_tmp = filepath + ".tmp." + str(os.getpid())
+        try:
+            jsonfile = open(filepath_tmp, 'w')
+            try:
+                for chunk in ReportJSONEncoder().iterencode(data):
+                    jsonfile.write(chunk)
+            finally:
+                jsonfile.close()
+            os.rename(filepath_tmp, filepath)
+        except:
+            if os.path.exists(filepath_tmp): os.remove(filepath_tmp)
+            raise
         return
 
+    json_data = ReportJSONEncoder().encode(data)
     # NA as value is not decoded with Python JSON
     # JSON R has "NA" and not NaN
     # JSON R has "NA" and not null
@@ -511,6 +557,32 @@ def completeTops(tops, details, backend_name='bugzilla'):
         completed_tops['url'].append(buildIssueURL(info[1], issue_id, backend_name))
     return completed_tops
 
+def get_groups_tops(groups, rows, fields, limit, key):
+    """ Top limit items of each group, in ExecuteQuery format
+
+    groups maps each group to the set of keys it includes. rows are
+    (key, item, value) tuples, item being a tuple with the item fields. The
+    value of an item in a group is the sum of its values for the keys of
+    the group. key sorts the (value,) + item rows and fields are their names.
+    """
+    keys_rows = {}
+    for (group_key, item, value) in rows:
+        keys_rows.setdefault(group_key, []).append((item, value))
+
+    tops = {}
+    for group in groups:
+        values = {}
+        for group_key in groups[group]:
+            for (item, value) in keys_rows.get(group_key, []):
+                values[item] = values.get(item, 0) + value
+        top = heapq.nsmallest(limit, [(value,) + item for (item, value) in values.items()], key)
+        data = {}
+        for (i, field) in enumerate(fields):
+            data[field] = [row[i] for row in top]
+            if len(top) == 1: data[field] = top[0][i]
+        tops[group] = data
+    return tops
+
 def buildIssueURL(tracker_url, issue_id, backend='bugzilla'):
     if backend is not 'bugzilla':
         return ""
@@ -536,53 +608,81 @@ def get_avg(period_values):
         return period_values
     return average(removeDecimals(period_values))
 
-def medianAndAvgByPeriod(period, dates, values):
+def getPeriodIds(period, dates):
+    """ Ids of the period of each date, the same ones used in SQL queries
+
+    dates is a list of datetimes or unix timestamps.
+    """
+    dates = numpy.asarray(dates)
+    if dates.dtype.kind in 'iuf':
+        dates = dates.astype('int64').astype('datetime64[s]')
+    else:
+        dates = dates.astype('datetime64[s]')
+    days = dates.astype('datetime64[D]')
+
+    if period == 'day':
+        return days.astype('datetime64[s]').astype('int64')
+    elif period == 'week':
+        # ISO week: the one of its thursday, 1970-01-01 was a thursday
+        thursdays = days - (days.astype('int64') + 3) % 7 + 3
+        years = thursdays.astype('datetime64[Y]')
+        weeks = (thursdays - years.astype('datetime64[D]')).astype('int64') // 7 + 1
+        return (years.astype('int64') + 1970) * 100 + weeks
+    elif period == 'month':
+        return dates.astype('datetime64[M]').astype('int64') + 1970 * 12 + 1
+    elif period == 'year':
+        return (dates.astype('datetime64[Y]').astype('int64') + 1970) * 12
+    else:
+        raise Exception("Period not supported: " + str(period))
 
-    def get_period(period, date):
-        if period == 'month':
-            return date.year * 12 + date.month
+def medianAndAvgByPeriod(period, dates, values):
+    """ Median, avg, min, max and count of the values in each period
 
+    dates and values don't need to be sorted. None and NaN values are
+    ignored. values can be a list or a NumPy array, like the columns from
+    DSQuery.ExecuteQueryColumnar.
+    """
     if len(dates) == 0: return None
-    if not values: return None
-
-    if not isinstance(values, list):
-        values = [values]
+    if isinstance(values, ndarray):
+        values = values.astype(float)
+    else:
+        if not values: return None
+        if not isinstance(values, list):
+            values = [values]
+        values = numpy.array([float('nan') if v is None else v for v in values],
+                             dtype = float)
 
     if len(dates) != len(values): return None
 
-    result = {period  : [],
-              'median' : [],
-              'avg'    : []}
-
-    start = dates[0]
-    current_period = get_period(period, start)
-    period_values = []
-    ndates = len(dates)
-
-    for i in range(0, ndates):
-        date_period = get_period(period, dates[i])
-
-        # Change of period
-        if date_period != current_period:
-            result[period].append(current_period)
-            result['median'].append(get_median(period_values))
-            result['avg'].append(get_avg(period_values))
-
-            current_period = date_period
-            period_values = []
-
-        period_values.append(values[i])
-
-        # End of the list
-        if i == ndates - 1:
-            result[period].append(current_period)
-            result['median'].append(get_median(period_values))
-            result['avg'].append(get_avg(period_values))                        # Accumulated values
+    ids = getPeriodIds(period, dates)
+    valid = ~numpy.isnan(values)
+    ids, values = ids[valid], values[valid]
+
+    field = period_fields[period]
+    result = {field : [], 'median' : [], 'avg' : [],
+              'min' : [], 'max' : [], 'count' : []}
+    if len(values) == 0: return result
+
+    # Sorted by period and, inside each period, by value
+    order = numpy.lexsort((values, ids))
+    ids, values = ids[order], values[order]
+    periods, starts, count = numpy.unique(ids, return_index = True,
+                                          return_counts = True)
+    ends = starts + count - 1
+    middle = (values[starts + (count - 1) // 2] + values[starts + count // 2]) / 2
+
+    result[field] = periods.tolist()
+    result['median'] = middle.tolist()
+    result['avg'] = (numpy.add.reduceat(values, starts) / count).tolist()
+    result['min'] = values[starts].tolist()
+    result['max'] = values[ends].tolist()
+    result['count'] = count.tolist()
     return result
 
 def check_array_values(data):
     for item in data:
-        if not isinstance(data[item], list): data[item] = [data[item]]
+        if isinstance(data[item], ndarray): data[item] = data[item].tolist()
+        elif not isinstance(data[item], list): data[item] = [data[item]]
     return data
 
 def fill_items(items, data, id_field, evol = False,
@@ -644,6 +744,7 @@ def order_items(items, data, id_field, evol = False, period = None):
 def fill_and_order_items(items, data, id_field, evol = False,
                          period = None, startdate = None, enddate = None):
     # Only items will appear for a filter
+    data = check_array_values(data)
     if not evol: # evol is already filled (complete data) for a company, but not all companies
         data = fill_items(items, data, id_field)
     if evol: data = fill_items(items, data, id_field,
@@ -134,24 +134,32 @@ class IRC(DataSource):
         fn = os.path.join(destdir, filter_.get_filename(IRC()))
         createJSON(items, fn)
 
-        for item in items :
+        shard_items = DataSource.get_shard_items(items)
+        items_data = DataSource.get_filter_items_data(IRC, filter_, shard_items, period,
+                                                      startdate, enddate, identities_db)
+
+        for item in shard_items :
             # item_name = "'"+ item+ "'"
             logging.info (item)
 
             filter_item = Filter(filter_.get_name(), item)
 
-            evol_data = IRC.get_evolutionary_data(period, startdate, enddate, identities_db, filter_item)
+            if item in items_data:
+                evol_data, agg = items_data[item]
+            else:
+                evol_data = IRC.get_evolutionary_data(period, startdate, enddate, identities_db, filter_item)
+                agg = IRC.get_agg_data(period, startdate, enddate, identities_db, filter_item)
+
             fn = os.path.join(destdir, filter_item.get_evolutionary_filename(IRC()))
             createJSON(completePeriodIds(evol_data, period, startdate, enddate), fn)
 
-            agg = IRC.get_agg_data(period, startdate, enddate, identities_db, filter_item)
             fn = os.path.join(destdir, filter_item.get_static_filename(IRC()))
             createJSON(agg, fn)
 
     @staticmethod
     def create_filter_report_all(filter_, period, startdate, enddate, destdir, npeople, identities_db):
         filter_name = filter_.get_name()
-        if filter_name == "people2" or filter_name == "company_off":
+        if DataSource.get_group_id_field(IRC, filter_name) is not None:
             filter_all = Filter(filter_name, None)
             agg_all = IRC.get_agg_data(period, startdate, enddate,
                                        identities_db, filter_all)
@@ -216,10 +224,20 @@ def GetDate (startdate, enddate, identities_db, type_analysis, type):
     else :
         fields = " DATE_FORMAT (min(date), '%Y-%m-%d') as first_date"
 
+    # Filter all: the dates of all the items (None if not supported)
+    group_field = None
+    if type_analysis is not None and len(type_analysis) == 2 and type_analysis[1] is None:
+        group_fields = {'repository': "c.name", 'company': "c.name",
+                        'country': "c.name", 'domain': "d.name"}
+        group_field = group_fields.get(type_analysis[0])
+        if group_field is None: return None
+        fields = group_field + ", " + fields
+
     tables = " irclog i " + GetIRCSQLReportFrom(identities_db, type_analysis)
     filters = GetIRCSQLReportWhere(type_analysis)
 
     q = BuildQuery(None, startdate, enddate, " i.date ", fields, tables, filters, False)
+    if group_field is not None: q += " GROUP BY " + group_field
     data = ExecuteQuery(q)
     return(data)
 
@@ -240,7 +258,9 @@ def GetIRCSQLRepositoriesFrom ():
 
 def GetIRCSQLRepositoriesWhere(repository):
     # filters necessaries for repositories
-    return (" i.channel_id = c.id and c.name=" + repository)
+    filters = " i.channel_id = c.id"
+    if repository is not None: filters += " and c.name=" + repository
+    return filters
 
 
 def GetIRCSQLCompaniesFrom (i_db):
@@ -252,12 +272,13 @@ def GetIRCSQLCompaniesFrom (i_db):
 
 def GetIRCSQLCompaniesWhere(name):
     # filters necessary to companies analysis
-    return(" i.nick = pup.people_id and "+\
+    filters = (" i.nick = pup.people_id and "+\
            "pup.upeople_id = upc.upeople_id and "+\
            "upc.company_id = c.id and "+\
            "i.submitted_on >= upc.init and "+\
-           "i.submitted_on < upc.end and "+\
-           "c.name = " + name)
+           "i.submitted_on < upc.end")
+    if name is not None: filters += " and c.name = " + name
+    return filters
 
 
 def GetIRCSQLCountriesFrom (i_db):
@@ -269,10 +290,11 @@ def GetIRCSQLCountriesFrom (i_db):
 
 def GetIRCSQLCountriesWhere(name):
     # filters necessary to countries analysis
-    return(" i.nick = pup.people_id and "+\
+    filters = (" i.nick = pup.people_id and "+\
            "pup.upeople_id = upc.upeople_id and "+\
-           "upc.country_id = c.id and "+\
-           "c.name = " + name)
+           "upc.country_id = c.id")
+    if name is not None: filters += " and c.name = " + name
+    return filters
 
 def GetIRCSQLDomainsFrom (i_db):
     # tables necessary to domains analysis
@@ -282,10 +304,11 @@ def GetIRCSQLDomainsFrom (i_db):
 
 def GetIRCSQLDomainsWhere (name):
     # filters necessary to domains analysis
-    return(" i.nick = pup.people_id and "+\
+    filters = (" i.nick = pup.people_id and "+\
            "pup.upeople_id = upd.upeople_id and "+\
-           "upd.domain_id = d.id and "+\
-           "d.name = " + name)
+           "upd.domain_id = d.id")
+    if name is not None: filters += " and d.name = " + name
+    return filters
 
 def GetTablesOwnUniqueIdsIRC () :
     tables = 'irclog, people_upeople pup'
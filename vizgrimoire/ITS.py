@@ -225,21 +225,30 @@ class ITS(DataSource):
         fn = os.path.join(destdir, filter_.get_filename(ITS()))
         createJSON(items, fn)
 
+        shard_items = DataSource.get_shard_items(items)
+
         if filter_name in ("domain", "company", "repository"):
             items_list = {'name' : [], 'closed_365' : [], 'closers_365' : []}
         else:
-            items_list = items
+            items_list = shard_items
+
+        items_data = DataSource.get_filter_items_data(ITS, filter_, shard_items, period,
+                                                      startdate, enddate, identities_db)
 
-        for item in items :
+        for item in shard_items :
             item_name = "'"+ item+ "'"
             logging.info (item_name)
             filter_item = Filter(filter_name, item)
 
-            evol_data = ITS.get_evolutionary_data(period, startdate, enddate, identities_db, filter_item)
+            if item in items_data:
+                evol_data, agg = items_data[item]
+            else:
+                evol_data = ITS.get_evolutionary_data(period, startdate, enddate, identities_db, filter_item)
+                agg = ITS.get_agg_data(period, startdate, enddate, identities_db, filter_item)
+
             fn = os.path.join(destdir, filter_item.get_evolutionary_filename(ITS()))
             createJSON(evol_data, fn)
 
-            agg = ITS.get_agg_data(period, startdate, enddate, identities_db, filter_item)
             fn = os.path.join(destdir, filter_item.get_static_filename(ITS()))
             createJSON(agg, fn)
 
@@ -254,9 +263,9 @@ class ITS(DataSource):
                 createJSON(top, fn)
 
         fn = os.path.join(destdir, filter_.get_filename(ITS()))
-        createJSON(items_list, fn)
+        DataSource.create_items_list(items_list, items, shard_items, fn)
 
-        if (filter_name == "company"):
+        if (filter_name == "company") and DataSource.is_first_shard():
             closed = ITS.get_filter_summary(filter_, period, startdate, enddate, identities_db, 10)
             createJSON (closed, destdir+"/"+ filter_.get_summary_filename(ITS))
 
@@ -269,7 +278,7 @@ class ITS(DataSource):
     def create_filter_report_all(filter_, period, startdate, enddate, destdir, npeople, identities_db):
         check = False # activate to debug issues
         filter_name = filter_.get_name()
-        if filter_name == "people2" or filter_name == "company":
+        if DataSource.get_group_id_field(ITS, filter_name) is not None:
             filter_all = Filter(filter_name, None)
             agg_all = ITS.get_agg_data(period, startdate, enddate,
                                        identities_db, filter_all)
@@ -452,7 +461,10 @@ def GetITSSQLRepositoriesFrom ():
 
 def GetITSSQLRepositoriesWhere (repository):
     # fields necessary to match info among tables
-    return (" i.tracker_id = t.id and t.url = "+repository+" ")
+    filters = " i.tracker_id = t.id "
+    if repository is not None:
+        filters += "and t.url = "+repository+" "
+    return filters
 
 def GetITSSQLProjectsFrom ():
     # tables necessary for repositories
@@ -502,10 +514,12 @@ def GetITSSQLCountriesFrom (i_db):
 
 def GetITSSQLCountriesWhere (name):
     # filters for the countries analysis
-    return(" i.submitted_by = pup.people_id and "+\
+    filters = " i.submitted_by = pup.people_id and "+\
            "pup.upeople_id = upc.upeople_id and "+\
-           "upc.country_id = c.id and "+\
-           "c.name = "+name)
+           "upc.country_id = c.id"
+    if name is not None:
+           filters += " and c.name = "+name
+    return filters
 
 
 def GetITSSQLDomainsFrom (i_db):
@@ -518,10 +532,12 @@ def GetITSSQLDomainsFrom (i_db):
 
 def GetITSSQLDomainsWhere (name):
     # filters for the domains analysis
-    return(" i.submitted_by = pup.people_id and "+\
+    filters = " i.submitted_by = pup.people_id and "+\
            "pup.upeople_id = upd.upeople_id and "+\
-           "upd.domain_id = d.id and "+\
-           "d.name = "+name)
+           "upd.domain_id = d.id"
+    if name is not None:
+           filters += " and d.name = "+name
+    return filters
 
 ##########
 #Generic functions to obtain FROM and WHERE clauses per type of report
@@ -575,10 +591,20 @@ def GetDate (startdate, enddate, identities_db, type_analysis, type):
     else :
         fields = " DATE_FORMAT (min(submitted_on), '%Y-%m-%d') as first_date"
 
+    # Filter all: the dates of all the items (None if not supported)
+    group_field = None
+    if type_analysis is not None and len(type_analysis) == 2 and type_analysis[1] is None:
+        group_fields = {'repository': "t.url", 'company': "c.name",
+                        'country': "c.name", 'domain': "d.name"}
+        group_field = group_fields.get(type_analysis[0])
+        if group_field is None: return None
+        fields = group_field + ", " + fields
+
     tables = " issues i " + GetITSSQLReportFrom(identities_db, type_analysis)
     filters = GetITSSQLReportWhere(type_analysis, identities_db)
 
     q = BuildQuery(None, startdate, enddate, " i.submitted_on ", fields, tables, filters, False)
+    if group_field is not None: q += " GROUP BY " + group_field
 
     data = ExecuteQuery(q)
     return(data)
@@ -240,22 +240,31 @@ class MLS(DataSource):
         fn = os.path.join(destdir, filter_.get_filename(MLS()))
         createJSON(items_files, fn)
 
+        shard_items = DataSource.get_shard_items(items)
+
         if filter_name in ("domain", "company", "repository"):
             items_list = {'name' : [], 'sent_365' : [], 'senders_365' : []}
         else:
-            items_list = items
+            items_list = shard_items
+
+        items_data = DataSource.get_filter_items_data(MLS, filter_, shard_items, period,
+                                                      startdate, enddate, identities_db)
 
-        for item in items :
+        for item in shard_items :
             item_name = "'"+ item+ "'"
             logging.info (item_name)
             filter_item = Filter(filter_.get_name(), item)
 
-            evol_data = MLS.get_evolutionary_data(period, startdate, enddate, 
-                                                  identities_db, filter_item)
+            if item in items_data:
+                evol_data, agg = items_data[item]
+            else:
+                evol_data = MLS.get_evolutionary_data(period, startdate, enddate, 
+                                                      identities_db, filter_item)
+                agg = MLS.get_agg_data(period, startdate, enddate, identities_db, filter_item)
+
             fn = os.path.join(destdir, filter_item.get_evolutionary_filename(MLS()))
             createJSON(evol_data, fn)
 
-            agg = MLS.get_agg_data(period, startdate, enddate, identities_db, filter_item)
             fn = os.path.join(destdir, filter_item.get_static_filename(MLS()))
             createJSON(agg, fn)
 
@@ -268,9 +277,9 @@ class MLS(DataSource):
             createJSON(top_senders, destdir+"/"+filter_item.get_top_filename(MLS()))
 
         fn = os.path.join(destdir, filter_.get_filename(MLS()))
-        createJSON(items_list, fn)
+        DataSource.create_items_list(items_list, items, shard_items, fn)
 
-        if (filter_name == "company"):
+        if (filter_name == "company") and DataSource.is_first_shard():
             sent = MLS.get_filter_summary(filter_, period, startdate, enddate, identities_db, 10)
             createJSON (sent, destdir+"/"+filter_.get_summary_filename(MLS))
 
@@ -283,7 +292,7 @@ class MLS(DataSource):
     def create_filter_report_all(filter_, period, startdate, enddate, destdir, npeople, identities_db):
         check = False # activate to debug issues
         filter_name = filter_.get_name()
-        if filter_name == "people2" or filter_name == "company":
+        if DataSource.get_group_id_field(MLS, filter_name) is not None:
             filter_all = Filter(filter_name, None)
             agg_all = MLS.get_agg_data(period, startdate, enddate,
                                        identities_db, filter_all)
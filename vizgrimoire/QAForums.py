@@ -176,7 +176,7 @@ class QAForums(DataSource):
 
         fn = os.path.join(destdir, filter_.get_filename(QAForums()))
         createJSON(items, fn)
-        for item in items:
+        for item in DataSource.get_shard_items(items):
             logging.info(item)
             filter_item = Filter(filter_.get_name(), item)
 
@@ -33,7 +33,6 @@ from GrimoireUtils import createJSON, getPeriod, get_subprojects
 from data_source import DataSource
 from filter import Filter
 from metrics_filter import MetricFilters
-from query_builder import DSQuery
 
 class SCM(DataSource):
     _metrics_set = []
@@ -238,21 +237,30 @@ class SCM(DataSource):
         fn = os.path.join(destdir, filter_.get_filename(SCM()))
         createJSON(items, fn)
 
+        shard_items = DataSource.get_shard_items(items)
+
         if filter_name in ("domain", "company", "repository"):
             items_list = {'name' : [], 'commits_365' : [], 'authors_365' : []}
         else:
-            items_list = items
+            items_list = shard_items
+
+        items_data = DataSource.get_filter_items_data(SCM, filter_, shard_items, period,
+                                                      startdate, enddate, identities_db)
 
-        for item in items :
+        for item in shard_items :
             item_name = "'"+ item+ "'"
             logging.info (item_name)
             filter_item = Filter(filter_name, item)
 
-            evol_data = SCM.get_evolutionary_data(period, startdate, enddate, identities_db, filter_item)
+            if item in items_data:
+                evol_data, agg = items_data[item]
+            else:
+                evol_data = SCM.get_evolutionary_data(period, startdate, enddate, identities_db, filter_item)
+                agg = SCM.get_agg_data(period, startdate, enddate, identities_db, filter_item)
+
             fn = os.path.join(destdir, filter_item.get_evolutionary_filename(SCM()))
             createJSON(evol_data, fn)
 
-            agg = SCM.get_agg_data(period, startdate, enddate, identities_db, filter_item)
             fn = os.path.join(destdir, filter_item.get_static_filename(SCM()))
             createJSON(agg, fn)
 
@@ -267,9 +275,9 @@ class SCM(DataSource):
                 createJSON(top_authors, fn)
 
         fn = os.path.join(destdir, filter_.get_filename(SCM()))
-        createJSON(items_list, fn)
+        DataSource.create_items_list(items_list, items, shard_items, fn)
 
-        if (filter_name == "company"):
+        if (filter_name == "company") and DataSource.is_first_shard():
             summary =  SCM.get_filter_summary(filter_, period, startdate, enddate, identities_db, 10)
             createJSON (summary, destdir+"/"+ filter_.get_summary_filename(SCM))
 
@@ -278,8 +286,7 @@ class SCM(DataSource):
                                evol = False, period = None):
         # Check per item data with group by people data
         items = SCM.get_filter_items(filter_, startdate, enddate, idb)
-        id_field = DSQuery.get_group_field(filter_.get_name())
-        id_field = id_field.split('.')[1] # remove table name
+        id_field = DataSource.get_group_id_field(SCM, filter_.get_name())
         for i in range(0,len(items['name'])):
             name = items['name'][i]
             logging.info("Checking " + name + " " + str(i) + "/" + str(len(items['name'])))
@@ -315,7 +322,7 @@ class SCM(DataSource):
         # New API for getting all metrics with one query
         check = False # activate to debug issues
         filter_name = filter_.get_name()
-        if filter_name == "people2" or filter_name == "company":
+        if DataSource.get_group_id_field(SCM, filter_name) is not None:
             filter_all = Filter(filter_name, None)
             agg_all = SCM.get_agg_data(period, startdate, enddate,
                                        identities_db, filter_all)
@@ -36,7 +36,6 @@ from GrimoireUtils import GetPercentageDiff, GetDates, completePeriodIds
 from GrimoireUtils import checkListArray, removeDecimals, get_subprojects
 from GrimoireUtils import getPeriod, createJSON, checkFloatArray, medianAndAvgByPeriod, check_array_values
 from metrics_filter import MetricFilters
-from query_builder import DSQuery
 
 
 from data_source import DataSource
@@ -116,8 +115,12 @@ class SCR(DataSource):
                 if r in reports_on: metrics_on += [r]
 
         if type_analysis and type_analysis[1] is None:
-            items = DS.get_filter_items(filter_, startdate, enddate, identities_db)
-            items = items.pop('name')
+            items = filter_.get_items()
+            if items is None:
+                items = DS.get_filter_items(filter_, startdate, enddate, identities_db)
+                items = items.pop('name')
+            id_field = DataSource.get_group_id_field(DS, type_analysis[0])
+            items_analysis = [[type_analysis[0], item] for item in items]
 
         if DS.get_name()+"_start_date" in Report.get_config()['r']:
             startdate = "'"+Report.get_config()['r'][DS.get_name()+"_start_date"]+"'"
@@ -146,9 +149,10 @@ class SCR(DataSource):
 
             if type_analysis and type_analysis[1] is None:
                 logging.info(item.id)
-                id_field = DSQuery.get_group_field(type_analysis[0])
-                id_field = id_field.split('.')[1] # remove table name
                 mvalue = check_array_values(mvalue)
+                if id_field not in mvalue:
+                    mvalue = DataSource.get_metric_items_data(item, mfilter, items,
+                                                              items_analysis, id_field, evol)
                 mvalue = fill_and_order_items(items, mvalue, id_field,
                                               evol, period, startdate, enddate)
             data = dict(data.items() + mvalue.items())
@@ -169,10 +173,14 @@ class SCR(DataSource):
         # END SCR SPECIFIC #
 
         if not evol:
-            init_date = DS.get_date_init(startdate, enddate, identities_db, type_analysis)
-            end_date = DS.get_date_end(startdate, enddate, identities_db, type_analysis)
-
-            data = dict(data.items() + init_date.items() + end_date.items())
+            if type_analysis and type_analysis[1] is None:
+                dates = DataSource.get_date_items(DS, startdate, enddate, identities_db,
+                                                  items, items_analysis, id_field)
+                data = dict(data.items() + dates.items())
+            else:
+                init_date = DS.get_date_init(startdate, enddate, identities_db, type_analysis)
+                end_date = DS.get_date_end(startdate, enddate, identities_db, type_analysis)
+                data = dict(data.items() + init_date.items() + end_date.items())
 
             # Tendencies
             metrics_trends = SCR.get_metrics_core_trends()
@@ -181,22 +189,21 @@ class SCR(DataSource):
             if automator_metrics in automator['r']:
                 metrics_trends = automator['r'][automator_metrics].split(",")
 
-            for i in [7,30,365]:
-                for item in all_metrics:
-                    if item.id not in metrics_trends: continue
-                    mfilter_orig = item.filters
-                    item.filters = mfilter
-                    period_data = item.get_trends(enddate, i)
-                    item.filters = mfilter_orig
-
-                    data = dict(data.items() +  period_data.items())
+            for item in all_metrics:
+                if item.id not in metrics_trends: continue
+                mfilter_orig = item.filters
+                item.filters = mfilter
+                period_data = item.get_trends_multi(enddate, [7,30,365])
 
-                    if type_analysis and type_analysis[1] is None:
-                        id_field = DSQuery.get_group_field(type_analysis[0])
-                        id_field = id_field.split('.')[1] # remove table name
-                        period_data = fill_and_order_items(items, period_data, id_field)
+                if type_analysis and type_analysis[1] is None:
+                    if id_field not in period_data:
+                        period_data = DataSource.get_metric_items_data(
+                            item, mfilter, items, items_analysis, id_field,
+                            trends = (enddate, [7,30,365]))
+                    period_data = fill_and_order_items(items, period_data, id_field)
+                item.filters = mfilter_orig
 
-                    data = dict(data.items() +  period_data.items())
+                data = dict(data.items() +  period_data.items())
 
 
         if filter_ is not None: studies_data = {}
@@ -272,7 +279,8 @@ class SCR(DataSource):
             logging.error("SCR " + filter_name + " not supported")
             return items
 
-        items = metric.get_list()
+        # Pending gets the items again for each of its filters
+        items = metric._memoize("list", metric.get_list)
         return items
 
     @staticmethod
@@ -289,13 +297,18 @@ class SCR(DataSource):
         if not isinstance(items, (list)):
             items = [items]
 
+        shard_items = DataSource.get_shard_items(items)
+
         # For repos aggregated data. Include metrics to sort in javascript.
         if (filter_name == "repository"):
             items_list = {"name":[],"review_time_days_median":[],"submitted":[]}
         else:
-            items_list = items
+            items_list = shard_items
+
+        items_data = DataSource.get_filter_items_data(SCR, filter_, shard_items, period,
+                                                      startdate, enddate, identities_db)
 
-        for item in items :
+        for item in shard_items :
             item_file = item.replace("/","_")
             if (filter_name == "repository"):
                 items_list["name"].append(item_file)
@@ -303,13 +316,17 @@ class SCR(DataSource):
             logging.info (item)
             filter_item = Filter(filter_name, item)
 
-            evol = SCR.get_evolutionary_data(period, startdate, enddate, 
-                                               identities_db, filter_item)
+            if item in items_data:
+                evol, agg = items_data[item]
+            else:
+                evol = SCR.get_evolutionary_data(period, startdate, enddate, 
+                                                   identities_db, filter_item)
+                agg = SCR.get_agg_data(period, startdate, enddate, identities_db, filter_item)
+
             fn = os.path.join(destdir, filter_item.get_evolutionary_filename(SCR()))
             createJSON(evol, fn)
 
             # Static
-            agg = SCR.get_agg_data(period, startdate, enddate, identities_db, filter_item)
             fn = os.path.join(destdir, filter_item.get_static_filename(SCR()))
             createJSON(agg, fn)
             if (filter_name == "repository"):
@@ -318,10 +335,10 @@ class SCR(DataSource):
                 else: items_list["submitted"].append("NA")
                 if 'review_time_days_median' in agg: 
                     items_list["review_time_days_median"].append(agg['review_time_days_median'])
-                else: items_list["submitted"].append("NA")
+                else: items_list["review_time_days_median"].append("NA")
 
         fn = os.path.join(destdir, filter_.get_filename(SCR()))
-        createJSON(items_list, fn)
+        DataSource.create_items_list(items_list, items, shard_items, fn)
 
     @staticmethod
     def _check_report_all_data(data, filter_, startdate, enddate, idb,
@@ -333,7 +350,7 @@ class SCR(DataSource):
         check = False # activate to debug issues
         filter_name = filter_.get_name()
 
-        if filter_name == "people2" or filter_name == "company":
+        if DataSource.get_group_id_field(SCR, filter_name) is not None:
             filter_all = Filter(filter_name, None)
             agg_all = SCR.get_agg_data(period, startdate, enddate,
                                        identities_db, filter_all)
@@ -78,42 +78,57 @@ class CompaniesActivity(Analyses):
         """ % (field)
         return from_
 
-    def get_sql_commits(self, year = None):
+    def get_sql_years(self, date, years = None):
+        """ Parts of a query grouped also by year for the years (start, end)
+
+        The dates are filtered with a range so indexes on them can be used.
+        """
+        parts = {"field": "", "filter": "", "group": "", "order": "", "outer": ""}
+        if years is not None:
+            parts["field"] = "YEAR(%s) as year, " % (date)
+            parts["filter"] = "%s >= '%i-01-01' AND %s < '%i-01-01'" % \
+                (date, years[0], date, years[1] + 1)
+            parts["group"] = ", year"
+            parts["order"] = "year, "
+            parts["outer"] = "year, "
+        return parts
+
+    def get_sql_commits(self, years = None):
         where = ""
         field = "commits"
         from_ =  self.get_scm_from_companies()
 
-        if year is not None:
-            where = " WHERE YEAR(s.date) = " + str(year)
-            field = field + "_" + str(year)
+        y = self.get_sql_years("s.date", years)
+        if years is not None:
+            where = " WHERE " + y["filter"]
         sql = """
-            select c.name, count(c.id) as %s
+            select c.name, %s count(c.id) as %s
             %s %s
-            group by c.id
-            order by %s desc, c.name
-        """ % (field, from_, where, field)
+            group by c.id%s
+            order by %s%s desc, c.name
+        """ % (y["field"], field, from_, where, y["group"], y["order"], field)
 
         return (sql)
 
-    def get_sql_authors(self, year = None):
+    def get_sql_authors(self, years = None):
         where = ""
         field = "authors"
         from_ =  self.get_scm_from_companies()
 
-        if year is not None:
-            where = " WHERE YEAR(s.date) = " + str(year)
-            field = field + "_" + str(year)
+        y = self.get_sql_years("s.date", years)
+        if years is not None:
+            where = " WHERE " + y["filter"]
         sql = """
-            select c.name, count(distinct(s.author_id)) as %s
+            select c.name, %s count(distinct(s.author_id)) as %s
             %s %s
-            group by c.id
-            order by %s desc, c.name
-        """ % (field, from_, where, field)
+            group by c.id%s
+            order by %s%s desc, c.name
+        """ % (y["field"], field, from_, where, y["group"], y["order"], field)
 
         return (sql)
 
-    def get_sql_committers(self, year = None, active = False):
-        if year is not None and active:
+    def get_sql_committers(self, years = None, active = False):
+        if years is not None and active:
             logging.error("Active committers is not valid for past years.")
             return None
         # An active committers has done a commit in last 90 days
@@ -123,214 +138,177 @@ class CompaniesActivity(Analyses):
         if active: field = "committers_active"
         from_ =  self.get_scm_from_companies(True)
 
-        if year is not None:
-            where = " WHERE YEAR(s.date) = " + str(year)
-            field = field + "_" + str(year)
+        y = self.get_sql_years("s.date", years)
+        if years is not None:
+            where = " WHERE " + y["filter"]
         if active:
-	    if where == "": where = " WHERE "
-  	    else: where += " AND "
-            where += " DATEDIFF(NOW(), s.date) < " + active_max_days
+            where = " WHERE DATEDIFF(NOW(), s.date) < " + active_max_days
         sql = """
-            select c.name, count(distinct(s.committer_id)) as %s
+            select c.name, %s count(distinct(s.committer_id)) as %s
             %s %s
-            group by c.id
-            order by %s desc, c.name
-        """ % (field, from_, where, field)
+            group by c.id%s
+            order by %s%s desc, c.name
+        """ % (y["field"], field, from_, where, y["group"], y["order"], field)
 
         return (sql)
 
-    def get_sql_actions(self, year = None):
+    def get_sql_actions(self, years = None):
         where = ""
         field = "actions"
         from_ =  self.get_scm_from_companies()
 
-        if year is not None:
-            where = " WHERE YEAR(s.date) = " + str(year)
-            field = field + "_" + str(year)
+        y = self.get_sql_years("s.date", years)
+        if years is not None:
+            where = " WHERE " + y["filter"]
         sql = """
-            select c.name, count(a.id) as %s
+            select c.name, %s count(a.id) as %s
             %s
               JOIN actions a ON a.commit_id = s.id 
             %s
-            group by c.id
-            order by %s desc, c.name
-        """ % (field, from_, where, field)
+            group by c.id%s
+            order by %s%s desc, c.name
+        """ % (y["field"], field, from_, where, y["group"], y["order"], field)
 
         return (sql)
 
-    def get_sql_sloc(self, year = None):
+    def get_sql_sloc(self, years = None):
         """ Metric not used. Use lines_added and lines_removed """
-        where = ""
-        field = "sloc"
-        from_ =  self.get_scm_from_companies()
-
-        # Remove commits from cvs2svn migration with removed lines issues
-        where = "WHERE  message NOT LIKE '%cvs2svn%'"
-        if year is not None:
-            where += " AND YEAR(s.date) = " + str(year)
-            field = field + "_" + str(year)
-
-        sql = """
-            select name, added-removed as %s FROM (
-              select c.name, SUM(removed) as removed, SUM(added) as added
-              %s JOIN commits_lines cl ON cl.commit_id = s.id
-              %s
-              group by c.id
-            ) t
-            order by %s desc, name
-        """ % (field, from_, where, field)
-
-        return (sql)
-
+        return self.get_sql_lines("sloc", "added-removed", years)
 
     def get_lines_filters(self):
         # Remove commits from cvs2svn migration with removed lines issues
         where = "WHERE  message NOT LIKE '%cvs2svn%'"
         return where
 
-    def get_sql_lines_added(self, year = None):
-        where = self.get_lines_filters()
-        field = "lines_added"
-        from_ =  self.get_scm_from_companies()
-
-        if year is not None:
-            where += " AND YEAR(s.date) = " + str(year)
-            field = field + "_" + str(year)
-
-        sql = """
-            select name, added as %s FROM (
-              select c.name, SUM(added) as added
-              %s JOIN commits_lines cl ON cl.commit_id = s.id
-              %s
-              group by c.id
-            ) t
-            order by %s desc, name
-        """ % (field, from_, where, field)
-
-        return (sql)
-
-    def get_sql_lines_removed(self, year = None):
+    def get_sql_lines(self, field, value, years = None):
+        """ Lines metric computed with value from the added and removed lines """
         where = self.get_lines_filters()
-        field = "lines_removed"
         from_ =  self.get_scm_from_companies()
 
-        if year is not None:
-            where += " AND YEAR(s.date) = " + str(year)
-            field = field + "_" + str(year)
+        y = self.get_sql_years("s.date", years)
+        if years is not None:
+            where += " AND " + y["filter"]
 
         sql = """
-            select name, removed as %s FROM (
-              select c.name, SUM(removed) as removed
+            select name, %s %s as %s FROM (
+              select c.name, %s SUM(removed) as removed, SUM(added) as added
               %s JOIN commits_lines cl ON cl.commit_id = s.id
               %s
-              group by c.id
+              group by c.id%s
             ) t
-            order by %s desc, name
-        """ % (field, from_, where, field)
+            order by %s%s desc, name
+        """ % (y["outer"], value, field, y["field"], from_, where, y["group"],
+               y["order"], field)
 
         return (sql)
 
-    def get_sql_lines_total(self, year = None):
-        where = self.get_lines_filters()
-        field = "lines_total"
-        from_ =  self.get_scm_from_companies()
-
-        if year is not None:
-            where += " AND YEAR(s.date) = " + str(year)
-            field = field + "_" + str(year)
+    def get_sql_lines_added(self, years = None):
+        return self.get_sql_lines("lines_added", "added", years)
 
-        sql = """
-            select name, (added+removed) as %s FROM (
-              select c.name, SUM(removed) as removed, SUM(added) as added
-              %s JOIN commits_lines cl ON cl.commit_id = s.id
-              %s
-              group by c.id
-            ) t
-            order by %s desc, name
-        """ % (field, from_, where, field)
+    def get_sql_lines_removed(self, years = None):
+        return self.get_sql_lines("lines_removed", "removed", years)
 
-        return (sql)
+    def get_sql_lines_total(self, years = None):
+        return self.get_sql_lines("lines_total", "(added+removed)", years)
 
-    def get_sql_tickets(self, field = None, year = None):
-        where = "WHERE"
+    def get_sql_tickets(self, field = None, years = None):
+        filters = []
         from_ =  self.get_its_from_companies()
-        if field == "opened":
-            if year is None: where = ""
-        elif field == "closed":
-            where = "WHERE i.status='RESOLVED' "
+        if field == "closed":
+            filters.append("i.status='RESOLVED'")
         elif field == "pending":
-            where = "WHERE i.status='NEW' "
-        else: return
+            filters.append("i.status='NEW'")
+        elif field != "opened": return
 
-        if year is not None:
-            if where != "WHERE": where += " AND "
-            where += " YEAR(i.submitted_on) = " + str(year) 
-            field = field + "_" + str(year)
+        y = self.get_sql_years("i.submitted_on", years)
+        if years is not None:
+            filters.append(y["filter"])
+        where = ""
+        if len(filters) > 0: where = "WHERE " + " AND ".join(filters)
         sql = """
-            select c.name, count(distinct(i.id)) as %s
+            select c.name, %s count(distinct(i.id)) as %s
             %s %s
-            group by c.id
-            order by %s desc, c.name
-        """ % (field, from_, where, field)
+            group by c.id%s
+            order by %s%s desc, c.name
+        """ % (y["field"], field, from_, where, y["group"], y["order"], field)
         return (sql)
 
-    def get_sql_opened(self, year = None):
-        return self.get_sql_tickets("opened", year)
+    def get_sql_opened(self, years = None):
+        return self.get_sql_tickets("opened", years)
 
-    def get_sql_closed(self, year = None):
-        return self.get_sql_tickets("closed", year)
+    def get_sql_closed(self, years = None):
+        return self.get_sql_tickets("closed", years)
 
-    def get_sql_pending(self, year = None):
-        return self.get_sql_tickets("pending", year)
+    def get_sql_pending(self, years = None):
+        return self.get_sql_tickets("pending", years)
 
-    def get_sql_sent(self, year = None):
+    def get_sql_sent(self, years = None):
         where = ""
         field = "sent"
         from_ =  self.get_mls_from_companies()
 
-        if year is not None:
-            where = " WHERE YEAR(m.first_date) = " + str(year)
-            field = field + "_" + str(year)
+        y = self.get_sql_years("m.first_date", years)
+        if years is not None:
+            where = " WHERE " + y["filter"]
 
         sql = """
-            select c.name, count(distinct(m.message_ID)) as %s
+            select c.name, %s count(distinct(m.message_ID)) as %s
             %s %s
-            group by c.id
-            order by %s desc, c.name
-        """ % (field, from_, where, field)
+            group by c.id%s
+            order by %s%s desc, c.name
+        """ % (y["field"], field, from_, where, y["group"], y["order"], field)
         return (sql)
 
     def create_report(self, data_source, destdir):
         if data_source != SCM: return
         self.result(data_source, destdir)
 
+    def get_companies_rows(self, activity, names):
+        """ Row of each company in activity, adding the new ones with zero values """
+        rows = dict([(name, i) for (i, name) in enumerate(activity['name'])])
+        for name in names:
+            if name in rows: continue
+            rows[name] = len(activity['name'])
+            activity['name'].append(name)
+            for metric in activity:
+                if metric == "name": continue
+                activity[metric].append(0)
+        return rows
+
     def add_companies_data (self, activity, data):
         """ Add companies data in an already existing complete companies activity dictionary """
-        new_activity = []
+        self.check_array_values(data)
         field = None
 
-        # Check all data names are already in activity. If not add it with zero value.
-        for item in data['name']:
-            if item not in activity['name']:
-                activity['name'].append(item)
-                for metric in activity:
-                    if metric == "name": continue
-                    activity[metric].append(0)
-
         # Find the name of the field to be uses to get values
         for key in data.keys():
             if key != "name": 
                 field = key
                 break
-        for company in activity['name']:
-            if company in data['name']:
-                index = data['name'].index(company)
-                value = data[field][index]
-                new_activity.append(value)
-            else:
-                new_activity.append(0)
 
-        activity[field] = new_activity
+        rows = self.get_companies_rows(activity, data['name'])
+        values = [0] * len(activity['name'])
+        # With repeated names the first one is used
+        for (name, value) in reversed(zip(data['name'], data[field])):
+            values[rows[name]] = value
+        activity[field] = values
+        return activity
+
+    def add_companies_years_data (self, activity, data, start, end):
+        """ Add the <metric>_<year> fields from data grouped by company and year """
+        self.check_array_values(data)
+        field = None
+
+        for key in data.keys():
+            if key not in ["name", "year"]:
+                field = key
+                break
+
+        rows = self.get_companies_rows(activity, data['name'])
+        for year in range(start, end+1):
+            activity[field + "_" + str(year)] = [0] * len(activity['name'])
+        for (name, year, value) in reversed(zip(data['name'], data['year'], data[field])):
+            activity[field + "_" + str(int(year))][rows[name]] = value
         return activity
 
     def check_array_values(self, data):
@@ -343,35 +321,34 @@ class CompaniesActivity(Analyses):
         if metric not in metrics:
             logging.error(metric + " not supported in companies activity.")
             return
-        for i in range(start, end+1):
-            if metric == "commits":
-                data = self.db.ExecuteQuery(self.get_sql_commits(i))
-            elif metric == "authors":
-                data = self.db.ExecuteQuery(self.get_sql_authors(i))
-            elif metric == "committers":
-                data = self.db.ExecuteQuery(self.get_sql_committers(i))
-            elif metric == "actions":
-                data = self.db.ExecuteQuery(self.get_sql_actions(i))
-            elif metric == "sloc":
-                data = self.db.ExecuteQuery(self.get_sql_sloc(i))
-            elif metric == "lines-added":
-                data = self.db.ExecuteQuery(self.get_sql_lines_added(i))
-                data = self._convert_dict_field(data, "lines_added","lines-added")
-            elif metric == "lines-removed":
-                data = self.db.ExecuteQuery(self.get_sql_lines_removed(i))
-                data = self._convert_dict_field(data, "lines_removed","lines-removed")
-            elif metric == "lines-total":
-                data = self.db.ExecuteQuery(self.get_sql_lines_total(i))
-                data = self._convert_dict_field(data, "lines_total","lines-total")
-            elif metric == "opened":
-                data = self.db.ExecuteQuery(self.get_sql_opened(i))
-            elif metric == "closed":
-                data = self.db.ExecuteQuery(self.get_sql_closed(i))
-            elif metric == "sent":
-                data = self.db.ExecuteQuery(self.get_sql_sent(i))
-            self.check_array_values(data)
-            activity = self.add_companies_data (activity, data)
-
+        # All years at once, grouped by company and year
+        years = (start, end)
+        if metric == "commits":
+            data = self.db.ExecuteQuery(self.get_sql_commits(years))
+        elif metric == "authors":
+            data = self.db.ExecuteQuery(self.get_sql_authors(years))
+        elif metric == "committers":
+            data = self.db.ExecuteQuery(self.get_sql_committers(years))
+        elif metric == "actions":
+            data = self.db.ExecuteQuery(self.get_sql_actions(years))
+        elif metric == "sloc":
+            data = self.db.ExecuteQuery(self.get_sql_sloc(years))
+        elif metric == "lines-added":
+            data = self.db.ExecuteQuery(self.get_sql_lines_added(years))
+            data = self._convert_dict_field(data, "lines_added","lines-added")
+        elif metric == "lines-removed":
+            data = self.db.ExecuteQuery(self.get_sql_lines_removed(years))
+            data = self._convert_dict_field(data, "lines_removed","lines-removed")
+        elif metric == "lines-total":
+            data = self.db.ExecuteQuery(self.get_sql_lines_total(years))
+            data = self._convert_dict_field(data, "lines_total","lines-total")
+        elif metric == "opened":
+            data = self.db.ExecuteQuery(self.get_sql_opened(years))
+        elif metric == "closed":
+            data = self.db.ExecuteQuery(self.get_sql_closed(years))
+        elif metric == "sent":
+            data = self.db.ExecuteQuery(self.get_sql_sent(years))
+        self.add_companies_years_data(activity, data, start, end)
 
     def _convert_dict_field(self, dict, str_old, str_new):
         """ Change field dict names replacing str_old with str_new in the field names"""
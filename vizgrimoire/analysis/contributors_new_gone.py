@@ -27,12 +27,32 @@ from analyses import Analyses
 from query_builder import DSQuery
 from metrics_filter import MetricFilters
 from GrimoireUtils import createJSON, completePeriodIds
+from people_lifecycle import PeopleLifecycle
 
 class ContributorsNewGone(Analyses):
     id = "contributors_new_gone"
     name = "ContributorsNewGone"
     desc = "Number of contributors new and gone in a project."
 
+    lifecycle = None
+
+    def get_analysis_date(self):
+        """People are new or gone at the end of the report, so the results
+           don't depend on the day the analysis is run"""
+        return self.filters.enddate
+
+    def _get_lifecycle(self, data_source, filters, extra_filters = ""):
+        """First and last activity of the identities. With extra filters
+           it is got from the actions, the people lifecycle table is not
+           used for them."""
+        if extra_filters != "":
+            if filters != "": extra_filters += " AND " + filters
+            return PeopleLifecycle(self.db, data_source, extra_filters)
+        if self.lifecycle is None:
+            self.lifecycle = PeopleLifecycle(self.db, data_source, filters)
+            self.lifecycle.refresh()
+        return self.lifecycle
+
     def create_report(self, data_source, destdir):
         ds = data_source.get_name()
         if ds not in ['scm','scr']: return None
@@ -71,68 +91,45 @@ class ContributorsNewGoneSCM(ContributorsNewGone):
     name = "ContributorsNewGoneSCM"
     desc = "Number of contributors new and gone in a project in the code management system."
 
+    def get_lifecycle(self, filters = ""):
+        return self._get_lifecycle("scm", self.db.GetCommitsFiltered(), filters)
+
     # People Code Contrib New and Gone KPI
     def GetNewPeopleListSQL(self, period):
-        filters = self.db.GetCommitsFiltered()
-        if (filters != ""): filters  = " WHERE " + filters
-
-        q_people = """
-            SELECT author_id FROM (SELECT MIN(date) AS first, author_id
-            FROM scmlog
-            %s
-            GROUP BY author_id
-            HAVING DATEDIFF(NOW(), first) <= %s) plist """ % (filters, period)
-        return q_people
+        lifecycle = self.get_lifecycle()
+        return """
+            SELECT pup.people_id AS author_id
+            FROM (%s) plist, people_upeople pup
+            WHERE pup.upeople_id = plist.upeople_id """ % \
+            (lifecycle.get_new_sql(period, self.get_analysis_date()))
 
     def GetGonePeopleListSQL(self,period):
-        filters = self.db.GetCommitsFiltered()
-        if (filters != ""): filters  = " WHERE " + filters
-
-        q_people = """
-            SELECT author_id FROM (SELECT MAX(date) AS last, author_id
-            FROM scmlog
-            %s
-            GROUP BY author_id
-            HAVING DATEDIFF(NOW(), last)>%s) plist """ % (filters, period)
-
-        return q_people
+        lifecycle = self.get_lifecycle()
+        return """
+            SELECT pup.people_id AS author_id
+            FROM (%s) plist, people_upeople pup
+            WHERE pup.upeople_id = plist.upeople_id """ % \
+            (lifecycle.get_gone_sql(period, self.get_analysis_date()))
 
     # Total commits for people in period
     def GetNewPeopleTotalListSQL(self,period, filters=""):
-        scmlog_filters = self.db.GetCommitsFiltered()
-        if (filters != ""):
-            if scmlog_filters != "": filters += " AND " + scmlog_filters
-        else: filters = scmlog_filters
-
-        if (filters != ""): filters  = " WHERE " + filters
-        q_total_period = """
-            SELECT COUNT(id) as total, author_id, MIN(date) AS first
-            FROM scmlog
-            %s
-            GROUP BY author_id
-            HAVING DATEDIFF(NOW(), first) <= %s
+        lifecycle = self.get_lifecycle(filters)
+        return """
+            SELECT actions AS total, pup.people_id AS author_id, first_date AS first
+            FROM (%s) plist, people_upeople pup
+            WHERE pup.upeople_id = plist.upeople_id
             ORDER BY total
-            """ % (filters, period)
-        return q_total_period
+            """ % (lifecycle.get_new_sql(period, self.get_analysis_date()))
 
     # Total commits for people in period
     def GetGonePeopleTotalListSQL(self,period, filters=""):
-        scmlog_filters = self.db.GetCommitsFiltered()
-        if (filters != ""):
-            if scmlog_filters != "": filters += " AND " + scmlog_filters
-        else: filters = scmlog_filters
-
-        if (filters != ""): filters  = " WHERE " + filters
-        q_total_period = """
-            SELECT COUNT(id) as total, author_id, MAX(date) AS last
-            FROM scmlog
-            %s
-            GROUP BY author_id
-            HAVING DATEDIFF(NOW(), last)>%s
+        lifecycle = self.get_lifecycle(filters)
+        return """
+            SELECT actions AS total, pup.people_id AS author_id, last_date AS last
+            FROM (%s) plist, people_upeople pup
+            WHERE pup.upeople_id = plist.upeople_id
             ORDER BY total
-            """ % (filters, period)
-
-        return q_total_period
+            """ % (lifecycle.get_gone_sql(period, self.get_analysis_date()))
 
     # New/Gone people using period as analysis time frame
     def GetNewGoneAuthorsSQL(self,period, fields = "", tables = "", filters = "",
@@ -158,10 +155,11 @@ class ContributorsNewGoneSCM(ContributorsNewGone):
         q= """
         SELECT %s author_id, name, email, date
         FROM %s people, scmlog
-        WHERE %s author_id = people.id AND DATEDIFF(NOW(), date) %s %s
+        WHERE %s author_id = people.id AND DATEDIFF(%s, date) %s %s
               AND author_id IN (%s)
         ORDER BY %s date""" % \
-            (fields, tables, filters, newgone, period, q_people, order_by)
+            (fields, tables, filters, self.get_analysis_date(), newgone, period,
+             q_people, order_by)
         # Order so the group by take the first submission and add total
         # SELECT * FROM ( %s ) nc, (%s) total
         date_field = "first"
@@ -178,7 +176,8 @@ class ContributorsNewGoneSCM(ContributorsNewGone):
     def GetNewGoneAuthors(self, gone = False):
         period = 90 # period of days to be analyzed
         if (gone): period = 180
-        fields = "TIMESTAMPDIFF(SECOND, date, NOW())/(24*3600) AS revtime"
+        fields = "TIMESTAMPDIFF(SECOND, date, %s)/(24*3600) AS revtime" % \
+                 (self.get_analysis_date())
         tables = ""
         filters = ""
         # filters = "status<>'MERGED' AND status<>'ABANDONED'"
@@ -223,14 +222,6 @@ class ContributorsNewGoneSCM(ContributorsNewGone):
         date_leaving = 90 # last contrib 3 months ago
         date_gone = 180 # last contrib 6 months ago
 
-        q_all_people = """
-            SELECT COUNT(scmlog.id) AS total, author_id,
-                   MAX(date) AS date, name, email
-           FROM scmlog, people
-           WHERE people.id = scmlog.author_id
-           GROUP BY author_id ORDER BY total
-           """
-
     #    q_leaving = """
     #        SELECT total, name, email, date, people_upeople.upeople_id  from
     #          (%s) t, people_upeople
@@ -239,20 +230,16 @@ class ContributorsNewGoneSCM(ContributorsNewGone):
     #        ORDER BY date, total DESC
     #        """ % (q_all_people,date_leaving,date_gone)
 
-        filters = self.db.GetCommitsFiltered()
-        if (filters != ""): filters  += " AND "
-
-        q_gone  = """
-            SELECT total, name, email, date, people_upeople.upeople_id from
-              (%s) t, people_upeople
-            WHERE %s DATEDIFF(NOW(),date)>%s
-                AND people_upeople.people_id = author_id
-            ORDER BY date, total DESC
-            """ % (q_all_people, filters, date_gone)
-
-        data = self.db.ExecuteQuery(q_gone)
-
-        return data
+        lifecycle = self.get_lifecycle()
+        q_gone = """
+        SELECT actions AS total, name, email, last_date AS date, plist.upeople_id
+        FROM (%s) plist, people_upeople, people
+        WHERE people_upeople.upeople_id = plist.upeople_id
+            AND people.id = people_upeople.people_id
+        GROUP BY plist.upeople_id
+        ORDER BY date, total DESC
+        """ % (lifecycle.get_gone_sql(date_gone, self.get_analysis_date()))
+        return self.db.ExecuteQuery(q_gone)
 
     def create_report(self, data_source, destdir):
         from SCM import SCM
@@ -329,66 +316,45 @@ class ContributorsNewGoneSCR(ContributorsNewGone):
     name = "ContributorsNewGoneSCR"
     desc = "Number of contributors new and gone in a project in the code revision system."
 
+    def get_lifecycle(self, filters = ""):
+        return self._get_lifecycle("scr", self.db.GetIssuesFiltered(), filters)
+
     # People Code Contrib New and Gone KPI
     def GetNewPeopleListSQL(self, period):
-        filters = self.db.GetIssuesFiltered()
-        if (filters != ""): filters  = " WHERE " + filters
-
-        q_people = """
-            SELECT submitted_by FROM (SELECT MIN(submitted_on) AS first, submitted_by
-            FROM issues
-            %s
-            GROUP BY submitted_by
-            HAVING DATEDIFF(NOW(), first) <= %s) plist """ % (filters, period)
-        return q_people
+        lifecycle = self.get_lifecycle()
+        return """
+            SELECT pup.people_id AS submitted_by
+            FROM (%s) plist, people_upeople pup
+            WHERE pup.upeople_id = plist.upeople_id """ % \
+            (lifecycle.get_new_sql(period, self.get_analysis_date()))
 
     def GetGonePeopleListSQL(self,period):
-        filters = self.db.GetIssuesFiltered()
-        if (filters != ""): filters  = " WHERE " + filters
-
-        q_people = """
-            SELECT submitted_by FROM (SELECT MAX(submitted_on) AS last, submitted_by
-            FROM issues
-            %s
-            GROUP BY submitted_by
-            HAVING DATEDIFF(NOW(), last)>%s) plist """ % (filters, period)
-        return q_people
+        lifecycle = self.get_lifecycle()
+        return """
+            SELECT pup.people_id AS submitted_by
+            FROM (%s) plist, people_upeople pup
+            WHERE pup.upeople_id = plist.upeople_id """ % \
+            (lifecycle.get_gone_sql(period, self.get_analysis_date()))
 
     # Total submissions for people in period
     def GetNewPeopleTotalListSQL(self,period, filters=""):
-        issues_filters = self.db.GetIssuesFiltered()
-        if (filters != ""):
-            if issues_filters != "": filters += " AND " + issues_filters
-        else: filters = issues_filters
-
-        if (filters != ""): filters  = " WHERE " + filters
-        q_total_period = """
-            SELECT COUNT(id) as total, submitted_by, MIN(submitted_on) AS first
-            FROM issues
-            %s
-            GROUP BY submitted_by
-            HAVING DATEDIFF(NOW(), first) <= %s
+        lifecycle = self.get_lifecycle(filters)
+        return """
+            SELECT actions AS total, pup.people_id AS submitted_by, first_date AS first
+            FROM (%s) plist, people_upeople pup
+            WHERE pup.upeople_id = plist.upeople_id
             ORDER BY total
-            """ % (filters, period)
-        return q_total_period
+            """ % (lifecycle.get_new_sql(period, self.get_analysis_date()))
 
     # Total submissions for people in period
     def GetGonePeopleTotalListSQL(self,period, filters=""):
-        issues_filters = self.db.GetIssuesFiltered()
-        if (filters != ""):
-            if issues_filters != "": filters += " AND " + issues_filters
-        else: filters = issues_filters
-
-        if (filters != ""): filters  = " WHERE " + filters
-        q_total_period = """
-            SELECT COUNT(id) as total, submitted_by, MAX(submitted_on) AS last
-            FROM issues
-            %s
-            GROUP BY submitted_by
-            HAVING DATEDIFF(NOW(), last)>%s
+        lifecycle = self.get_lifecycle(filters)
+        return """
+            SELECT actions AS total, pup.people_id AS submitted_by, last_date AS last
+            FROM (%s) plist, people_upeople pup
+            WHERE pup.upeople_id = plist.upeople_id
             ORDER BY total
-            """ % (filters, period)
-        return q_total_period
+            """ % (lifecycle.get_gone_sql(period, self.get_analysis_date()))
 
     # New/Gone people using period as analysis time frame
     def GetNewGoneSubmittersSQL(self,period, fields = "", tables = "", filters = "",
@@ -420,11 +386,12 @@ class ContributorsNewGoneSCR(ContributorsNewGone):
         q= """
         SELECT %s url, submitted_by, name, email, submitted_on, status
         FROM %s people, issues_ext_gerrit, issues
-        WHERE %s submitted_by = people.id AND DATEDIFF(NOW(), submitted_on) %s %s
+        WHERE %s submitted_by = people.id AND DATEDIFF(%s, submitted_on) %s %s
               AND issues_ext_gerrit.issue_id = issues.id
               AND submitted_by IN (%s)
         ORDER BY %s submitted_on""" % \
-            (fields, tables, filters, newgone, period, q_people, order_by)
+            (fields, tables, filters, self.get_analysis_date(), newgone, period,
+             q_people, order_by)
         # Order so the group by take the first submission and add total
         # SELECT * FROM ( %s ) nc, (%s) total
         date_field = "first"
@@ -441,7 +408,8 @@ class ContributorsNewGoneSCR(ContributorsNewGone):
     def GetNewGoneSubmitters(self, gone = False):
         period = 90 # period of days to be analyzed
         if (gone): period = 180
-        fields = "TIMESTAMPDIFF(SECOND, submitted_on, NOW())/(24*3600) AS revtime"
+        fields = "TIMESTAMPDIFF(SECOND, submitted_on, %s)/(24*3600) AS revtime" % \
+                 (self.get_analysis_date())
         tables = ""
         filters = ""
         # filters = "status<>'MERGED' AND status<>'ABANDONED'"
@@ -523,14 +491,6 @@ class ContributorsNewGoneSCR(ContributorsNewGone):
         date_leaving = 90 # last contrib 3 months ago
         date_gone = 180 # last contrib 6 months ago
 
-        q_all_people = """
-            SELECT COUNT(issues.id) AS total, submitted_by,
-                   MAX(submitted_on) AS submitted_on, name, email
-           FROM issues, people
-           WHERE people.id = issues.submitted_by
-           GROUP BY submitted_by ORDER BY total
-           """
-
     #    q_leaving = """
     #        SELECT total, name, email, submitted_on, people_upeople.upeople_id  from
     #          (%s) t, people_upeople
@@ -539,25 +499,21 @@ class ContributorsNewGoneSCR(ContributorsNewGone):
     #        ORDER BY submitted_on, total DESC
     #        """ % (q_all_people,date_leaving,date_gone)
 
-        filters = self.db.GetIssuesFiltered()
-        if (filters != ""): filters  += " AND "
-
-        q_gone  = """
-            SELECT total, name, email, submitted_on, people_upeople.upeople_id from
-              (%s) t, people_upeople
-            WHERE %s DATEDIFF(NOW(),submitted_on)>%s
-                AND people_upeople.people_id = submitted_by
-            ORDER BY submitted_on, total DESC
-            """ % (q_all_people, filters, date_gone)
-
-        data = self.db.ExecuteQuery(q_gone)
-
-        return data
+        lifecycle = self.get_lifecycle()
+        q_gone = """
+        SELECT actions AS total, name, email, last_date AS submitted_on, plist.upeople_id
+        FROM (%s) plist, people_upeople, people
+        WHERE people_upeople.upeople_id = plist.upeople_id
+            AND people.id = people_upeople.people_id
+        GROUP BY plist.upeople_id
+        ORDER BY submitted_on, total DESC
+        """ % (lifecycle.get_gone_sql(date_gone, self.get_analysis_date()))
+        return self.db.ExecuteQuery(q_gone)
 
     def create_report(self, data_source, destdir):
         from SCR import SCR
         if data_source != SCR: return
-        self.result(destdir)
+        self.result(data_source, destdir)
 
     def result(self, data_source, destdir = None):
         from SCR import SCR
@@ -577,7 +533,7 @@ class ContributorsNewGoneSCR(ContributorsNewGone):
         code_contrib["submitters"] = self.GetGoneSubmitters()
         code_contrib["mergers"] = self.GetGoneMergers()
         code_contrib["abandoners"] = self.GetGoneAbandoners()
-        createJSON(code_cdestdir+"/scr-code-contrib-gone.json")
+        createJSON(code_contrib, destdir+"/scr-code-contrib-gone.json")
 
 
         data = self.GetNewSubmittersActivity()
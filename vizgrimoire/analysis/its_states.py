@@ -28,135 +28,299 @@
 #    Santiago Dueñas <sduenas@bitergia.com>
 #
 
+import logging
+
 from analyses import Analyses
 
-from GrimoireUtils import completePeriodIds
+from GrimoireUtils import check_array_values, completePeriodIds, \
+    completePeriodIdsMulti, period_fields
 
 
 class TicketsStates(Analyses):
-    """Analysis of issues states"""
+    """Analysis of issues states
+
+    The replay of the issues log used for the backlog is checkpointed in
+    the ITS database: the state of each ticket, the tickets in each state
+    at the end of the periods already closed and the last log entry
+    replayed. Next runs only replay the log entries added after it.
+    """
 
     id = "tickets_states"
     name = "Tickets states"
     desc = "Analysis of issues states"
 
-    def __get_sql_issues_states__(self, backend_type):
-        """Returns the log of states"""
-
+    checkpoint_tables = {
+        "tickets_states_checkpoint" : """
+            checkpoint VARCHAR(64) NOT NULL PRIMARY KEY,
+            last_id INT NOT NULL,
+            last_udate INT NOT NULL,
+            enddate VARCHAR(32) NOT NULL,
+            log_rows INT NOT NULL""",
+        "tickets_states_issues" : """
+            checkpoint VARCHAR(64) NOT NULL,
+            issue_id INT NOT NULL,
+            status VARCHAR(64) NOT NULL,
+            PRIMARY KEY (checkpoint, issue_id)""",
+        "tickets_states_backlog" : """
+            checkpoint VARCHAR(64) NOT NULL,
+            unixtime INT NOT NULL,
+            status VARCHAR(64) NOT NULL,
+            tickets INT NOT NULL,
+            PRIMARY KEY (checkpoint, unixtime, status)"""
+    }
+
+    def __get_log_table__(self, backend_type):
         if backend_type == "lp": backend_type = "launchpad" # openstack
+        return "issues_log_" + backend_type
 
-        q = """SELECT issue_id, status, UNIX_TIMESTAMP(date) udate
-               FROM issues_log_%s
+    def __get_sql_issues_states__(self, backend_type, checkpoint = None):
+        """Returns the log of states, only the entries not replayed
+           yet if there is a checkpoint"""
+
+        q = """SELECT id, issue_id, status, UNIX_TIMESTAMP(date) udate
+               FROM %s
                WHERE date >= %s AND date < %s
-               ORDER BY udate""" % (backend_type, self.filters.startdate, self.filters.enddate)
+            """ % (self.__get_log_table__(backend_type),
+                   self.filters.startdate, self.filters.enddate)
+        if checkpoint is not None:
+            q += " AND (id > %s OR date >= '%s') " % (checkpoint['last_id'],
+                                                      checkpoint['enddate'])
+        q += " ORDER BY udate, id"
         return q
 
-    def __get_sql_current__(self, state, evolutionary):
-        """This function returns the evolution or agg number of issues state"""
-
-        fields = " count(distinct(id)) as `current_" + state + "` "
-        tables = " issues i "
-        filters = " status = '" + state.replace("'", "''") + "' "
-
-        q = self.db.BuildQuery(self.filters.period, self.filters.startdate,
-                               self.filters.enddate, " i.submitted_on ",
-                               fields, tables, filters, evolutionary)
+    def __get_sql_current__(self):
+        """This function returns the evolution of the number of issues
+           in each state"""
+
+        period_field = self.db.GetSQLPeriodField(self.filters.period,
+                                                 "i.submitted_on")
+        q = """SELECT status, %s, count(distinct(id)) AS current
+               FROM issues i
+               WHERE i.submitted_on >= %s AND i.submitted_on < %s
+               GROUP BY status, %s
+            """ % (period_field, self.filters.startdate, self.filters.enddate,
+                   period_field.split(" AS ")[1])
         return q
 
     def __get_sql_state_types__(self, backend_type):
         """This function returns the list of states available on the database"""
 
-        if backend_type == "lp": backend_type = "launchpad" # openstack
-
         q = """SELECT DISTINCT(status) status
-               FROM issues_log_%s""" % backend_type
+               FROM %s""" % self.__get_log_table__(backend_type)
         return q
 
+    def __get_checkpoint_id__(self, backend_type):
+        return "%s %s %s" % (backend_type, self.filters.period,
+                             self.filters.startdate.strip("'"))
+
+    def _create_checkpoint_tables(self):
+        try:
+            for table, columns in self.checkpoint_tables.items():
+                q = "CREATE TABLE IF NOT EXISTS %s (%s)" % (table, columns)
+                self.db.ExecuteUpdate(q)
+        except Exception, e:
+            logging.warning("Tickets states replayed without checkpoint: %s" % e)
+            return False
+        return True
+
+    def _load_checkpoint(self, checkpoint_id, backend_type):
+        """Returns the replay state saved for checkpoint_id or None if
+           there isn't a valid one for the current filters"""
+
+        q = """SELECT last_id, last_udate, enddate, log_rows
+               FROM tickets_states_checkpoint
+               WHERE checkpoint = '%s'""" % checkpoint_id
+        res = self.db.ExecuteQuery(q)
+        if not 'last_id' in res or isinstance(res['last_id'], list):
+            return None
+        if res['enddate'] > self.filters.enddate.strip("'"):
+            return None
+
+        # Entries already replayed removed from the log invalidate it
+        q = """SELECT COUNT(*) AS log_rows FROM %s
+               WHERE date >= %s AND date < '%s' AND id <= %s
+            """ % (self.__get_log_table__(backend_type),
+                   self.filters.startdate, res['enddate'], res['last_id'])
+        if self.db.ExecuteQuery(q)['log_rows'] != res['log_rows']:
+            return None
+
+        checkpoint = {'last_id': int(res['last_id']),
+                      'last_udate': int(res['last_udate']),
+                      'enddate': res['enddate'],
+                      'log_rows': int(res['log_rows']),
+                      'tickets': {}, 'backlog': {}}
+
+        q = """SELECT issue_id, status FROM tickets_states_issues
+               WHERE checkpoint = '%s'""" % checkpoint_id
+        res = check_array_values(self.db.ExecuteQuery(q))
+        for issue_id, status in zip(res['issue_id'], res['status']):
+            checkpoint['tickets'][issue_id] = status
+
+        q = """SELECT unixtime, status, tickets FROM tickets_states_backlog
+               WHERE checkpoint = '%s'""" % checkpoint_id
+        res = check_array_values(self.db.ExecuteQuery(q))
+        for unixtime, status, tickets in zip(res['unixtime'], res['status'],
+                                             res['tickets']):
+            checkpoint['backlog'].setdefault(int(unixtime), {})[status] = tickets
+
+        return checkpoint
+
+    def _save_checkpoint(self, checkpoint_id, checkpoint, issues, backlog,
+                         replace):
+        """Saves the replay state. The checkpoint row is removed while the
+           tickets and backlog are updated so a failed save is not used."""
+
+        key = "checkpoint = '%s'" % checkpoint_id
+        self.db.ExecuteUpdate("DELETE FROM tickets_states_checkpoint WHERE " + key,
+                              table = "tickets_states_checkpoint")
+        if replace:
+            for table in ["tickets_states_issues", "tickets_states_backlog"]:
+                self.db.ExecuteUpdate("DELETE FROM %s WHERE %s" % (table, key),
+                                      table = table)
+
+        rows = [(checkpoint_id, issue_id, status)
+                for issue_id, status in issues.items()]
+        if len(rows) > 0:
+            q = """REPLACE INTO tickets_states_issues (checkpoint, issue_id, status)
+                   VALUES (%s, %s, %s)"""
+            self.db.ExecuteUpdate(q, rows, "tickets_states_issues")
+
+        rows = [(checkpoint_id, unixtime, status, tickets)
+                for unixtime in sorted(backlog)
+                for status, tickets in backlog[unixtime].items()]
+        if len(rows) > 0:
+            q = """REPLACE INTO tickets_states_backlog (checkpoint, unixtime, status, tickets)
+                   VALUES (%s, %s, %s, %s)"""
+            self.db.ExecuteUpdate(q, rows, "tickets_states_backlog")
+
+        q = """INSERT INTO tickets_states_checkpoint
+               (checkpoint, last_id, last_udate, enddate, log_rows)
+               VALUES (%s, %s, %s, %s, %s)"""
+        row = (checkpoint_id, checkpoint['last_id'], checkpoint['last_udate'],
+               checkpoint['enddate'], checkpoint['log_rows'])
+        self.db.ExecuteUpdate(q, [row], "tickets_states_checkpoint")
+
     def get_backlog(self, states, backend_type):
         import datetime
         import time
 
-        def update_backlog_count(current_count, backlog_count):
-            for state, count in current_count.items():
-                backlog_count[state].append(count)
-
         # Dict to store the results
         data = {self.filters.period : [self.filters.startdate, self.filters.enddate]}
         data = completePeriodIds(data, self.filters.period,
                                  self.filters.startdate, self.filters.enddate)
-
-        tickets_states = {}
-        current_status = {}
-
-        # Initialize structures
         for state in states:
-            current_status[state] = 0
             data[state] = []
 
-        # Request issues log
-        query = self.__get_sql_issues_states__(backend_type)
-        issues_log = self.db.ExecuteQuery(query)
+        checkpoint_id = self.__get_checkpoint_id__(backend_type)
+        use_checkpoint = self._create_checkpoint_tables()
+        checkpoint = None
+        if use_checkpoint:
+            checkpoint = self._load_checkpoint(checkpoint_id, backend_type)
+
+        # Request issues log, only the new entries if there is a checkpoint
+        query = self.__get_sql_issues_states__(backend_type, checkpoint)
+        issues_log = check_array_values(self.db.ExecuteQuery(query))
+        if checkpoint is not None and len(issues_log['udate']) > 0 and \
+            int(issues_log['udate'][0]) < checkpoint['last_udate']:
+            # New entries before the last one replayed: replay it all
+            logging.info("Tickets states checkpoint outdated by old log entries")
+            checkpoint = None
+            query = self.__get_sql_issues_states__(backend_type)
+            issues_log = check_array_values(self.db.ExecuteQuery(query))
+
+        replace = checkpoint is None
+        if checkpoint is None:
+            checkpoint = {'last_id': 0, 'last_udate': 0, 'log_rows': 0,
+                          'tickets': {}, 'backlog': {}}
+        tickets_states = checkpoint['tickets']
+        backlog = checkpoint['backlog']
+
+        # Tickets in each state, not only the predefined ones
+        current_status = {}
+        for state in tickets_states.values():
+            current_status[state] = current_status.get(state, 0) + 1
 
-        periods = list(data['unixtime'][1:])
+        log_len = len(issues_log['issue_id'])
+        last_udate = checkpoint['last_udate']
+        if log_len > 0:
+            last_udate = max(last_udate, int(issues_log['udate'][-1]))
 
+        periods = [int(unixtime) for unixtime in data['unixtime'][1:]]
+        closed_periods = set([end for end in periods if end <= last_udate])
         # Add a one period more to avoid problems with
         # data from this period
         last_date = int(time.mktime(datetime.datetime.strptime(
                         self.filters.enddate, "'%Y-%m-%d'").timetuple()))
         periods.append(last_date)
 
-        end_period = int(periods.pop(0))
-
-        for i in range(len(issues_log['issue_id'])):
-            issue_id = issues_log['issue_id'][i]
-            issue_state = issues_log['status'][i]
-            issue_date = int(issues_log['udate'][i])
-
-            # Fill periods without changes on issues states
-            while issue_date >= end_period:
-                end_period = int(periods.pop(0))
-                update_backlog_count(current_status, data)
-
-            if issue_id not in tickets_states:
-                # Add ticket to the status dict
-                tickets_states[issue_id] = issue_state
-            elif tickets_states[issue_id] != issue_state:
-                # Decrease the count of tickets with the old state
-                # only for predefined states
-                old_state = tickets_states[issue_id]
-                if old_state in states:
-                    current_status[old_state] -= 1
-
-                # Set new status
-                tickets_states[issue_id] = issue_state
+        changed_issues = {}
+        new_backlog = {}
+        i = 0
+        for end_period in periods + [None]:
+            if end_period in backlog:
+                # Period closed and replayed in a previous run
+                backlog_count = backlog[end_period]
             else:
-                continue # Ignore equal states
-
-            # Increase the count of tickets with issue_state
-            # only for predefined states
-            if issue_state in states:
-                current_status[issue_state] += 1
+                while i < log_len and (end_period is None or
+                                       int(issues_log['udate'][i]) < end_period):
+                    issue_id = issues_log['issue_id'][i]
+                    issue_state = issues_log['status'][i]
+                    i += 1
+
+                    old_state = tickets_states.get(issue_id)
+                    if old_state == issue_state: continue # Ignore equal states
+                    if old_state is not None:
+                        current_status[old_state] -= 1
+                    tickets_states[issue_id] = issue_state
+                    changed_issues[issue_id] = issue_state
+                    current_status[issue_state] = current_status.get(issue_state, 0) + 1
+
+                if end_period is None: break
+                backlog_count = dict([(state, current_status.get(state, 0))
+                                      for state in states])
+                # No new log entries can change a period ended before
+                # the last entry replayed
+                if end_period in closed_periods:
+                    new_backlog[end_period] = backlog_count
 
-        # End of the loop. Add the last period values to the backlog count
-        update_backlog_count(current_status, data)
-
-        # Fill remaining periods without changes on issues states
-        while periods:
-            periods.pop(0)
             for state in states:
-                data[state].append(data[state][-1])
+                data[state].append(backlog_count.get(state, 0))
+
+        if use_checkpoint:
+            if log_len > 0:
+                checkpoint['last_id'] = max(checkpoint['last_id'],
+                                            max([int(id) for id in issues_log['id']]))
+            checkpoint['last_udate'] = last_udate
+            checkpoint['enddate'] = self.filters.enddate.strip("'")
+            checkpoint['log_rows'] += log_len
+            if replace: changed_issues = tickets_states
+            try:
+                self._save_checkpoint(checkpoint_id, checkpoint, changed_issues,
+                                      new_backlog, replace)
+            except Exception, e:
+                logging.warning("Can't save tickets states checkpoint: %s" % e)
 
         return data
 
-
     def get_current_states(self, states):
-        current_states = {}
+        query = self.__get_sql_current__()
+        data = check_array_values(self.db.ExecuteQuery(query))
+        period = period_fields[self.filters.period]
 
+        current_states = {}
         for state in states:
-            query = self.__get_sql_current__(state, True)
-            data = self.db.ExecuteQuery(query)
-            data = completePeriodIds(data, self.filters.period,
-                                     self.filters.startdate, self.filters.enddate)
+            current_states[state] = {period: [], 'current_' + state: []}
+        for status, period_id, current in zip(data['status'], data[period],
+                                              data['current']):
+            if status not in current_states: continue
+            current_states[status][period].append(period_id)
+            current_states[status]['current_' + status].append(current)
+
+        series = completePeriodIdsMulti([current_states[state] for state in states],
+                                        self.filters.period,
+                                        self.filters.startdate, self.filters.enddate)
+        current_states = {}
+        for data in series:
             current_states = dict(current_states.items() + data.items())
 
         return current_states
@@ -33,6 +33,9 @@
 
 
 import logging
+
+import numpy
+
 from analyses import Analyses
 from query_builder import DSQuery
 from metrics_filter import MetricFilters
@@ -55,85 +58,6 @@ class OnionTransitions(Analyses):
             data = self.result(data_source)
         return data
 
-    def _get_person_info(self, upeople_id, from_date, to_date, data_source = None):
-        # gets the person info in two queries, first it obtains the name and later
-        # the number of ocurrences if any. If not, it sets ocurrences = 0
-        person_data = {}
-        if (data_source.get_name() == "scm"):
-            logging.info("Warning: current queries are counting merges")
-            # q = " select pup.upeople_id as uid, p.name, p.email, "+\
-            #     "        (count(distinct(s.id))) as commits "+\
-            #     " from scmlog s, "+\
-            #     "      actions a, "+\
-            #     "      people_upeople pup, "+\
-            #     "      people p "+\
-            #     " where s.id = a.commit_id and "+\
-            #     "       s.date>="+ from_date+" and "+\
-            #     "       s.date<="+ to_date+" and "+\
-            #     "       s.author_id = pup.people_id and "+\
-            #     "       s.author_id = p.id and "+\
-            #     "       p.email <> '%gerrit@%' and "+\
-            #     "       p.email <> '%jenkins@%' and "+\
-            #     "       pup.upeople_id = " + str(upeople_id) +\
-            #     " group by pup.upeople_id "+\
-            #     " order by commits desc; "
-            q0 = "select name, email from people, people_upeople pup "+\
-                "where people.id = pup.people_id and pup.upeople_id = " + str(upeople_id) + " "+\
-                " LIMIT 1"
-            
-            q1 = " select pup.upeople_id as uid, p.name, p.email, "+\
-                "        (count(distinct(s.id))) as commits "+\
-                " from scmlog s, "+\
-                "      people_upeople pup, "+\
-                "      people p "+\
-                " where s.date>="+ from_date+" and "+\
-                "       s.date<"+ to_date+" and "+\
-                "       s.author_id = pup.people_id and "+\
-                "       s.author_id = p.id and "+\
-                "       p.email <> '%gerrit@%' and "+\
-                "       p.email <> '%jenkins@%' and "+\
-                "       pup.upeople_id = " + str(upeople_id) +\
-                " group by pup.upeople_id "+\
-                " order by commits desc; "
-
-            aux = self.db.ExecuteQuery(q0)
-            person_data["name"] = aux["name"]
-            person_data["email"] = aux["email"]
-            aux = self.db.ExecuteQuery(q1)
-            if (type(aux["commits"]) == list):
-                person_data["commits"] = 0
-            else:
-                person_data["commits"] = aux["commits"]
-
-        elif (data_source.get_name() == "qaforums"):
-            logging.info("Warning: qaforums is not using matched identities")
-            q0 = "SELECT username as name from people where identifier = " + str(upeople_id)+ " "+\
-                " LIMIT 1"
-            
-            q1 = "SELECT identifier, username as name, COUNT(*) as messages from ("+\
-                "(select p.identifier as identifier, p.username, q.added_at as date"+\
-                "  from questions q, people p"+\
-                "  where q.author_identifier=p.identifier)"+\
-                "union"+\
-                "(select p.identifier as identifier, p.username, a.submitted_on as date"+\
-                "  from answers a, people p"+\
-                "  where a.user_identifier=p.identifier)"+\
-                "union"+\
-                "(select p.identifier as identifier, p.username, c.submitted_on as date"+\
-                "  from comments c, people p"+\
-                "  where c.user_identifier=p.identifier)) t "+\
-                "WHERE date>="+ from_date +" AND date<" + to_date +" "+\
-                " AND identifier = "+ str(upeople_id) + " "+\
-                "group by identifier"
-            aux = self.db.ExecuteQuery(q0)
-            person_data["name"] = aux["name"]
-            aux = self.db.ExecuteQuery(q1)
-            if (type(aux["messages"]) == list):
-                person_data["messages"] = 0
-            else:
-                person_data["messages"] = aux["messages"]
-        return(person_data)
-
     def result(self, data_source = None, offset_days = None):
         if data_source.get_name() != "scm" \
             and data_source.get_name() != "qaforums": return None
@@ -161,15 +85,17 @@ class OnionTransitions(Analyses):
             timedelta = dt_end - dt_start
             new_startdate = dt_start - timedelta
             past_from_date = "'" + new_startdate.strftime("%Y-%m-%d") + "'"
-        
-        # getting the data
-        #print("current %s - %s" % (cur_from_date, cur_to_date))
-        current_groups = self._activity_groups(cur_from_date, cur_to_date, data_source)
+
+        # getting the activity of all people in the windows
+        windows = {"past": (past_from_date, past_to_date),
+                   "cur": (cur_from_date, cur_to_date),
+                   "filter": (self.filters.startdate, self.filters.enddate)}
+        people, total = self._get_activity(windows, data_source)
+        current_groups = self._activity_groups(people, total, "cur", data_source)
         cur_core = current_groups["core"]        
         cur_regular = current_groups["regular"]
         cur_occasional = current_groups["occasional"]
-        #print("past %s - %s" % (past_from_date, past_to_date))
-        past_groups = self._activity_groups(past_from_date, past_to_date, data_source)
+        past_groups = self._activity_groups(people, total, "past", data_source)
         past_core = past_groups["core"]
         past_regular = past_groups["regular"]
         past_occasional = past_groups["occasional"]
@@ -186,106 +112,82 @@ class OnionTransitions(Analyses):
         groups = {"core":cur_core, "up_core":up_core, "up_reg":up_reg,
                   "down_reg":down_reg, "down_occ":down_occ}
 
+        # here we define what we export in each group
+        if (data_source.get_name() == "scm"):
+            ident = "uid"
+            fields = {"name":"name", "email":"email", "commits":"filter"}
+        elif (data_source.get_name() == "qaforums"):
+            ident = "identifier"
+            fields = {"name":"name", "messages":"filter"}
+        person_pos = dict([(person, i) for i, person in enumerate(people[ident])])
+
         result = {}
         for g in groups:
-            #here we define what we export in each group
-            if (data_source.get_name() == "scm"):
-                result[g] = {"name":[],"email":[],"commits":[]}
-            elif (data_source.get_name() == "qaforums"):
-                result[g] = {"name":[],"messages":[]}
-
+            result[g] = dict([(field, []) for field in fields])
             # and .. we get the data
             for person in groups[g]:
-                user_data = self._get_person_info(person, self.filters.startdate, self.filters.enddate, data_source)
-                result[g]["name"].append(user_data["name"])
-                if (data_source.get_name() == "scm"):
-                    result[g]["email"].append(user_data["email"])
-                    result[g]["commits"].append(user_data["commits"])
-                elif (data_source.get_name() == "qaforums"):
-                    #print(user_data)
-                    result[g]["messages"].append(user_data["messages"])
-                #print user_data
-                #print " --> "+ str(person)
-                #result[g]["uid"].append(user_data["uid"])
-        
-        # print("core VVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVV")
-        # c_set = []
-        # a_set = []
-        # for c in cur_core:
-        #      aux = self._get_person_info(c, cur_from_date, cur_to_date, data_source)
-        #      c_set.append(aux["commits"])
-        # c_set.sort()
-        # print c_set
-        # print("regular ***********************************************")
-        # for a in cur_regular:
-        #      aux2 = self._get_person_info(a, cur_from_date, cur_to_date, data_source)
-        #      a_set.append(aux2["commits"])
-        # a_set.sort()
-        # print a_set
-
-        # print("core 22222222222222 VVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVV")
-        # c_set = []
-        # a_set = []
-        # for c in cur_core:
-        #      aux = self._get_person_info(c, self.filters.startdate, self.filters.enddate, data_source)
-        #      c_set.append(aux["commits"])
-        # c_set.sort()
-        # print c_set
-        # print("regular 2222222222222 ***********************************************")
-        # for a in cur_regular:
-        #      aux2 = self._get_person_info(a, self.filters.startdate, self.filters.enddate, data_source)
-        #      a_set.append(aux2["commits"])
-        # a_set.sort()
-        # print a_set
-        
+                i = person_pos[person]
+                for field in fields:
+                    result[g][field].append(people[fields[field]][i])
 
         return (result)
 
-        # print("PAST core VVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVV")
-        # c_set = []
-        # a_set = []
-        # for c in past_core:
-        #     aux = self.get_person_info(c, new_startdate, self.filters.startdate, data_source)
-        #     c_set.append(aux["commits"])
-        # c_set.sort()
-        # print c_set
-        # print("PAST regular ***********************************************")
-        # for a in past_regular:
-        #     aux2 = self.get_person_info(a, new_startdate, self.filters.startdate, data_source)
-        #     a_set.append(aux2["commits"])
-        # a_set.sort()
-        # print a_set
-
-    def _get_total_messages_query(self, from_date, to_date):
-        q = "SELECT "+\
-        "(select COUNT(*) from questions WHERE "+\
-        " added_at>="+ from_date +" AND added_at<" + to_date + ") + "+\
-        "(select COUNT(*) from comments WHERE "+\
-        " submitted_on>="+ from_date +" AND submitted_on<" + to_date + ") + "+\
-        "(SELECT COUNT(*) FROM answers WHERE "+\
-        " submitted_on>="+ from_date +" AND submitted_on<" + to_date + ")"+\
-        "as total;"
+    @staticmethod
+    def _get_windows_fields(windows, date, value, distinct = False):
+        # one field per window counting the values with date in it
+        fields = []
+        for name in sorted(windows):
+            from_date, to_date = windows[name]
+            count = "CASE WHEN %s>=%s AND %s<%s THEN %s END" % \
+                (date, from_date, date, to_date, value)
+            if distinct: count = "DISTINCT(" + count + ")"
+            fields.append("COUNT(%s) AS %s" % (count, name))
+        return ", ".join(fields)
+
+    @staticmethod
+    def _get_windows_dates(windows):
+        from_date = min([window[0] for window in windows.values()])
+        to_date = max([window[1] for window in windows.values()])
+        return from_date, to_date
+
+    def _get_total_messages_query(self, windows):
+        from_date, to_date = self._get_windows_dates(windows)
+        q = "SELECT " + self._get_windows_fields(windows, "date", "1") +\
+        " from ("+\
+        "(select added_at as date from questions WHERE "+\
+        " added_at>="+ from_date +" AND added_at<" + to_date + ") "+\
+        "union all "+\
+        "(select submitted_on as date from comments WHERE "+\
+        " submitted_on>="+ from_date +" AND submitted_on<" + to_date + ") "+\
+        "union all "+\
+        "(SELECT submitted_on as date FROM answers WHERE "+\
+        " submitted_on>="+ from_date +" AND submitted_on<" + to_date + ")) t"
         return(q)
         
-    def _get_personal_messages_query(self, from_date, to_date):
-        q = "SELECT identifier, COUNT(*) as messages from ("+\
-        "(select p.identifier as identifier, q.added_at as date"+\
+    def _get_personal_messages_query(self, windows):
+        logging.info("Warning: qaforums is not using matched identities")
+        from_date, to_date = self._get_windows_dates(windows)
+        q = "SELECT identifier, username as name, " +\
+        self._get_windows_fields(windows, "date", "1") +\
+        " from ("+\
+        "(select p.identifier as identifier, p.username, q.added_at as date"+\
         "  from questions q, people p"+\
         "  where q.author_identifier=p.identifier)"+\
         "union"+\
-        "(select p.identifier as identifier, a.submitted_on as date"+\
+        "(select p.identifier as identifier, p.username, a.submitted_on as date"+\
         "  from answers a, people p"+\
         "  where a.user_identifier=p.identifier)"+\
         "union"+\
-        "(select p.identifier as identifier, c.submitted_on as date"+\
+        "(select p.identifier as identifier, p.username, c.submitted_on as date"+\
         "  from comments c, people p"+\
         "  where c.user_identifier=p.identifier)) t "+\
         "WHERE date>="+ from_date +" AND date<" + to_date +" "+\
-        "group by identifier order by messages desc"
+        "group by identifier"
         return(q)
     
-    def _get_total_commits_query(self, from_date, to_date):
+    def _get_total_commits_query(self, windows):
         logging.info("Warning: current queries are counting merges")
+        from_date, to_date = self._get_windows_dates(windows)
         # uncomment this query in order to remove the queries
         # q = "select count(distinct(s.id)) as total "+\
         #      "from scmlog s, people p, actions a "+\
@@ -295,8 +197,8 @@ class OnionTransitions(Analyses):
         #      "      s.id = a.commit_id and "+\
         #      "      s.date>="+ from_date +" and "+\
         #      "      s.date<="+ to_date+";"
-        q = "select count(distinct(s.id)) as total "+\
-             "from scmlog s, people p "+\
+        q = "select " + self._get_windows_fields(windows, "s.date", "s.id", True) +\
+             " from scmlog s, people p "+\
              "where s.author_id = p.id and "+\
              "      p.email <> '%gerrit@%' and "+\
              "      p.email <> '%jenkins@%' and "+\
@@ -304,8 +206,9 @@ class OnionTransitions(Analyses):
              "      s.date<"+ to_date+";"
         return(q)
 
-    def _get_personal_commits_query(self, from_date, to_date):
+    def _get_personal_commits_query(self, windows):
         logging.info("Warning: current queries are counting merges")
+        from_date, to_date = self._get_windows_dates(windows)
         # uncomment this query in order to remove the queries
         # q = " select pup.upeople_id as uid, p.name, p.email, "+\
         #     "        (count(distinct(s.id))) as commits "+\
@@ -322,9 +225,9 @@ class OnionTransitions(Analyses):
         #     "       p.email <> '%jenkins@%' "+\
         #     " group by pup.upeople_id "+\
         #     " order by commits desc; "
-        # Database access: developer, %commits
+        # Database access: developer, commits in each window
         q = " select pup.upeople_id as uid, p.name, p.email, "+\
-            "        (count(distinct(s.id))) as commits "+\
+            self._get_windows_fields(windows, "s.date", "s.id", True) +\
             " from scmlog s, "+\
             "      people_upeople pup, "+\
             "      people p "+\
@@ -334,103 +237,55 @@ class OnionTransitions(Analyses):
             "       s.author_id = p.id and "+\
             "       p.email <> '%gerrit@%' and "+\
             "       p.email <> '%jenkins@%' "+\
-            " group by pup.upeople_id "+\
-            " order by commits desc; "
+            " group by pup.upeople_id "
         return(q)
 
-    def _activity_groups(self, from_date, to_date, data_source = None):
+    def _get_activity(self, windows, data_source):
+        """ Activity of each person and total activity in each window """
+        if data_source.get_name() == "scm":
+            total = self.db.ExecuteQuery(self._get_total_commits_query(windows))
+            people = self.db.ExecuteQuery(self._get_personal_commits_query(windows))
+        elif data_source.get_name() == "qaforums":
+            total = self.db.ExecuteQuery(self._get_total_messages_query(windows))
+            people = self.db.ExecuteQuery(self._get_personal_messages_query(windows))
+
+        for field in people:
+            if not isinstance(people[field], list):
+                people[field] = [people[field]]
+        return people, total
+
+    @staticmethod
+    def _onion_layers(activity, total):
+        """ Positions of core, regular and occasional people
+
+        People are sorted by activity and their cumulative share of the
+        total is used: core people reach the 80%, regular ones the 95% and
+        the rest are occasional.
+        """
+        activity = numpy.array(activity, dtype=float)
+        active = numpy.flatnonzero(activity > 0)
+        order = active[numpy.argsort(-activity[active], kind='mergesort')]
+        cont = numpy.cumsum((activity[order] / total) * 100)
+
+        core_end = numpy.searchsorted(cont, 80) + 1
+        regular_end = max(core_end, numpy.searchsorted(cont, 95)) + 1
+        return (order[:core_end], order[core_end:regular_end],
+                order[regular_end:])
+
+    def _activity_groups(self, people, total, window, data_source = None):
         if data_source.get_name() != "scm" and \
           data_source.get_name() != "qaforums": return None
 
-        groups = {}
-
-        # Init of structure to be returned
-        community = {}
-        community['core'] = None
-        community['regular'] = None
-        community['occasional'] = None
-
-        if data_source.get_name() == "scm":        
-            q = self._get_total_commits_query(from_date, to_date)
-            total = self.db.ExecuteQuery(q)
-            total_commits = float(total['total'])
-            q = self._get_personal_commits_query(from_date, to_date)
-            people = self.db.ExecuteQuery(q)
-            if not isinstance(people['commits'], list):
-                people['commits'] = [people['commits']]
-            # this is a list. Operate over the list
-            people['commits'] = [((commits / total_commits) * 100) for commits in people['commits']]
-        elif data_source.get_name() == "qaforums":
-            q = self._get_total_messages_query(from_date, to_date)
-            total = self.db.ExecuteQuery(q)
-            total_messages = float(total['total'])
-            q = self._get_personal_messages_query(from_date, to_date)
-            people = self.db.ExecuteQuery(q)
-            if not isinstance(people['messages'], list):
-                people['messages'] = [people['messages']]
-            # this is a list. Operate over the list
-            people['messages'] = [((messages / total_messages) * 100) for messages in people['messages']]
-
-        #print(people)
-
-        # Calculating number of core, regular and occasional developers
-        cont = 0
-        ncore = 0
-        core_f = True # flag
-        nregular = 0
-        regular_f = True  # flag
-        noccasional = 0
-        ndevs = 0
-        core_group = set()
-        reg_group = set()
-        occ_group = set()
-        array_cont = 0        
-
         # field used to browse people dict()
         if data_source.get_name() == "scm":
-            field = 'commits'
             ident = 'uid'
         elif data_source.get_name() == "qaforums":
-            field = 'messages'
             ident = 'identifier'
-        
-        #for p in people:
-        for value in people[field]:
-            cont = cont + value
-            ndevs = ndevs + 1
-            dev_email = people[ident][array_cont]
-
-            if (core_f):
-                core_group.add(dev_email)
-                if (cont >= 80):
-                    core_f = False
-                    ncore = ndevs
-            elif (regular_f):
-                reg_group.add(dev_email)
-                if (cont >= 95):
-                    regular_f = False
-                    nregular = ndevs
-            else:
-                occ_group.add(dev_email)
-                
-
-            array_cont += 1
-
-        noccasional = ndevs - nregular
-        nregular = nregular - ncore
-
-        # print("core_group len = %s" % len(core_group))
-        # print("reg_group len = %s" % len(reg_group))
-        # print("occ_group len = %s" % len(occ_group))
-
-        # inserting values in variable
-        community['core'] = ncore
-        community['regular'] = nregular
-        community['occasional'] = noccasional
 
-        #print(community)
+        groups = {"core": set(), "regular": set(), "occasional": set()}
+        if not total[window]: return groups
 
-        groups["core"]= core_group
-        groups["regular"]=reg_group
-        groups["occasional"]=occ_group
+        layers = self._onion_layers(people[window], float(total[window]))
+        for group, positions in zip(["core", "regular", "occasional"], layers):
+            groups[group] = set([people[ident][i] for i in positions])
         return(groups)
@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+
+# Copyright (C) 2014 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+#
+# Authors:
+#     Alvaro del Castillo <acs@bitergia.com>
+#
+
+""" First and last activity of each person in a data source """
+
+import logging
+
+class PeopleLifecycle(object):
+    """First date, last date and number of actions of each unique identity
+
+    The lifecycle is kept in the people_lifecycle_<data source> table of the
+    data source database, keyed by upeople_id. It is refreshed incrementally:
+    only the actions added since the last refresh are aggregated. If actions
+    already aggregated are removed, the identities change or the filters of
+    the actions are different, it is built again. Refreshes hold a named
+    lock, so concurrent ones don't aggregate the same actions twice. If the
+    table can't be refreshed the queries aggregate the actions instead, with
+    the same results.
+    """
+
+    # data source: (actions table, id field, person field, date field)
+    sources = {"scm": ("scmlog", "id", "author_id", "date"),
+               "scr": ("issues", "id", "submitted_by", "submitted_on")}
+
+    state_table = "people_lifecycle_state"
+    state_columns = """
+        source VARCHAR(32) NOT NULL PRIMARY KEY,
+        filters VARCHAR(255) NOT NULL,
+        identities VARCHAR(64) NOT NULL,
+        last_id INT NOT NULL,
+        actions INT NOT NULL"""
+    lifecycle_columns = """
+        upeople_id INT NOT NULL PRIMARY KEY,
+        first_date DATETIME NOT NULL,
+        last_date DATETIME NOT NULL,
+        actions INT NOT NULL,
+        INDEX (first_date),
+        INDEX (last_date)"""
+
+    def __init__(self, db, data_source, filters = ""):
+        """filters are conditions on the actions table, like the ones from
+           GetCommitsFiltered or GetIssuesFiltered"""
+        self.db = db
+        self.data_source = data_source
+        self.filters = filters.strip()
+        (self.actions, self.id_field, self.people_field, self.date_field) = \
+            PeopleLifecycle.sources[data_source]
+        self.table = "people_lifecycle_" + data_source
+        # The table once refreshed
+        self.lifecycle = "(%s) lifecycle" % self.get_lifecycle_sql()
+
+    def _get_actions_filters(self, last_id):
+        filters = "%s.%s <= %i" % (self.actions, self.id_field, last_id)
+        if self.filters != "": filters += " AND " + self.filters
+        return filters
+
+    def _get_identities(self):
+        """Signature of the identities, it changes when they are merged"""
+        q = """SELECT COUNT(*) AS total,
+                      BIT_XOR(CRC32(CONCAT(people_id, ':', upeople_id))) AS hash
+               FROM people_upeople"""
+        res = self.db.ExecuteQuery(q)
+        return "%s:%s" % (res['total'], res['hash'])
+
+    def _count_actions(self, last_id):
+        q = "SELECT COUNT(*) AS actions FROM %s WHERE %s" % \
+            (self.actions, self._get_actions_filters(last_id))
+        return int(self.db.ExecuteQuery(q)['actions'])
+
+    def _load_state(self, identities):
+        """Returns the last action id aggregated, or 0 if the lifecycle
+           must be built again"""
+        q = """SELECT filters, identities, last_id, actions FROM %s
+               WHERE source = '%s'""" % (PeopleLifecycle.state_table, self.data_source)
+        res = self.db.ExecuteQuery(q)
+        if not 'last_id' in res or isinstance(res['last_id'], list):
+            return 0
+        if res['filters'] != self.filters or res['identities'] != identities:
+            return 0
+        last_id = int(res['last_id'])
+        if self._count_actions(last_id) != res['actions']:
+            return 0
+        return last_id
+
+    def refresh(self):
+        """Aggregate the new actions. Returns False if the table can't be
+           refreshed, i.e. the database can't be written, and the queries
+           aggregate all the actions then."""
+        try:
+            with self.db.lock("%s.%s" % (self.db.database, self.table)):
+                self._refresh()
+        except Exception, e:
+            logging.warning("People lifecycle not available for %s: %s" %
+                            (self.data_source, e))
+            return False
+        self.lifecycle = self.table
+        return True
+
+    def _refresh(self):
+        for (table, columns) in [(PeopleLifecycle.state_table, PeopleLifecycle.state_columns),
+                                 (self.table, PeopleLifecycle.lifecycle_columns)]:
+            self.db.ExecuteUpdate("CREATE TABLE IF NOT EXISTS %s (%s)" % (table, columns))
+
+        identities = self._get_identities()
+        last_id = self._load_state(identities)
+        q = "SELECT MAX(%s) AS max_id FROM %s" % (self.id_field, self.actions)
+        max_id = self.db.ExecuteQuery(q)['max_id']
+        if max_id is None: max_id = 0
+        max_id = int(max_id)
+        if last_id > 0 and last_id == max_id: return
+
+        # The state is removed while the lifecycle is changed
+        q = "DELETE FROM %s WHERE source = '%s'" % (PeopleLifecycle.state_table,
+                                                    self.data_source)
+        self.db.ExecuteUpdate(q, table = PeopleLifecycle.state_table)
+        if last_id == 0:
+            logging.info("Building people lifecycle for " + self.data_source)
+            self.db.ExecuteUpdate("DELETE FROM " + self.table, table = self.table)
+
+        q = """INSERT INTO %(lifecycle)s (upeople_id, first_date, last_date, actions)
+               SELECT pup.upeople_id, MIN(%(actions)s.%(date)s),
+                      MAX(%(actions)s.%(date)s), COUNT(*)
+               FROM %(actions)s, people_upeople pup
+               WHERE pup.people_id = %(actions)s.%(people)s
+                 AND %(actions)s.%(id)s > %(last_id)i AND %(filters)s
+               GROUP BY pup.upeople_id
+               ON DUPLICATE KEY UPDATE
+                 first_date = LEAST(first_date, VALUES(first_date)),
+                 last_date = GREATEST(last_date, VALUES(last_date)),
+                 actions = actions + VALUES(actions)
+            """ % {'lifecycle': self.table, 'actions': self.actions,
+                   'date': self.date_field, 'people': self.people_field,
+                   'id': self.id_field, 'last_id': last_id,
+                   'filters': self._get_actions_filters(max_id)}
+        self.db.ExecuteUpdate(q, table = self.table)
+
+        q = """INSERT INTO %s (source, filters, identities, last_id, actions)
+               VALUES (%%s, %%s, %%s, %%s, %%s)""" % (PeopleLifecycle.state_table)
+        row = (self.data_source, self.filters, identities, max_id,
+               self._count_actions(max_id))
+        self.db.ExecuteUpdate(q, [row], PeopleLifecycle.state_table)
+
+    def get_lifecycle_sql(self):
+        """Lifecycle of the identities got from all the actions"""
+        filters = ""
+        if self.filters != "": filters = " AND " + self.filters
+        return """
+            SELECT pup.upeople_id, MIN(%(actions)s.%(date)s) AS first_date,
+                   MAX(%(actions)s.%(date)s) AS last_date, COUNT(*) AS actions
+            FROM %(actions)s, people_upeople pup
+            WHERE pup.people_id = %(actions)s.%(people)s %(filters)s
+            GROUP BY pup.upeople_id""" % \
+            {'actions': self.actions, 'date': self.date_field,
+             'people': self.people_field, 'filters': filters}
+
+    def get_new_sql(self, days, date):
+        """Identities with the first action in the days before date.
+           Same as DATEDIFF(date, first_date) <= days."""
+        return """
+            SELECT upeople_id, first_date, last_date, actions FROM %s
+            WHERE first_date >= DATE_SUB(%s, INTERVAL %s DAY)
+              AND first_date < %s""" % (self.lifecycle, date, days, date)
+
+    def get_gone_sql(self, days, date):
+        """Identities without actions in the days before date.
+           Same as DATEDIFF(date, last_date) > days."""
+        return """
+            SELECT upeople_id, first_date, last_date, actions FROM %s
+            WHERE last_date < DATE_SUB(%s, INTERVAL %s DAY)""" % (self.lifecycle, date, days)
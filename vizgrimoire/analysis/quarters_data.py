@@ -23,6 +23,7 @@
 
 """ People and Companies evolution per quarters """
 
+import heapq
 from datetime import datetime, timedelta
 from dateutil.relativedelta import relativedelta
 
@@ -38,6 +39,49 @@ class QuartersData(Analyses):
     name = "Quarters Data"
     desc = "Metrics by Quarter"
 
+    fields = ["total", "name", "id", "quarter", "year"]
+
+    @staticmethod
+    def get_quarters(startdate, enddate):
+        """ (year, quarter) of the quarters from startdate until enddate """
+        start = datetime.strptime(startdate.replace("'",""), "%Y-%m-%d")
+        end = datetime.strptime(enddate.replace("'",""), "%Y-%m-%d")
+        date = datetime(start.year, 3*((start.month-1)/3)+1, 1)
+        quarters = []
+        while date < end:
+            quarters.append((date.year, (date.month-1)/3+1))
+            date = date + relativedelta(months=3)
+        return quarters
+
+    @staticmethod
+    def get_quarters_dates(quarters):
+        """ First day of the quarters and first day after them """
+        if len(quarters) == 0: return ("'1970-01-01'", "'1970-01-01'")
+        (year, quarter) = quarters[0]
+        start = datetime(year, 3*(quarter-1)+1, 1)
+        (year, quarter) = quarters[-1]
+        end = datetime(year, 3*(quarter-1)+1, 1) + relativedelta(months=3)
+        return (start.strftime("'%Y-%m-%d'"), end.strftime("'%Y-%m-%d'"))
+
+    @staticmethod
+    def get_top_quarters(rows, quarters, limit, key):
+        """ Top limit (year, quarter, total, name, id) rows of each quarter
+            sorted by key, in ExecuteQuery format """
+        quarters_rows = dict([(quarter, []) for quarter in quarters])
+        for (year, quarter, total, name, item_id) in rows:
+            if (year, quarter) not in quarters_rows: continue
+            quarters_rows[(year, quarter)].append((total, name, item_id, quarter, year))
+
+        top_quarters = {}
+        for (year, quarter) in quarters:
+            top = heapq.nsmallest(limit, quarters_rows[(year, quarter)], key)
+            data = {}
+            for (i, field) in enumerate(QuartersData.fields):
+                data[field] = [row[i] for row in top]
+                if len(top) == 1: data[field] = top[0][i]
+            top_quarters[str(year)+" "+str(quarter)] = data
+        return top_quarters
+
     def create_report(self, data_source, destdir):
         if data_source != SCR: return None
         self.result(data_source, destdir)
@@ -57,25 +101,18 @@ class QuartersData(Analyses):
         companies = self.db.GetCompaniesName(startdate, enddate)
         createJSON(companies, destdir+"/scr-companies-all.json", False)
 
-        start = datetime.strptime(startdate.replace("'",""), "%Y-%m-%d")
-        start_quarter = (start.month-1)%3 + 1
-        end = datetime.strptime(enddate.replace("'",""), "%Y-%m-%d")
-        end_quarter = (end.month-1)%3 + 1
-
-        companies_quarters = {}
-        people_quarters = {}
-
-        quarters = (end.year - start.year) * 4 + (end_quarter - start_quarter)
-
-        for i in range(0, quarters):
-            year = start.year
-            quarter = (i%4)+1
-            # logging.info("Analyzing companies and people quarter " + str(year) + " " +  str(quarter))
-            data = self.db.GetCompaniesQuarters(year, quarter)
-            companies_quarters[str(year)+" "+str(quarter)] = data
-            data_people = self.db.GetPeopleQuarters(year, quarter, 25, bots)
-            people_quarters[str(year)+" "+str(quarter)] = data_people
-            start = start + relativedelta(months=3)
+        # All the quarters are got in one query and ranked in memory
+        quarters = QuartersData.get_quarters(startdate, enddate)
+        quarters_dates = QuartersData.get_quarters_dates(quarters)
+
+        # ORDER BY total DESC, c.name
+        rows = self.db.GetCompaniesQuartersTotals(*quarters_dates)
+        companies_quarters = QuartersData.get_top_quarters(rows, quarters, 25,
+            lambda row: (-row[0], (row[1] or "").lower()))
+        # ORDER BY total DESC, id
+        rows = self.db.GetPeopleQuartersTotals(quarters_dates[0], quarters_dates[1], bots)
+        people_quarters = QuartersData.get_top_quarters(rows, quarters, 25,
+            lambda row: (-row[0], row[2]))
         createJSON(companies_quarters, destdir+"/scr-companies-quarters.json")
         createJSON(people_quarters, destdir+"/scr-people-quarters.json")
 
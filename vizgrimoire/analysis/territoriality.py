@@ -33,6 +33,9 @@ from query_builder import DSQuery
 
 from metrics_filter import MetricFilters
 
+from GrimoireUtils import check_array_values, completePeriodIds, getPeriodAxis, \
+    getPeriodDates, period_fields
+
 class Territoriality(Analyses):
     # Territoriality measures the percentage of files 
     # touched by just one developer out of the total 
@@ -43,7 +46,6 @@ class Territoriality(Analyses):
     #
     # TODO:
     #  - Add type of file filter (so far 'code' is harcoded in the query)
-    #  - Add evolutionary analysis of territoriality
 
     id = "territoriality"
     name = "Territoriality"
@@ -90,6 +92,113 @@ class Territoriality(Analyses):
         print query
         return query
 
+    def __get_actions_sql__(self):
+        """ Period, file, author and repository of the code files actions """
+        repos_tables = ""
+        repos_where  = ""
+        if self.__get_repository__() is not None:
+            repos_tables = " , repositories r "
+            repos_where = " and s.repository_id = r.id and r.name= " + self.__get_repository__()
+
+        query = """
+                select %s, a.file_id, pup.upeople_id, s.repository_id
+                from actions a,
+                     scmlog s,
+                     people_upeople pup,
+                     file_types ft %s
+                where a.commit_id=s.id and
+                      s.date >= %s and
+                      s.date < %s and
+                      s.author_id=pup.people_id  and
+                      a.file_id=ft.file_id and
+                      ft.type='code' %s
+                order by s.date
+             """ % (self.db.GetSQLPeriodField(self.filters.period, "s.date"),
+                    repos_tables, self.filters.startdate, self.filters.enddate,
+                    repos_where)
+        return query
+
+    def __get_repository__(self):
+        if not self.filters.type_analysis: return None
+        if self.filters.type_analysis[0] != "repository": return None
+        return self.filters.type_analysis[1]
+
+    @staticmethod
+    def get_territoriality(territorial_files, total_files):
+        territoriality = []
+        for (territorial, total) in zip(territorial_files, total_files):
+            if total == 0: territoriality.append(0)
+            else: territoriality.append(float(territorial) / total)
+        return territoriality
+
+    @staticmethod
+    def __add_counts__(evol, territorial, total):
+        for repo in evol:
+            evol[repo]["territorial_files"].append(territorial[repo])
+            evol[repo]["total_files"].append(total[repo])
+
+    def result_evol(self, data_source = None):
+        """ Territorial and total files from the start date until the end of
+            each period, for all the repositories and for each one
+
+        It scans all the actions in the dates, so it is not get_ts: the
+        report would merge it with the data source evolutionary metrics.
+        """
+        if data_source is not None and data_source.get_name() != "scm": return {}
+
+        period = self.filters.period
+        start, end = getPeriodDates(self.filters.startdate, self.filters.enddate)
+        periods = getPeriodAxis(period, start, end)[0]
+
+        q = "SELECT id, name FROM repositories"
+        if self.__get_repository__() is not None:
+            q += " WHERE name = " + self.__get_repository__()
+        repos = check_array_values(self.db.ExecuteQuery(q))
+        names = dict(zip(repos['id'], repos['name']))
+
+        # Author of each (repository, file) or None if there are several
+        owners = {}
+        territorial = dict([(repo, 0) for repo in names])
+        total = dict([(repo, 0) for repo in names])
+        evol = dict([(repo, {"territorial_files": [], "total_files": []}) for repo in names])
+
+        # Counts are added when all the actions of a period are read
+        pos = 0
+        rows = self.db.ExecuteQueryStream(self.__get_actions_sql__())
+        for (period_id, file_id, upeople_id, repo) in rows:
+            if repo not in names: continue
+            while pos < len(periods) and periods[pos] < period_id:
+                Territoriality.__add_counts__(evol, territorial, total)
+                pos += 1
+            key = (repo, file_id)
+            if key not in owners:
+                owners[key] = upeople_id
+                territorial[repo] += 1
+                total[repo] += 1
+            elif owners[key] is not None and owners[key] != upeople_id:
+                owners[key] = None
+                territorial[repo] -= 1
+        while pos < len(periods):
+            Territoriality.__add_counts__(evol, territorial, total)
+            pos += 1
+
+        ts = {period_fields[period]: periods,
+              "territorial_files": [0] * len(periods),
+              "total_files": [0] * len(periods)}
+        repositories = {}
+        for repo in names:
+            for field in ["territorial_files", "total_files"]:
+                ts[field] = [x + y for (x, y) in zip(ts[field], evol[repo][field])]
+            evol[repo]["territoriality"] = \
+                Territoriality.get_territoriality(evol[repo]["territorial_files"],
+                                                  evol[repo]["total_files"])
+            repositories[names[repo]] = evol[repo]
+        ts["territoriality"] = Territoriality.get_territoriality(ts["territorial_files"],
+                                                                 ts["total_files"])
+        ts = completePeriodIds(ts, period, self.filters.startdate, self.filters.enddate)
+        if self.__get_repository__() is None: ts["territoriality_repositories"] = repositories
+        return ts
+
     def result(self, data_source = None):
         if data_source is not None and data_source.get_name() != "scm": return None
         if len(self.filters.type_analysis) == 0: return None
@@ -26,26 +26,35 @@ import GrimoireUtils
 import GrimoireSQL
 from GrimoireSQL import ExecuteQuery
 
+def _quote(value):
+    # SQL string literal for a message id
+    return "'" + value.replace("\\", "\\\\").replace("'", "\\'") + "'"
+
 class Email(object):
     """This class contains the main attributes of an email
     """
 
-    def __init__(self, message_id, i_db):
+    def __init__(self, message_id, i_db, data = None):
         self.message_id = message_id
         self.i_db = i_db # Identities database
         self.subject = None # Email subject
         self.body = None # Email body
         self.date = None # Email sending date
         self.url = None # Domain of the archive
-        self._buildEmail() # Constructor
-               
-    def _buildEmail(self):
-        # This method retrieves items of information of a given
-        # email, specified by its email id.
+        if data is None:
+            data = Email._get_emails_data([message_id], i_db).get(message_id, {})
+        self._buildEmail(data) # Constructor
+
+    @staticmethod
+    def _get_emails_data(message_ids, i_db):
+        # Retrieves the items of information of several emails in one query.
+        # Returns a dictionary with message_id as keys.
+        emails_data = {}
+        if len(message_ids) == 0: return emails_data
 
         query = """
-                select distinct m.message_ID, 
-                       m.subject, 
+                select distinct m.message_ID,
+                       m.subject,
                        m.message_body,
                        m.first_date,
                        u.identifier as initiator_name,
@@ -55,25 +64,39 @@ class Email(object):
                      messages_people mp,
                      people_upeople pup,
                      %s.upeople u
-                where m.message_ID = '%s' and
+                where m.message_ID in (%s) and
                       m.message_ID = mp.message_id and
                       mp.type_of_recipient = 'From' and
                       mp.email_address = pup.people_id and
-                      pup.upeople_id = u.id 
-                limit 1
-                """  % (self.i_db, self.message_id)
+                      pup.upeople_id = u.id
+                """  % (i_db, ",".join([_quote(msg) for msg in set(message_ids)]))
+        results = GrimoireUtils.check_array_values(ExecuteQuery(query))
         # WARNING: There may appear in some cases repeated emails.
         # This may be because the same email was sent to different
-        # mailing lists. Forcing the query to 1 row, allows to 
-        # avoid this issue till we understand why this behaviour
-        results = ExecuteQuery(query)
-
-        self.subject = results["subject"]
-        self.body = results["message_body"]
-        self.date = results["first_date"]
-        self.initiator_name = results["initiator_name"]
-        self.initiator_id = results["initiator_id"]
-        self.url = results["url"]
+        # mailing lists. Only the first row of each email is used
+        # till we understand why this behaviour
+        fields = results.keys()
+        for i in range(0, len(results.get("message_ID", []))):
+            message_id = results["message_ID"][i]
+            if message_id in emails_data: continue
+            emails_data[message_id] = dict([(field, results[field][i]) for field in fields])
+        return emails_data
+
+    @staticmethod
+    def get_emails(message_ids, i_db):
+        # Returns the list of Email for message_ids with only one query
+        emails_data = Email._get_emails_data(message_ids, i_db)
+        return [Email(message_id, i_db, emails_data.get(message_id, {}))
+                for message_id in message_ids]
+
+    def _buildEmail(self, results):
+        # This method fills the items of information of the email
+        self.subject = results.get("subject")
+        self.body = results.get("message_body")
+        self.date = results.get("first_date")
+        self.initiator_name = results.get("initiator_name")
+        self.initiator_id = results.get("initiator_id")
+        self.url = results.get("url")
 
 
 class Threads(object):
@@ -93,32 +116,26 @@ class Threads(object):
         self.crowded = None # the thread with most people participating
         self.longest = None # the thread with the longest queue of emails
         self.verbose = None # the thread with the most verbose emails.
+        self.stats = None # keys = root message_id, values = (number of
+                          # different people, length of all the bodies)
 
         self._init_threads()    
 
-    def _build_threads (self, message_id):
-        # Constructor of threads.
+    def _build_threads (self, message_id, sons):
+        # Constructor of threads: all the messages below message_id,
+        # each one followed by its own answers. sons is the index of
+        # answers of each message.
 
-        sons = []
         messages = []
-        if message_id not in self.list_is_response_of:
-            # this a leaf of the tree!
-            return []
-
-        else:
-            cont = 0
-            for msg in self.list_is_response_of:
-                #Retrieving all of the sons of a given msg
-                if msg == message_id:
-                    sons.append(self.list_message_id[cont])
-                cont = cont + 1
-            for msg in sons:
-                messages.extend([msg])
-                messages.extend(self._build_threads(msg))            
-               
-
-        return messages          
-            
+        visited = set([message_id]) # avoid loops in broken data
+        pending = list(reversed(sons.get(message_id, [])))
+        while len(pending) > 0:
+            msg = pending.pop()
+            messages.append(msg)
+            if msg in visited: continue
+            visited.add(msg)
+            pending.extend(reversed(sons.get(msg, [])))
+        return messages
 
     def _init_threads(self):
         # Returns dictionary of message_id threads. Each key contains a list
@@ -130,24 +147,82 @@ class Threads(object):
                 from messages 
                 where first_date >= %s and first_date < %s
                 """ % (self.initdate, self.enddate)
-        list_messages = ExecuteQuery(query)
-        self.list_message_id = list_messages["message_ID"]
-        self.list_is_response_of = list_messages["is_response_of"]
-        
+        list_messages = GrimoireUtils.check_array_values(ExecuteQuery(query))
+        self.list_message_id = list_messages.get("message_ID", [])
+        self.list_is_response_of = list_messages.get("is_response_of", [])
+
+        # Index of the answers to each message, built in one pass
+        sons = {}
+        parents = {}
+        for (message_id, father) in zip(self.list_message_id, self.list_is_response_of):
+            if father is not None:
+                sons.setdefault(father, []).append(message_id)
+            if message_id not in parents: parents[message_id] = father
+
         messages = {}
         for message_id in self.list_message_id:
-            # Looking for messages in the thread
-            index = self.list_message_id.index(message_id)
-            
             # Only analyzing those whose is_response_of is None, 
             # those are the message 'root' of each thread.
-            if self.list_is_response_of[index] is None:
-                messages[message_id] = self._build_threads(message_id)
+            if parents[message_id] is None and message_id not in messages:
+                messages[message_id] = self._build_threads(message_id, sons)
                 # Adding the root message to the list in first place
                 messages[message_id].insert(0, message_id)
 
         self.threads = messages
 
+    def _get_messages_people(self):
+        # Returns dictionary with the set of upeople_id sending each message
+        query = """
+                select distinct m.message_ID as message_id,
+                       pup.upeople_id as upeople_id
+                from messages m,
+                     messages_people mp,
+                     people_upeople pup
+                where m.first_date >= %s and m.first_date < %s and
+                      m.message_ID = mp.message_id and
+                      mp.type_of_recipient = 'From' and
+                      mp.email_address = pup.people_id
+                """ % (self.initdate, self.enddate)
+        results = GrimoireUtils.check_array_values(ExecuteQuery(query))
+        people = {}
+        for (message_id, upeople_id) in zip(results.get("message_id", []),
+                                            results.get("upeople_id", [])):
+            people.setdefault(message_id, set([])).add(int(upeople_id))
+        return people
+
+    def _get_messages_length(self):
+        # Returns dictionary with the length of the body of each message
+        query = """
+                select message_ID as message_id,
+                       length(message_body) as length
+                from messages
+                where first_date >= %s and first_date < %s
+                """ % (self.initdate, self.enddate)
+        results = GrimoireUtils.check_array_values(ExecuteQuery(query))
+        lengths = {}
+        for (message_id, length) in zip(results.get("message_id", []),
+                                        results.get("length", [])):
+            if message_id in lengths: continue
+            if length is None: length = 0
+            lengths[message_id] = int(length)
+        return lengths
+
+    def _get_stats(self):
+        # Number of different people and length of all the bodies of each
+        # thread, computed in one traversal of all the threads
+        if self.stats is None:
+            people = self._get_messages_people()
+            lengths = self._get_messages_length()
+            self.stats = {}
+            for (root, thread) in self.threads.items():
+                thread_people = set([])
+                total_len_bodies = 0 # len of all of the body messages
+                for msg in thread:
+                    thread_people.update(people.get(msg, []))
+                    total_len_bodies += lengths.get(msg, 0)
+                self.stats[root] = (len(thread_people), total_len_bodies)
+        return self.stats
+
     def crowdedThread (self):
         # Returns the most crowded thread.
         # This is defined as the thread with the highest number of different
@@ -157,46 +232,16 @@ class Threads(object):
             pass
        
     def topCrowdedThread(self, numTop):
-        # Returns list ordered by the longest thread
-
-        top_threads = [] # [(message_id, number of different upeople_id), (...,...), ...]
-
-        for thread in self.threads.values():
-            # this loop counts number of different people
-            # in each of the threads and provides a 
-            # dictionary with root message_id as each of the keys
-            # and a list of upeople_id as the value.
-            # Sets were considered as an option, but it implies that
-            # we may find with a higher probability equal sets, what
-            # would provide incorrect sets to their correspondant message_id
-            # when ordering them (at least using this algorithm).
-            # So, not using sets, and manual order of the lists is done 
-            people = set([])
-            for message in thread:
-                query = """
-                        select distinct pup.upeople_id as upeople_id
-                        from messages m,
-                             messages_people mp,
-                             people_upeople pup
-                        where m.message_ID = '%s' and
-                              m.message_ID = mp.message_id and 
-                              mp.type_of_recipient = 'From' and
-                              mp.email_address = pup.people_id
-                        """ % (message)
-                result = ExecuteQuery(query)
-                upeople_id = int(result["upeople_id"])       
-                people.add(upeople_id)
-            top_threads.append((message, len(people)))
+        # Returns list ordered by the most crowded threads
 
+        stats = self._get_stats()
+        # [(root message_id, number of different upeople_id), (...,...), ...]
+        top_threads = [(root, stats[root][0]) for root in self.threads.keys()]
         sorted_threads = sorted(top_threads, key=lambda thread: thread[1], reverse = True)
-        
-        top_threads_emails = []
-        for top in sorted_threads[:numTop]:
-            # Create a list of emails
-            message_id = top[0]
-            email = Email(message_id, self.i_db)
-            top_threads_emails.append((email, top[1]))
-        return top_threads_emails
+        sorted_threads = sorted_threads[:int(numTop)]
+
+        emails = Email.get_emails([top[0] for top in sorted_threads], self.i_db)
+        return zip(emails, [top[1] for top in sorted_threads])
 
 
     def longestThread (self):
@@ -215,59 +260,32 @@ class Threads(object):
     def topLongestThread(self, numTop):
         numTop = int(numTop)
         # Returns list ordered by the longest threads
-        top_threads = []
-        top_root_msgs = []
-        top_threads_emails = []
 
         # Retrieving the lists of threads
         values = self.threads.values()
-        # sorted(values, lambda x,y: 1 if len(x)>len(y) else -1 if len(x)<len(y) else 0)
         values = sorted(values, key = len, reverse = True)
 
-        # Checks if numTop is higher than len of the list
-        if numTop > len(values):
-            top_threads = values
-        else:
-            top_threads = values[0:numTop]
-            
-        for thread in top_threads:
-            # the root message is the first of the list 
-            # (the rest of them are not ordered)
-            top_root_msgs.append(thread[0])
-
-        for message_id in top_root_msgs:
-            # Create a list of emails
-            email = Email(message_id, self.i_db)
-            top_threads_emails.append(email)
-
-        return top_threads_emails
+        # the root message is the first of the list 
+        # (the rest of them are not ordered)
+        top_root_msgs = [thread[0] for thread in values[0:numTop]]
+
+        return Email.get_emails(top_root_msgs, self.i_db)
         
   
     def verboseThread (self):
-        # TODO: at some point these numbers should be calculated when
-        # retrieving the initial list of message_id, is_response_of values
         # Returns the most verbose thread (the biggest emails)
         if self.verbose == None:
             # variable was not initialize
             self.verbose = "" 
             current_len = 0
+            stats = self._get_stats()
             # iterating through the root messages
             for message_id in self.threads.keys():
-                total_len_bodies = 0 # len of all of the body messages
-                # iterating through each of the messages of the thread
-                for msg in self.threads[message_id]:
-                    query = """
-                            select length(message_body) as length
-                            from messages
-                            where message_ID = '%s'
-                            """ % (msg)
-                    result = ExecuteQuery(query)
-                    length = int(result["length"])
-                    total_len_bodies = total_len_bodies + length
-                    if total_len_bodies > current_len:
-                        # New bigger thread found
-                        self.verbose = message_id
-                        current_len = total_len_bodies
+                total_len_bodies = stats[message_id][1]
+                if total_len_bodies > current_len:
+                    # New bigger thread found
+                    self.verbose = message_id
+                    current_len = total_len_bodies
         return Email(self.verbose, self.i_db) 
 
 
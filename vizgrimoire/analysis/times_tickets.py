@@ -25,7 +25,7 @@
 """ People and Companies evolution per quarters """
 
 from analyses import Analyses
-from GrimoireUtils import completePeriodIds, medianAndAvgByPeriod, get_median, get_avg
+from GrimoireUtils import completePeriodIds, medianAndAvgByPeriod, get_median, get_avg, period_fields
 from query_builder import DSQuery
 from metrics_filter import MetricFilters
 
@@ -36,7 +36,8 @@ class TimesTickets(Analyses):
 
     def getMedianAndAvg(self, period, alias, dates, values):
         data = medianAndAvgByPeriod(period, dates, values)
-        result = {period : data[period],
+        field = period_fields[period]
+        result = {field : data[field],
                   'median_' + alias : data['median'],
                   'avg_' + alias : data['avg']}
         return result
@@ -81,14 +82,12 @@ class TimesTickets(Analyses):
         if condition:
             q += condition
 
-        q += """ ORDER BY date """
-
         params = {'alias' : alias or 'time_to_action',
                   'startdate' : startdate,
                   'enddate' : enddate}
         query = q % params
 
-        data = self.db.ExecuteQuery(query)
+        data = self.db.ExecuteQueryColumnar(query)
         return (data)
 
     def GetTimeToFirstComment (self, period, startdate, enddate, condition, alias=None) :
@@ -100,14 +99,12 @@ class TimesTickets(Analyses):
         if condition:
             q += condition
 
-        q += """ ORDER BY date """
-
         params = {'alias' : alias or 'time_to_comment',
                   'startdate' : startdate,
                   'enddate' : enddate}
         query = q % params
 
-        data = self.db.ExecuteQuery(query)
+        data = self.db.ExecuteQueryColumnar(query)
         return (data)
 
     def GetTimeClosed (self, period, startdate, enddate, closed_condition, ext_condition=None, alias=None):
@@ -122,14 +119,12 @@ class TimesTickets(Analyses):
         if ext_condition:
             q += ext_condition
 
-        q += """ ORDER BY date """
-
         params = {'alias' : alias or 'time_opened',
                   'startdate' : startdate,
                   'enddate' : enddate}
         query = q % params
 
-        data = self.db.ExecuteQuery(query)
+        data = self.db.ExecuteQueryColumnar(query)
         return (data)
 
     def GetIssuesOpenedAtQuery (self, startdate, enddate, closed_condition, ext_condition=None):
@@ -241,26 +236,17 @@ class TimesTickets(Analyses):
 
             fa_alias = 'tfa_%s' % field_value
             data = self.GetTimeToFirstAction(period, startdate, enddate, field_condition, fa_alias)
-            if not isinstance(data[fa_alias], (list)): 
-                data[fa_alias] = [data[fa_alias]]
-                data['date'] = [data['date']]
             if len(data[fa_alias]) == 0: continue
             time_to_fa = self.getMedianAndAvg(period, fa_alias, data['date'], data[fa_alias])
             time_to_fa = completePeriodIds(time_to_fa, period, startdate, enddate)
 
             fc_alias = 'tfc_%s' % field_value
             data = self.GetTimeToFirstComment(period, startdate, enddate, field_condition, fc_alias)
-            if not isinstance(data[fc_alias], (list)): 
-                data[fc_alias] = [data[fc_alias]]
-                data['date'] = [data['date']]
             time_to_fc = self.getMedianAndAvg(period, fc_alias, data['date'], data[fc_alias])
             time_to_fc = completePeriodIds(time_to_fc, period, startdate, enddate)
 
             tclosed_alias = 'ttc_%s' % field_value
             data = self.GetTimeClosed(period, startdate, enddate, closed_condition, field_condition, tclosed_alias)
-            if not isinstance(data[tclosed_alias], (list)): 
-                data[tclosed_alias] = [data[tclosed_alias]]
-                data['date'] = [data['date']]
             time_closed = self.getMedianAndAvg(period, tclosed_alias, data['date'], data[tclosed_alias])
             time_closed = completePeriodIds(time_closed, period, startdate, enddate)
 
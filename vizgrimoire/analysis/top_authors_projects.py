@@ -28,6 +28,8 @@ from query_builder import SCMQuery
 
 from metrics_filter import MetricFilters
 
+from GrimoireUtils import get_groups_tops
+
 class TopAuthorsProjects(Analyses):
     # this class provides a list of top contributors
 
@@ -35,30 +37,41 @@ class TopAuthorsProjects(Analyses):
     name = "Top Authors"
     desc = "Top people committing changes to the source code"
 
-    def __get_sql__(self):
-        return ""
-
-    def result(self, data_source = None):
-
-        project = self.filters.type_analysis[1]
-        projects_from = self.db.GetSQLProjectFrom()
+    fields = ["commits", "id", "authors"]
 
-        # Remove first and
-        projects_where = " WHERE  " + self.db.GetSQLProjectWhere(project)[3:]
-
-        fields =  "SELECT COUNT(DISTINCT(s.id)) as commits, u.id, u.identifier as authors "
-        fields += "FROM actions a, scmlog s, people_upeople pup, upeople u "
-        q = fields + projects_from + projects_where
-        q += " AND pup.people_id = s.author_id AND u.id = pup.upeople_id "
+    def __get_sql__(self, repositories = None):
+        """ Commits of each author in each repository """
+        q = "SELECT s.repository_id, u.id, u.identifier as authors, "
+        q += "COUNT(DISTINCT(s.id)) as commits "
+        q += "FROM actions a, scmlog s, people_upeople pup, upeople u "
+        q += " WHERE pup.people_id = s.author_id AND u.id = pup.upeople_id "
         q += " AND a.commit_id = s.id "
         q += " AND s.date >= " + self.filters.startdate + " and s.date < " + self.filters.enddate
-        q += " GROUP by u.id ORDER BY commits DESC, u.id"
-        q += " limit " + str(self.filters.npeople)
-
-        res = self.db.ExecuteQuery(q)
-
-        return res
+        if repositories is not None:
+            q += " AND s.repository_id IN (" + ",".join([str(r) for r in repositories]) + ")"
+        q += " GROUP by s.repository_id, u.id"
+        return q
 
+    def result(self, data_source = None):
+        project = self.filters.type_analysis[1].strip("'")
+        return self.result_projects(project)[project]
+
+    def result_projects(self, project = None):
+        """ Top authors of all the projects, or only of project """
+        projects = self.db.GetProjectsRepositories(project)
+        rows = []
+        if project is None:
+            rows = self.db.ExecuteQueryStream(self.__get_sql__())
+        else:
+            projects.setdefault(project, set())
+            if len(projects[project]) > 0:
+                rows = self.db.ExecuteQueryStream(self.__get_sql__(projects[project]))
+
+        rows = ((repository_id, (upeople_id, identifier), commits)
+                for (repository_id, upeople_id, identifier, commits) in rows)
+        # ORDER BY commits DESC, u.id
+        return get_groups_tops(projects, rows, TopAuthorsProjects.fields,
+                               self.filters.npeople, lambda row: (-row[0], row[1]))
 
 
 if __name__ == '__main__':
@@ -28,6 +28,8 @@ from query_builder import SCMQuery
 
 from metrics_filter import MetricFilters
 
+from GrimoireUtils import get_groups_tops
+
 class TopCompaniesProjects(Analyses):
     # this class provides a list of top organizations
     # by number of commits
@@ -36,31 +38,44 @@ class TopCompaniesProjects(Analyses):
     name = "Top Organizations"
     desc = "Top organizations committing changes to the source code"
 
-    def __get_sql__(self):
-        return ""
-
-    def result(self, data_source = None):
-        project = self.filters.type_analysis[1]
-
-        projects_from = self.db.GetSQLProjectFrom()
-        # Remove first and
-        projects_where = " WHERE  " + self.db.GetSQLProjectWhere(project)[3:]
+    fields = ["company_commits", "companies"]
 
-        fields =  "SELECT COUNT(DISTINCT(s.id)) as company_commits, c.name as companies "
-        fields += "FROM actions a, scmlog s, people_upeople pup, upeople u, upeople_companies upc, companies c "
-        q = fields + projects_from + projects_where
-        q += " AND pup.people_id = s.author_id AND u.id = pup.upeople_id "
+    def __get_sql__(self, repositories = None):
+        """ Commits of each organization in each repository """
+        q = "SELECT s.repository_id, c.name as companies, "
+        q += "COUNT(DISTINCT(s.id)) as company_commits "
+        q += "FROM actions a, scmlog s, people_upeople pup, upeople u, upeople_companies upc, companies c "
+        q += " WHERE pup.people_id = s.author_id AND u.id = pup.upeople_id "
         q += " AND u.id = upc.upeople_id AND c.id = upc.company_id "
         q += " AND s.date >= upc.init and s.date < upc.end "
         q += " AND s.date>=" + self.filters.startdate + " and s.date < " + self.filters.enddate
         q += " AND a.commit_id = s.id "
-        q += " GROUP by c.name ORDER BY company_commits DESC, c.name"
-        q += " limit " + str(self.filters.npeople)
-
-        res = self.db.ExecuteQuery(q)
-
-        return res
+        if repositories is not None:
+            q += " AND s.repository_id IN (" + ",".join([str(r) for r in repositories]) + ")"
+        q += " GROUP by s.repository_id, c.name"
+        return q
 
+    def result(self, data_source = None):
+        project = self.filters.type_analysis[1].strip("'")
+        return self.result_projects(project)[project]
+
+    def result_projects(self, project = None):
+        """ Top organizations of all the projects, or only of project """
+        projects = self.db.GetProjectsRepositories(project)
+        rows = []
+        if project is None:
+            rows = self.db.ExecuteQueryStream(self.__get_sql__())
+        else:
+            projects.setdefault(project, set())
+            if len(projects[project]) > 0:
+                rows = self.db.ExecuteQueryStream(self.__get_sql__(projects[project]))
+
+        rows = ((repository_id, (name,), commits)
+                for (repository_id, name, commits) in rows)
+        # ORDER BY company_commits DESC, c.name
+        return get_groups_tops(projects, rows, TopCompaniesProjects.fields,
+                               self.filters.npeople,
+                               lambda row: (-row[0], (row[1] or "").lower()))
 
 
 if __name__ == '__main__':
@@ -24,10 +24,11 @@
 """ DataSource offers the API to get aggregated, evolutionary and top data with filter 
     support for Grimoire supported data sources """ 
 
-import logging, os
+import errno, json, logging, os, socket, zlib
 from query_builder import DSQuery
-from GrimoireUtils import createJSON
+from GrimoireUtils import check_array_values, createJSON
 from metrics_filter import MetricFilters
+from filter import Filter
 
 class DataSource(object):
     _bots = []
@@ -183,6 +184,128 @@ class DataSource(object):
         """Create all files related to all filters in all data sources using GROUP BY queries"""
         raise NotImplementedError
 
+    @staticmethod
+    def _get_shard_slot():
+        """ Return (slot, slots) for the items handled by this process, or None.
+
+        A host shard i/N split in M parts is the global slot
+        (i-1) + N*(k-1) out of N*M for part k.
+        """
+        from report import Report
+        shard = Report.get_shard()
+        part = Report.get_shard_part()
+        if shard is None and part is None: return None
+        if shard is None: shard = (1, 1)
+        if part is None: part = (1, 1)
+        return ((shard[0] - 1) + shard[1] * (part[0] - 1), shard[1] * part[1])
+
+    @staticmethod
+    def get_shard_items(items):
+        """ Items of a filter to be generated by this host and process """
+        slot = DataSource._get_shard_slot()
+        if slot is None: return items
+        shard_items = []
+        for item in items:
+            key = item
+            if isinstance(key, unicode): key = key.encode('utf-8')
+            if (zlib.crc32(str(key)) & 0xffffffff) % slot[1] == slot[0]:
+                shard_items.append(item)
+        return shard_items
+
+    @staticmethod
+    def is_first_shard():
+        """ Items independent data (summaries) is generated by the first shard """
+        slot = DataSource._get_shard_slot()
+        return slot is None or slot[0] == 0
+
+    @staticmethod
+    def get_shard_filename(filename, shard = None, part = None):
+        name = filename
+        if name.endswith(".json"): name = name[:-len(".json")]
+        if shard is not None: name += "-shard-%i-of-%i" % shard
+        if part is not None: name += "-part-%i-of-%i" % part
+        return name + ".json"
+
+    @staticmethod
+    def create_items_list(items_list, items, shard_items, filename):
+        """ Create the file with the list of items of a filter
+
+        If the items are sharded, the list of the shard items is stored with
+        their position in the complete list, so the lists of all shards can be
+        merged in the final file once all of them are available.
+        """
+        from report import Report
+        shard = Report.get_shard()
+        part = Report.get_shard_part()
+        if shard is None and part is None:
+            createJSON(items_list, filename)
+            return
+        positions = dict([(item, pos) for (pos, item) in enumerate(items)])
+        data = {"positions": [positions[item] for item in shard_items],
+                "items_list": items_list}
+        createJSON(data, DataSource.get_shard_filename(filename, shard, part))
+        if part is None:
+            DataSource.merge_items_list(filename, shard)
+
+    @staticmethod
+    def merge_items_list(filename, shard = None, parts = None):
+        """ Merge the lists of items of all parts of a host shard (parts given)
+            or of all host shards if all of them are available """
+        if parts is not None:
+            names = [DataSource.get_shard_filename(filename, shard, (i, parts))
+                     for i in range(1, parts + 1)]
+            if shard is None: merged = filename
+            else: merged = DataSource.get_shard_filename(filename, shard)
+        else:
+            names = [DataSource.get_shard_filename(filename, (i, shard[1]))
+                     for i in range(1, shard[1] + 1)]
+            merged = filename
+
+        for name in names:
+            if not os.path.isfile(name):
+                logging.info("Items list " + name + " not available yet")
+                return
+
+        # Claim the merge renaming the files: the last hosts or processes
+        # can find all of them at the same time, only one gets the first
+        suffix = ".merging-%s-%i" % (socket.gethostname(), os.getpid())
+        try:
+            os.rename(names[0], names[0] + suffix)
+        except OSError, e:
+            if e.errno != errno.ENOENT: raise
+            logging.info("Items list " + merged + " merged by other process")
+            return
+        for name in names[1:]: os.rename(name, name + suffix)
+        names = [name + suffix for name in names]
+
+        all_parts = []
+        for name in names:
+            with open(name) as f: all_parts.append(json.load(f))
+
+        rows = []
+        for data in all_parts:
+            for (i, pos) in enumerate(data["positions"]):
+                rows.append((pos, data["items_list"], i))
+        rows.sort()
+
+        items_list = None
+        if len(all_parts) > 0 and isinstance(all_parts[0]["items_list"], dict):
+            items_list = dict([(field, []) for field in all_parts[0]["items_list"]])
+            for (pos, part_list, i) in rows:
+                for field in items_list:
+                    items_list[field].append(part_list[field][i])
+        else:
+            items_list = [part_list[i] for (pos, part_list, i) in rows]
+
+        if merged == filename:
+            createJSON(items_list, filename)
+        else:
+            data = {"positions": [pos for (pos, part_list, i) in rows],
+                    "items_list": items_list}
+            createJSON(data, merged)
+            DataSource.merge_items_list(filename, shard)
+        for name in names: os.remove(name)
+
     @staticmethod
     def get_top_people_file(ds):
         """Get the filename used to store top people data"""
@@ -351,9 +474,14 @@ class DataSource(object):
             type_analysis = filter_.get_type_analysis()
 
         if type_analysis and type_analysis[1] is None:
-            items = DS.get_filter_items(filter_, startdate, enddate, identities_db)
-            if items is None: return data
-            items = items.pop('name')
+            items = filter_.get_items()
+            if items is None:
+                items = DS.get_filter_items(filter_, startdate, enddate, identities_db)
+                if items is None: return data
+                items = items.pop('name')
+            id_field = DataSource.get_group_id_field(DS, type_analysis[0])
+            items_analysis = [Filter(type_analysis[0], item).get_type_analysis()
+                              for item in items]
 
         if DS.get_name()+"_startdate" in Report.get_config()['r']:
             startdate = Report.get_config()['r'][DS.get_name()+"_startdate"]
@@ -382,8 +510,9 @@ class DataSource(object):
 
             if type_analysis and type_analysis[1] is None:
                 logging.info(item.id)
-                id_field = DSQuery.get_group_field(type_analysis[0])
-                id_field = id_field.split('.')[1] # remove table name
+                if id_field not in mvalue:
+                    mvalue = DataSource.get_metric_items_data(item, mfilter, items,
+                                                              items_analysis, id_field, evol)
                 mvalue = fill_and_order_items(items, mvalue, id_field,
                                               evol, period, startdate, enddate)
             data = dict(data.items() + mvalue.items())
@@ -391,11 +520,14 @@ class DataSource(object):
             item.filters = mfilter_orig
 
         if not evol:
-            init_date = DS.get_date_init(startdate, enddate, identities_db, type_analysis)
-            end_date = DS.get_date_end(startdate, enddate, identities_db, type_analysis)
-
-            # TODO: grouped items metrics support
-            data = dict(data.items() + init_date.items() + end_date.items())
+            if type_analysis and type_analysis[1] is None:
+                dates = DataSource.get_date_items(DS, startdate, enddate, identities_db,
+                                                  items, items_analysis, id_field)
+                data = dict(data.items() + dates.items())
+            else:
+                init_date = DS.get_date_init(startdate, enddate, identities_db, type_analysis)
+                end_date = DS.get_date_end(startdate, enddate, identities_db, type_analysis)
+                data = dict(data.items() + init_date.items() + end_date.items())
 
             # Tendencies
             metrics_trends = DS.get_metrics_core_trends()
@@ -404,23 +536,134 @@ class DataSource(object):
             if automator_metrics in automator['r']:
                 metrics_trends = automator['r'][automator_metrics].split(",")
 
-            for i in [7,30,365]:
-                for item in all_metrics:
-                    if item.id not in metrics_trends: continue
-                    mfilter_orig = item.filters
-                    item.filters = mfilter
-                    period_data = item.get_trends(enddate, i)
-                    item.filters = mfilter_orig
+            for item in all_metrics:
+                if item.id not in metrics_trends: continue
+                mfilter_orig = item.filters
+                item.filters = mfilter
+                period_data = item.get_trends_multi(enddate, [7,30,365])
+
+                if type_analysis and type_analysis[1] is None:
+                    if id_field not in period_data:
+                        period_data = DataSource.get_metric_items_data(
+                            item, mfilter, items, items_analysis, id_field,
+                            trends = (enddate, [7,30,365]))
+                    period_data = fill_and_order_items(items, period_data, id_field)
+                item.filters = mfilter_orig
 
-                    if type_analysis and type_analysis[1] is None:
-                        id_field = DSQuery.get_group_field(type_analysis[0])
-                        id_field = id_field.split('.')[1] # remove table name
-                        period_data = fill_and_order_items(items, period_data, id_field)
+                data = dict(data.items() + period_data.items())
 
-                    data = dict(data.items() + period_data.items())
+        return data
+
+    @staticmethod
+    def get_group_id_field(DS, filter_name):
+        """ Field with the name of the items in filter all (GROUP BY) results """
+        field = DS.get_query_builder().get_group_field(filter_name)
+        if field is not None: field = DSQuery.get_group_field_name(field)
+        return field
+
+    @staticmethod
+    def get_metric_items_data(metric, mfilter, items, items_analysis, id_field,
+                              evol = False, trends = None):
+        """ Get a metric item by item, in the format of filter all results
+
+        Used for the metrics whose queries are not grouped by items.
+        trends is the (date, days list) to get the trends of the metric.
+        """
+        ts_fields = [mfilter.period, 'id', 'unixtime', 'date']
+        data = {id_field: []}
+        mfilter_orig = metric.filters
+        for (item, type_analysis) in zip(items, items_analysis):
+            metric.filters = MetricFilters(mfilter.period, mfilter.startdate,
+                                           mfilter.enddate, type_analysis,
+                                           mfilter.npeople, mfilter.people_out,
+                                           mfilter.companies_out, mfilter.global_filter)
+            if trends is not None: value = metric.get_trends_multi(trends[0], trends[1])
+            elif evol: value = metric.get_ts()
+            else: value = metric.get_agg()
+            data[id_field].append(item)
+            for field in value:
+                if evol and field in ts_fields: data[field] = value[field]
+                else: data.setdefault(field, []).append(value[field])
+        metric.filters = mfilter_orig
+        return data
 
+    @staticmethod
+    def get_date_items(DS, startdate, enddate, identities_db, items,
+                       items_analysis, id_field):
+        """ First and last activity dates of each item of a filter
+
+        get_date_init and get_date_end are called for the filter all
+        analysis. They return the dates of all items (GROUP BY), the same
+        dates for all items if they are not filtered by items, or None if
+        the filter is not supported. Then the dates are got item by item.
+        """
+        if len(items) == 0: return {id_field: []}
+        type_analysis = [items_analysis[0][0], None]
+        init_date = DS.get_date_init(startdate, enddate, identities_db, type_analysis)
+        end_date = DS.get_date_end(startdate, enddate, identities_db, type_analysis)
+        if init_date is not None and end_date is not None:
+            data = {id_field: list(items)}
+            for dates in [init_date, end_date]:
+                if id_field not in dates:
+                    for field in dates:
+                        data[field] = [dates[field]] * len(items)
+                    continue
+                dates = check_array_values(dates)
+                for field in dates:
+                    if field == id_field: continue
+                    item_dates = dict(zip(dates[id_field], dates[field]))
+                    data[field] = [item_dates.get(item) for item in items]
+            return data
+
+        data = {id_field: []}
+        for (item, type_analysis) in zip(items, items_analysis):
+            init_date = DS.get_date_init(startdate, enddate, identities_db, type_analysis)
+            end_date = DS.get_date_end(startdate, enddate, identities_db, type_analysis)
+            data[id_field].append(item)
+            for (field, value) in init_date.items() + end_date.items():
+                data.setdefault(field, []).append(value)
         return data
 
+    @staticmethod
+    def split_items_data(data, id_field, evol = False, period = None):
+        """ Split filter all (GROUP BY) results in {item: item data} """
+        ts_fields = [period, 'id', 'unixtime', 'date']
+        items_data = {}
+        if id_field not in data: return items_data
+        for (pos, item) in enumerate(data[id_field]):
+            item_data = {}
+            for field in data:
+                if field == id_field: continue
+                if evol and field in ts_fields: item_data[field] = data[field]
+                else: item_data[field] = data[field][pos]
+            items_data[item] = item_data
+        return items_data
+
+    @staticmethod
+    def get_filter_items_data(DS, filter_, items, period, startdate, enddate,
+                              identities_db):
+        """ Evolutionary and aggregated data for the items of a filter
+
+        The data for all items is got with GROUP BY queries, one per metric,
+        and splitted per item. Returns {item: (evol data, agg data)} with the
+        items found. It is empty if the data source does not support the
+        filter in GROUP BY queries.
+        """
+        id_field = DataSource.get_group_id_field(DS, filter_.get_name())
+        if id_field is None or len(items) == 0: return {}
+        filter_all = Filter(filter_.get_name(), None, items)
+        evol_all = DS.get_evolutionary_data(period, startdate, enddate,
+                                            identities_db, filter_all)
+        agg_all = DS.get_agg_data(period, startdate, enddate,
+                                  identities_db, filter_all)
+        evol_items = DataSource.split_items_data(evol_all, id_field, True, period)
+        agg_items = DataSource.split_items_data(agg_all, id_field)
+        items_data = {}
+        for item in items:
+            if item in evol_items and item in agg_items:
+                items_data[item] = (evol_items[item], agg_items[item])
+        return items_data
+
     @staticmethod
     def get_metrics_core_agg():
         """ Aggregation metrics core """
@@ -33,13 +33,15 @@ class Filter(object):
                      ["people2","people2","people2"]
                     ]
 
-    def __init__(self, name, item = None):
+    def __init__(self, name, item = None, items = None):
         self.name = name
         for filter_data in Filter._filters_data:
             if name in filter_data:
                 self.name_short = filter_data[1]
                 self.name_plural = filter_data[2]
         self.item = item 
+        # items to be included in a filter all (item None) analysis
+        self.items = items
 
     @staticmethod
     def get_filter_from_plural(plural):
@@ -59,6 +61,9 @@ class Filter(object):
     def get_item(self):
         return self.item
 
+    def get_items(self):
+        return self.items
+
     def get_filename (self, ds):
         return ds.get_name()+"-"+self.get_name_plural()+".json"
 
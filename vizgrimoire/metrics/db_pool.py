@@ -0,0 +1,247 @@
+## Copyright (C) 2014 Bitergia
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 3 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+##
+## This file is a part of GrimoireLib
+##  (an Python library for the MetricsGrimoire and vizGrimoire systems)
+##
+##
+## Authors:
+##   Alvaro del Castillo <acs@bitergia.com>
+
+""" Thread safe pool of MySQL connections shared by all query builders """
+
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import MySQLdb
+
+
+class DBPoolTimeout(Exception):
+    """ No connection was available in the pool before the timeout """
+    pass
+
+
+class DBPool(object):
+    """ Bounded pool of connections to one MySQL database
+
+    Connections are opened lazily when they are checked out, up to
+    max_size. Checked in connections are kept idle for reuse and the ones
+    above min_size are closed once they have been idle for more than
+    max_idle seconds. An idle connection is pinged before it is handed out
+    again, and it is replaced by a new one if the server closed it.
+    """
+
+    default_min_size = 1
+    default_max_size = 8
+    default_max_idle = 300 # seconds
+
+    _pools = {} # one pool per (host, port, user, database, group)
+    _pools_lock = threading.Lock()
+
+    def __init__(self, user, password, database, host="127.0.0.1", port=3306,
+                 group=None, min_size=None, max_size=None, max_idle=None):
+        self._reset()
+        self.user = user
+        self.password = password
+        self.database = database
+        self.host = host
+        self.port = port
+        self.group = group
+        self.min_size = min_size
+        self.max_size = max_size
+        self.max_idle = max_idle
+        if min_size is None: self.min_size = DBPool.default_min_size
+        if max_size is None: self.max_size = DBPool.default_max_size
+        if max_idle is None: self.max_idle = DBPool.default_max_idle
+        if self.max_size < 1 or self.min_size > self.max_size:
+            raise ValueError("Wrong pool size: min %s max %s" %
+                             (self.min_size, self.max_size))
+
+    def _reset(self):
+        self._idle = [] # (connection, last checkin time)
+        self._size = 0 # connections opened, idle or checked out
+        self._cond = threading.Condition(threading.Lock())
+        self._pid = os.getpid()
+
+    def _check_pid(self):
+        """ A forked process can't use the parent connections: start empty """
+        if self._pid != os.getpid():
+            self._reset()
+
+    @staticmethod
+    def get_key(user, database, host, port, group):
+        return (host, port, user, database, group)
+
+    @staticmethod
+    def get_pool(user, password, database, host="127.0.0.1", port=3306,
+                 group=None):
+        """ Return the shared pool for a database, creating it if needed """
+        key = DBPool.get_key(user, database, host, port, group)
+        DBPool._pools_lock.acquire()
+        try:
+            if key not in DBPool._pools:
+                DBPool._pools[key] = DBPool(user, password, database,
+                                            host, port, group)
+            return DBPool._pools[key]
+        finally:
+            DBPool._pools_lock.release()
+
+    @staticmethod
+    def close_pools():
+        """ Close all idle connections in all pools """
+        DBPool._pools_lock.acquire()
+        try:
+            for pool in DBPool._pools.values():
+                pool.close()
+        finally:
+            DBPool._pools_lock.release()
+
+    def _connect(self):
+        if (self.group == None):
+            db = MySQLdb.connect(user=self.user, passwd=self.password,
+                                 db=self.database, host=self.host,
+                                 port=self.port)
+        else:
+            db = MySQLdb.connect(read_default_group=self.group, db=self.database)
+        # Pooled connections live long: without autocommit their REPEATABLE
+        # READ snapshot would hide the rows written by other connections
+        db.autocommit(True)
+        cursor = db.cursor()
+        cursor.execute("SET NAMES 'utf8'")
+        cursor.close()
+        return db
+
+    @staticmethod
+    def _is_alive(db):
+        try:
+            db.ping()
+        except MySQLdb.Error:
+            return False
+        return True
+
+    @staticmethod
+    def _close(db):
+        try:
+            db.close()
+        except MySQLdb.Error:
+            pass
+
+    def _prune(self):
+        """ Close connections idle for too long. Called with the lock held. """
+        now = time.time()
+        while len(self._idle) > self.min_size:
+            db, last_used = self._idle[0]
+            if now - last_used < self.max_idle: break
+            self._idle.pop(0)
+            self._size -= 1
+            self._close(db)
+
+    def checkout(self, timeout=None):
+        """ Get a connection from the pool, waiting up to timeout seconds
+            (forever if None) if all of them are in use """
+        self._check_pid()
+        db = None
+        self._cond.acquire()
+        try:
+            deadline = None
+            if timeout is not None: deadline = time.time() + timeout
+            while True:
+                if len(self._idle) > 0:
+                    db = self._idle.pop()[0]
+                    break
+                if self._size < self.max_size:
+                    # Reserve the slot and connect outside the lock
+                    self._size += 1
+                    break
+                if deadline is None:
+                    self._cond.wait()
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise DBPoolTimeout("No free connection to %s after %s secs"
+                                            % (self.database, timeout))
+                    self._cond.wait(remaining)
+        finally:
+            self._cond.release()
+
+        if db is not None and not self._is_alive(db):
+            logging.info("Reconnecting to " + self.database)
+            self._close(db)
+            db = None
+        if db is None:
+            try:
+                db = self._connect()
+            except:
+                self._release_slot()
+                raise
+        return db
+
+    def checkin(self, db, broken=False):
+        """ Return a connection to the pool. Broken connections are closed. """
+        self._check_pid()
+        if broken:
+            self._close(db)
+            self._release_slot()
+            return
+        self._cond.acquire()
+        try:
+            self._idle.append((db, time.time()))
+            self._prune()
+            self._cond.notify()
+        finally:
+            self._cond.release()
+
+    def _release_slot(self):
+        self._cond.acquire()
+        try:
+            self._size -= 1
+            self._cond.notify()
+        finally:
+            self._cond.release()
+
+    @contextmanager
+    def connection(self, timeout=None):
+        """ with pool.connection() as db: checkout and checkin a connection """
+        db = self.checkout(timeout)
+        broken = False
+        try:
+            yield db
+        except (MySQLdb.OperationalError, MySQLdb.InterfaceError):
+            broken = True
+            raise
+        finally:
+            self.checkin(db, broken)
+
+    def close(self):
+        """ Close all idle connections. Checked out ones are not affected. """
+        self._check_pid()
+        self._cond.acquire()
+        try:
+            for db, last_used in self._idle:
+                self._close(db)
+                self._size -= 1
+            self._idle = []
+        finally:
+            self._cond.release()
+
+    def get_size(self):
+        return self._size
+
+    def get_idle(self):
+        return len(self._idle)
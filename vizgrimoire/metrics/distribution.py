@@ -0,0 +1,138 @@
+## Copyright (C) 2014 Bitergia
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 3 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+##
+## This file is a part of GrimoireLib
+##  (an Python library for the MetricsGrimoire and vizGrimoire systems)
+##
+##
+## Authors:
+##   Alvaro del Castillo <acs@bitergia.com>
+
+""" Median, average and percentiles of values streamed from the database """
+
+from numpy import average, percentile
+
+
+class QuantileSketch(object):
+    """ Summary of a stream of values using bounded memory
+
+    Count and average are exact. Values are kept in levels: the ones in
+    level i stand for 2**i values. When a level has more than capacity
+    values, they are sorted and every other one is moved to the next
+    level. While no more than capacity values are added, the quantiles are
+    exact. After that, the rank error is around count/capacity values.
+    """
+
+    default_capacity = 10000
+
+    def __init__(self, capacity = None):
+        self.capacity = capacity
+        if capacity is None: self.capacity = QuantileSketch.default_capacity
+        self.levels = [[]]
+        self.offsets = [0] # values moved up in each level: even or odd ones
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, value):
+        value = float(value)
+        self.levels[0].append(value)
+        self.count += 1
+        self.total += value
+        if len(self.levels[0]) > self.capacity: self._compact()
+
+    def _compact(self):
+        level = 0
+        while level < len(self.levels) and len(self.levels[level]) > self.capacity:
+            values = sorted(self.levels[level])
+            kept = []
+            # An even number of values is compacted so no weight is lost
+            if len(values) % 2 == 1: kept.append(values.pop())
+            if level + 1 == len(self.levels):
+                self.levels.append([])
+                self.offsets.append(0)
+            self.levels[level + 1].extend(values[self.offsets[level]::2])
+            # Alternate the half moved up so the error doesn't accumulate
+            self.offsets[level] = 1 - self.offsets[level]
+            self.levels[level] = kept
+            level += 1
+
+    def is_exact(self):
+        return len(self.levels) == 1
+
+    def get_avg(self):
+        if self.count == 0: return float('nan')
+        if self.is_exact(): return float(average(self.levels[0]))
+        return self.total / self.count
+
+    def get_percentile(self, q):
+        """ Value below which q percent of the values are """
+        if self.count == 0: return float('nan')
+        if self.is_exact(): return float(percentile(self.levels[0], q))
+
+        values = []
+        for level in range(0, len(self.levels)):
+            weight = 2 ** level
+            values.extend([(value, weight) for value in self.levels[level]])
+        values.sort()
+        rank = (q / 100.0) * (self.count - 1)
+        seen = 0
+        for (value, weight) in values:
+            seen += weight
+            if seen > rank: return value
+        return values[-1][0]
+
+    def get_median(self):
+        return self.get_percentile(50)
+
+
+def get_percentile_field(q):
+    return "p%i" % q
+
+def get_distribution(values, percentiles = [], capacity = None):
+    """ Median, avg and percentiles of values, which can be any iterable """
+    sketch = QuantileSketch(capacity)
+    for value in values:
+        if value is not None: sketch.add(value)
+
+    data = {"median": sketch.get_median(), "avg": sketch.get_avg()}
+    for q in percentiles:
+        data[get_percentile_field(q)] = sketch.get_percentile(q)
+    return data
+
+def get_distribution_by_period(rows, period_field, percentiles = [],
+                               capacity = None):
+    """ Median, avg and percentiles of the values in each period
+
+    rows is any iterable of (period id, value), i.e. a database cursor, in
+    any order. Only a QuantileSketch per period is kept in memory.
+    """
+    sketches = {}
+    for (period_id, value) in rows:
+        if value is None: continue
+        if period_id not in sketches:
+            sketches[period_id] = QuantileSketch(capacity)
+        sketches[period_id].add(value)
+
+    fields = ["median", "avg"] + [get_percentile_field(q) for q in percentiles]
+    data = dict([(field, []) for field in fields])
+    data[period_field] = sorted(sketches.keys())
+    for period_id in data[period_field]:
+        sketch = sketches[period_id]
+        data["median"].append(sketch.get_median())
+        data["avg"].append(sketch.get_avg())
+        for q in percentiles:
+            data[get_percentile_field(q)].append(sketch.get_percentile(q))
+    return data
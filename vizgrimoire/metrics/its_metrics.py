@@ -26,6 +26,10 @@
 import logging
 import MySQLdb
 
+from GrimoireUtils import completePeriodIds, period_fields
+
+from distribution import get_distribution, get_distribution_by_period
+
 from metrics import Metrics
 
 from metrics_filter import MetricFilters
@@ -220,12 +224,16 @@ class TimeToClose(Metrics):
 
     """
 
-    def get_agg(self):
-        fields = Set([])
+    percentiles = [75, 90, 95]
+
+    def _get_sql(self, evolutionary):
         tables = Set([])
         filters = Set([])
 
-        fields.add("TIMESTAMPDIFF(SECOND, i.submitted_on, t1.changed_on) as timeto")
+        fields = "TIMESTAMPDIFF(SECOND, i.submitted_on, t1.changed_on) as timeto"
+        if evolutionary:
+            fields = self.db.GetSQLPeriodField(self.filters.period, "t1.changed_on") + \
+                ", " + fields
         tables.add("issues i")
         tables.union_update(self.db.GetSQLReportFrom(self.filters))
 
@@ -239,11 +247,27 @@ class TimeToClose(Metrics):
         filters.add("i.id=t1.issue_id")
         filters.union_update(self.db.GetSQLReportWhere(self.filters))
 
-        query = "select " + self.db._get_fields_query(fields)
+        query = "select " + fields
         query = query + " from " + self.db._get_tables_query(tables)
         query = query + " where " + self.db._get_filters_query(filters)
 
-        return self.db.ExecuteQuery(query)
+        return query
+
+    def get_agg(self):
+        """ Median, avg and percentiles of the time to close in seconds """
+        rows = self.db.ExecuteQueryStream(self._get_sql(False))
+        data = get_distribution((row[0] for row in rows), self.percentiles)
+        return dict([("timeto_" + field, value) for (field, value) in data.items()])
+
+    def get_ts(self):
+        period_field = period_fields[self.filters.period]
+        rows = self.db.ExecuteQueryStream(self._get_sql(True))
+        data = get_distribution_by_period(rows, period_field, self.percentiles)
+        ts = {period_field: data.pop(period_field)}
+        for (field, value) in data.items():
+            ts["timeto_" + field] = value
+        return completePeriodIds(ts, self.filters.period,
+                                 self.filters.startdate, self.filters.enddate)
 
 
 #closers
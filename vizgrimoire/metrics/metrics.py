@@ -22,7 +22,11 @@
 ##   Daniel Izquierdo-Cortazar <dizquierdo@bitergia.com>
 
 
+import copy
+import math
+
 from GrimoireUtils import completePeriodIds, GetDates, GetPercentageDiff, check_array_values
+from GrimoireUtils import getPeriodAxis, getPeriodDates, period_fields
 from query_builder import DSQuery
 from metrics_filter import MetricFilters
 
@@ -50,6 +54,8 @@ class Metrics(object):
     data_source = None
     domains_limit = 30
     max_decimals = 2
+    memo = False # get_ts and get_agg results are memoized during the run
+    _memo_results = {}
 
     def __init__(self, dbcon = None, filters = None):
         """db connection and filter to be used"""
@@ -107,61 +113,73 @@ class Metrics(object):
         return self.data_source
 
     @staticmethod
-    def _convert_group_to_ts(data, id_field):
-        """ Convert a dict with mixed ts to individual ts """
+    def _get_items_ts(data, id_field, period, startdate, enddate):
+        """ Convert a dict with mixed ts to a complete ts for each item
+
+        data has a row for each item and period. The rows are bucketed by
+        item and period id into an items x periods matrix for each metric,
+        filled with 0 for the periods without data. All the items share
+        the generic time series fields: period, unixtime, id and date.
+        """
         data = check_array_values(data)
-        ts = {}
         if id_field not in data:
             raise Exception(id_field + " not in " + str(data))
+        period_field = period_fields[period]
+        start, end = getPeriodDates(startdate, enddate)
+        axis = getPeriodAxis(period, start, end)
+        if axis is None:
+            raise Exception("PERIOD: " + period + " not supported")
+        periods, unixtimes, labels = axis
+
+        metrics = [field for field in data.keys()
+                   if field not in (id_field, period_field)]
+
+        # Position of each item and period in the matrix
+        items = []
+        items_pos = {}
+        for item in data[id_field]:
+            if item not in items_pos:
+                items_pos[item] = len(items)
+                items.append(item)
+        periods_pos = dict([(period_id, pos) for (pos, period_id) in enumerate(periods)])
 
-        fields = data.keys()
-        fields.remove(id_field)
-
-        # Create a unique ts for each id_field
-
-        # Create empty structure
-        id_fields = list(set(data[id_field]))
-        ts[id_field] = id_fields
-        for field in fields: 
-            ts[field]  = []
-            for id in id_fields:
-                ts[field].append([])
-
-        # Fill items data
-        for i in range(0, len(data[id_field])):
-            item = data[id_field][i]
-            pos = id_fields.index(item)
-            for field in fields:
-                ts[field][pos].append(data[field][i])
-        return ts
-
-    @staticmethod
-    def _complete_period_ids_items(data, id_field, period, startdate, enddate):
         ts = {}
-        # Complete the time series and share the date series
-        metrics = data.keys()
-        if id_field not in data:
-            raise Exception(id_field + " not in " + str(data))
-
-        metrics.remove(id_field)
-        metrics.remove(period)
-        ts[id_field] = data[id_field]
+        ts[id_field] = items
         for metric in metrics:
-            ts[metric] = []
-
-        for i in range (0, len(ts[id_field])):
+            ts[metric] = [[0] * len(periods) for item in items]
+        if len(items) == 0: return ts
+
+        # Reverse order so the first row for an item and period is used
+        row_periods = data.get(period_field, [])
+        for row in range(len(row_periods)-1, -1, -1):
+            period_pos = periods_pos.get(row_periods[row])
+            if period_pos is None: continue
+            item_pos = items_pos[data[id_field][row]]
             for metric in metrics:
-                # Standard time series for each metric and convert
-                metric_ts = {}
-                metric_ts[metric] = data[metric][i]
-                metric_ts[period] = data[period][i]
-                metric_ts = completePeriodIds(metric_ts, period, startdate, enddate)
-                ts[metric].append(metric_ts[metric])
-                # Add additional time series fields: unixtime
-                metric_ts.pop(metric) # just time series generic fields
-                ts = dict(ts.items()+metric_ts.items())
+                value = data[metric][row]
+                if isinstance(value, float) and math.isnan(value): value = 0
+                ts[metric][item_pos][period_pos] = value
+
+        ts[period_field] = list(periods)
+        ts['unixtime'] = list(unixtimes)
+        ts['id'] = range(0, len(periods))
+        ts['date'] = list(labels)
         return ts
 
+    def _memoize(self, kind, compute):
+        """ Returns compute() memoized for this metric and its filters
+
+        kind is True for time series, False for aggregated values or the
+        name of other results. The results are shared by all the metrics
+        with the same id and filters during the run, and a copy is
+        returned because callers change them.
+        """
+        key = (self.data_source, self.id, kind, self.db.database,
+               self.filters.get_key())
+        if key not in Metrics._memo_results:
+            Metrics._memo_results[key] = compute()
+        return copy.deepcopy(Metrics._memo_results[key])
+
     def get_ts (self):
         """Returns a time series of a specific class
 
@@ -174,14 +192,19 @@ class Metrics(object):
 
         """
 
+        if self.memo: return self._memoize(True, self._get_ts)
+        return self._get_ts()
+
+    def _get_ts (self):
         query = self._get_sql(True)
         ts = self.db.ExecuteQuery(query)
         if self.filters.type_analysis and self.filters.type_analysis[1] is None:
-            id_field = DSQuery.get_group_field(self.filters.type_analysis[0])
-            id_field = id_field.split('.')[1] # remove table name
-            ts = Metrics._convert_group_to_ts(ts, id_field)
-            ts = Metrics._complete_period_ids_items(ts, id_field, self.filters.period,
-                                                    self.filters.startdate, self.filters.enddate)
+            id_field = self.db.get_group_field(self.filters.type_analysis[0])
+            id_field = DSQuery.get_group_field_name(id_field)
+            # Metrics not grouping by items are got item by item by the caller
+            if id_field not in ts: return ts
+            ts = Metrics._get_items_ts(ts, id_field, self.filters.period,
+                                       self.filters.startdate, self.filters.enddate)
         else:
             ts = completePeriodIds(ts, self.filters.period, 
                                    self.filters.startdate, self.filters.enddate)
@@ -189,6 +212,10 @@ class Metrics(object):
 
     def get_agg(self):
         """ Returns an aggregated value """
+        if self.memo: return self._memoize(False, self._get_agg)
+        return self._get_agg()
+
+    def _get_agg(self):
         q = self._get_sql(False)
         return self.db.ExecuteQuery(q)
 
@@ -226,7 +253,6 @@ class Metrics(object):
     def _get_trends_all_items(self, date, days):
         """ Returns the trend metrics between now and now-days values """
         from GrimoireUtils import check_array_values
-        from query_builder import DSQuery
         # Keeping state of origin filters
         filters = self.filters
 
@@ -242,44 +268,126 @@ class Metrics(object):
         self.filters.global_filter = filters.global_filter
         prev = check_array_values(self.get_agg())
 
-        group_field = DSQuery.get_group_field(self.filters.type_analysis[0])
-        group_field = group_field.split('.')[1] # remove table name
+        # Returning filters to their original value
+        self.filters = filters
+
+        group_field = self.db.get_group_field(self.filters.type_analysis[0])
+        group_field = DSQuery.get_group_field_name(group_field)
+        # Metrics not grouping by items are got item by item by the caller
+        if group_field not in prev or group_field not in last: return {}
         field = prev.keys()[0]
         if field == group_field: field = prev.keys()[1]
 
-        # We need to build a new dict with trends
-        # First, we need to find all possible keys
-        items = list(set(prev[group_field] + last[group_field]))
-        # Complete prev and last adding missing (0) values
-        for item in items:
-            if item not in prev[group_field]:
-                prev[field].append(0)
-                prev[group_field].append(item)
-            if item not in last[group_field]:
-                last[field].append(0)
-                last[group_field].append(item)
-        # Recreate last so the items are in the same order than prev
-        last_ordered = {}
-        last_ordered[field] = []
-        last_ordered[group_field] = []
-        for item in prev[group_field]:
-            last_ordered[group_field].append(item)
-            pos = last[group_field].index(item)
-            last_ordered[field].append(last[field][pos])
+        # Join prev and last by item, using 0 for the missing ones
+        prev_items = dict(zip(prev[group_field], prev[field]))
+        last_items = dict(zip(last[group_field], last[field]))
+        items = prev[group_field] + [item for item in last[group_field]
+                                     if item not in prev_items]
+        prev_values = [prev_items.get(item, 0) for item in items]
+        last_values = [last_items.get(item, 0) for item in items]
 
         # Create the dict with trend metrics
         data = {}
-        data[group_field] = prev[group_field]
-        data[self.id+'_'+str(days)] = last[field]
+        data[group_field] = items
+        data[self.id+'_'+str(days)] = last_values
         data['diff_net'+self.id+'_'+str(days)] = \
-            [last_ordered[field][i] - prev[field][i] for i in range(0, len(prev[field]))]
+            [last_values[i] - prev_values[i] for i in range(0, len(items))]
         data['percentage_'+self.id+'_'+str(days)] = \
-            [GetPercentageDiff(prev[field][i],last_ordered[field][i]) for i in range(0, len(prev[field]))]
+            [GetPercentageDiff(prev_values[i], last_values[i]) for i in range(0, len(items))]
 
-        # Returning filters to their original value
-        self.filters = filters
         return (data)
 
+    def _get_sql_trends(self, date, days_list):
+        """ Returns the sql to get the trends for all days in one query
+
+        None if the query of the metric can't be rewritten for it.
+        """
+        filters = self.filters
+        periods = []
+        for days in days_list:
+            chardates = GetDates(date, days)
+            periods.append(("last_"+str(days), chardates[1], chardates[0]))
+            periods.append(("prev_"+str(days), chardates[2], chardates[1]))
+        startdate = min([period[1] for period in periods])
+        enddate = periods[0][2]
+
+        self.filters = MetricFilters(filters.period,
+                                     startdate, enddate, filters.type_analysis)
+        self.filters.global_filter = filters.global_filter
+        try:
+            sql = self._get_sql(False)
+        finally:
+            self.filters = filters
+        return self.db.GetSQLTrends(sql, startdate, enddate, periods)
+
+    def _use_sql_trends(self):
+        """ The trends query is only valid for metrics using the generic
+            get_agg and get_trends with the query from their _get_sql """
+        metric = type(self)
+        for method in ["get_agg", "_get_agg", "get_trends"]:
+            if getattr(metric, method).im_func is not getattr(Metrics, method).im_func:
+                return False
+        return metric._get_sql.im_func is not Metrics._get_sql.im_func
+
+    @staticmethod
+    def _get_trend_value(value):
+        if value is None: return 0
+        return int(value)
+
+    def get_trends_multi(self, date, days_list):
+        """ Returns the trend metrics for several number of days
+
+        The values for all the periods and their previous periods are got
+        in one query using conditional aggregation. Metrics with their own
+        get_agg or get_trends, without _get_sql or whose query can't be
+        rewritten use get_trends for each number of days.
+        """
+        data = {}
+        if len(days_list) == 0: return data
+        sql = None
+        if self._use_sql_trends():
+            sql = self._get_sql_trends(date, days_list)
+
+        all_items = self.filters.type_analysis and self.filters.type_analysis[1] is None
+        if sql is not None:
+            res = self.db.ExecuteQuery(sql)
+            if all_items: res = check_array_values(res)
+            suffix = "_last_"+str(days_list[0])
+            fields = [field[:-len(suffix)] for field in res if field.endswith(suffix)]
+            # Just one metric field supported
+            if len(fields) != 1: sql = None
+
+        if sql is None:
+            for days in days_list:
+                data = dict(data.items() + self.get_trends(date, days).items())
+            return data
+
+        field = fields[0]
+        if all_items:
+            group_field = self.db.get_group_field(self.filters.type_analysis[0])
+            group_field = DSQuery.get_group_field_name(group_field)
+            # Metrics not grouping by items are got item by item by the caller
+            if group_field not in res: return {}
+            data[group_field] = res[group_field]
+
+        for days in days_list:
+            last = res[field+"_last_"+str(days)]
+            prev = res[field+"_prev_"+str(days)]
+            if all_items:
+                last = [Metrics._get_trend_value(value) for value in last]
+                prev = [Metrics._get_trend_value(value) for value in prev]
+                diff_net = [last[i] - prev[i] for i in range(0, len(last))]
+                percentage = [GetPercentageDiff(prev[i], last[i]) for i in range(0, len(last))]
+            else:
+                last = Metrics._get_trend_value(last)
+                prev = Metrics._get_trend_value(prev)
+                diff_net = last - prev
+                percentage = GetPercentageDiff(prev, last)
+            data['diff_net'+self.id+'_'+str(days)] = diff_net
+            data['percentage_'+self.id+'_'+str(days)] = percentage
+            data[self.id+'_'+str(days)] = last
+        return data
+
     def _get_top_supported_filters(self):
         return []
 
@@ -38,3 +38,9 @@ class MetricFilters(object):
 
     def set_global_filter(self, value): self.global_filter = value
 
+    def get_key(self):
+        """ Hashable value that is the same for equal filters """
+        return repr((self.period, self.startdate, self.enddate,
+                     self.type_analysis, self.npeople, self.people_out,
+                     self.companies_out, self.global_filter))
+
@@ -26,13 +26,13 @@
 
 import logging
 
-from datetime import datetime
-
 from data_source import DataSource
 from GrimoireUtils import completePeriodIds, GetDates, GetPercentageDiff
+from GrimoireUtils import check_array_values, period_fields
 from filter import Filter
 from metrics import Metrics
 from metrics_filter import MetricFilters
+from query_builder import DSQuery
 
 from MLS import MLS
 
@@ -656,30 +656,25 @@ class UnansweredPosts(Metrics):
     desc = "Unanswered posts in mailing lists"""
     data_source = MLS
 
-    def __get_date_from_month(self, monthid):
-        # month format: year*12+month
-        year = (monthid-1) / 12
-        month = monthid - year*12
-        day = 1
-        current = str(year) + "-" + str(month) + "-" + str(day)
-        return (current)
-
-    def __get_messages(self, from_date, to_date):
+    def __get_messages(self):
+        # All messages in the period ordered by date, with the id of
+        # their period and, for filter all, their item
         fields = Set([])
         tables = Set([])
         filters = Set([])
 
         fields.add("m.message_ID as message_ID")
         fields.add("m.is_response_of as is_response_of")
+        fields.add(self.db.GetSQLPeriodField(self.filters.period, "m.first_date"))
         tables.add("messages m")
-        filters.add("m.first_date >= '" + str(from_date) + "' ") 
-        filters.add("m.first_date < '" + str(to_date) + "' ")
         filters.add("m.first_date >= " + str(self.filters.startdate))
         filters.add("m.first_date < " + str(self.filters.enddate))
 
         if (self.filters.type_analysis and self.filters.type_analysis[0] in ("repository")):
             tables.union_update(self.db.GetSQLReportFrom(self.filters))
             filters.union_update(self.db.GetSQLReportWhere(self.filters))
+            if self.filters.type_analysis[1] is None:
+                fields.add(self.db.get_group_field(self.filters.type_analysis[0]))
 
         select_str = "select " + self.db._get_fields_query(fields)
         from_str = " from " + self.db._get_tables_query(tables)
@@ -689,63 +684,67 @@ class UnansweredPosts(Metrics):
 
         query = select_str + from_str + where_str
 
-        results = self.db.ExecuteQuery(query)
-
-        if isinstance(results['message_ID'], list):
-            return [(results['message_ID'][i], results['is_response_of'][i])\
-                    for i in range(len(results['message_ID']))]
-        else:
-            return [(results['message_ID'], results['is_response_of'])]
+        return check_array_values(self.db.ExecuteQuery(query))
 
     def get_agg(self):
         return {}
 
     def get_ts(self):
-        # Get all posts for each month and determine which from those
-        # are still unanswered. Returns the number of unanswered
-        # posts on each month.
+        # Get all posts in one ordered scan and determine, for each period,
+        # which posts from that period are still unanswered at its end.
+        # Returns the number of unanswered posts on each period.
         period = self.filters.period
+        period_field = period_fields[period]
 
         if (self.filters.type_analysis and self.filters.type_analysis[0] not in ("repository")):
             return {}
 
-        if (period != "month"):
-            logging.error("Period not supported in " + self.id + " " + period)
-            return None
-
-        startdate = self.filters.startdate
-        enddate = self.filters.enddate
-
-        start = datetime.strptime(startdate, "'%Y-%m-%d'")
-        end = datetime.strptime(enddate, "'%Y-%m-%d'")
-
-        start_month = (start.year * 12 + start.month) - 1
-        end_month = (end.year * 12 + end.month) - 1
-        months = end_month - start_month + 2
-        num_unanswered = {'month' : [],
-                          'unanswered_posts' : []}
-
-        for i in range(0, months):
-            unanswered = []
-            current_month = start_month + i
-            from_date = self.__get_date_from_month(current_month)
-            to_date = self.__get_date_from_month(current_month + 1)
-            messages = self.__get_messages(from_date, to_date)
-
-            for message in messages:
-                message_id = message[0]
-                response_of = message[1]
-
-                if response_of is None:
-                    unanswered.append(message_id)
-                    continue
-
-                if response_of in unanswered:
-                    unanswered.remove(response_of)
-
-            num_unanswered['month'].append(current_month)
-            num_unanswered['unanswered_posts'].append(len(unanswered))
-
-        return completePeriodIds(num_unanswered, self.filters.period,
-                                 self.filters.startdate, self.filters.enddate)
+        id_field = None
+        if self.filters.type_analysis and self.filters.type_analysis[1] is None:
+            id_field = self.db.get_group_field(self.filters.type_analysis[0])
+            id_field = DSQuery.get_group_field_name(id_field)
+
+        messages = self.__get_messages()
+        messages_ids = messages.get('message_ID', [])
+        if id_field is None: items = [None] * len(messages_ids)
+        else: items = messages.get(id_field, [])
+
+        # unanswered posts of the current period of each item
+        unanswered = {}
+        current_period = {}
+        # (item, period): number of unanswered posts
+        num_unanswered = {}
+        keys = []
+
+        for (message_id, response_of, period_id, item) in \
+            zip(messages_ids, messages.get('is_response_of', []),
+                messages.get(period_field, []), items):
+            key = (item, period_id)
+            if current_period.get(item) != period_id:
+                # Answers only count in the period of the post
+                current_period[item] = period_id
+                unanswered[item] = {}
+                if key not in num_unanswered:
+                    num_unanswered[key] = 0
+                    keys.append(key)
+            posts = unanswered[item]
+
+            if response_of is None:
+                # Repeated rows are counted as many times as they appear
+                posts[message_id] = posts.get(message_id, 0) + 1
+                num_unanswered[key] += 1
+                continue
+
+            if posts.get(response_of, 0) > 0:
+                posts[response_of] -= 1
+                num_unanswered[key] -= 1
+
+        data = {period_field: [key[1] for key in keys],
+                'unanswered_posts': [num_unanswered[key] for key in keys]}
+        if id_field is None:
+            return completePeriodIds(data, self.filters.period,
+                                     self.filters.startdate, self.filters.enddate)
+        data[id_field] = [key[0] for key in keys]
+        return Metrics._get_items_ts(data, id_field, self.filters.period,
+                                     self.filters.startdate, self.filters.enddate)
 
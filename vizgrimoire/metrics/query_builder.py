@@ -22,17 +22,28 @@
 ##   Alvaro del Castillo <acs@bitergia.com>
 
 import logging
-import MySQLdb
 import re
 import sys
+from array import array
+from contextlib import contextmanager
 from sets import Set
 
+import numpy
+from MySQLdb.constants import FIELD_TYPE
+from MySQLdb.cursors import SSCursor
+
+from db_pool import DBPool
 from metrics_filter import MetricFilters
 
+class DBLockTimeout(Exception):
+    """ A named lock was not got before the timeout """
+    pass
+
 class DSQuery(object):
     """ Generic methods to control access to db """
 
-    db_conn_pool = {} # one connection per database
+    query_cache = None # QueryCache shared by all query builders
+    query_stats = None # QueryStats shared by all query builders
 
     def __init__(self, user, password, database, identities_db = None, host="127.0.0.1", port=3306, group=None):
         self.identities_db = identities_db
@@ -42,15 +53,7 @@ class DSQuery(object):
         self.host = host
         self.port = port
         self.group = group
-        if database in DSQuery.db_conn_pool:
-            db = DSQuery.db_conn_pool[database]
-        else:
-            db = self.__SetDBChannel__(user, password, database, host, port, group)
-            DSQuery.db_conn_pool[database] = db
-        self.cursor = db.cursor()
-        self.cursor.execute("SET NAMES 'utf8'")
-
-        db = self.__SetDBChannel__(user, password, database, host, port, group)
+        self.pool = DBPool.get_pool(user, password, database, host, port, group)
 
         self.create_indexes()
 
@@ -66,6 +69,7 @@ class DSQuery(object):
             # Expected format: "count(distinct(pup.upeople_id)) AS authors"
             count_field = fields.split(" ")[2]
             fields = group_field + ", " + fields
+            group_field = group_field.split(" AS ")[0]
 
         sql = 'SELECT '+ fields
         sql += ' FROM '+ tables
@@ -81,26 +85,34 @@ class DSQuery(object):
 
         return(sql)
 
-    def GetSQLPeriod(self, period, date, fields, tables, filters, start, end,
-                     all_items = None):
-        group_field = None
-        if all_items :
-            group_field = self.get_group_field(all_items)
-            fields = group_field + ", " + fields
-
+    def GetSQLPeriodField(self, period, date):
+        """ Field with the id of the period of date in time series """
         iso_8601_mode = 3
         if (period == 'day'):
-            # Remove time so unix timestamp is start of day    
-            sql = 'SELECT UNIX_TIMESTAMP(DATE('+date+')) AS unixtime, '
+            # Remove time so unix timestamp is start of day. In UTC, as the
+            # time series axis, not in the session time zone
+            field = "TIMESTAMPDIFF(SECOND, '1970-01-01', DATE("+date+")) AS unixtime"
         elif (period == 'week'):
-            sql = 'SELECT YEARWEEK('+date+','+str(iso_8601_mode)+') AS week, '
+            field = 'YEARWEEK('+date+','+str(iso_8601_mode)+') AS week'
         elif (period == 'month'):
-            sql = 'SELECT YEAR('+date+')*12+MONTH('+date+') AS month, '
+            field = 'YEAR('+date+')*12+MONTH('+date+') AS month'
         elif (period == 'year'):
-            sql = 'SELECT YEAR('+date+')*12 AS year, '
+            field = 'YEAR('+date+')*12 AS year'
         else:
             logging.error("PERIOD: "+period+" not supported")
             raise Exception
+        return field
+
+    def GetSQLPeriod(self, period, date, fields, tables, filters, start, end,
+                     all_items = None):
+        group_field = None
+        if all_items :
+            group_field = self.get_group_field(all_items)
+            fields = group_field + ", " + fields
+            group_field = group_field.split(" AS ")[0]
+
+        iso_8601_mode = 3
+        sql = 'SELECT ' + self.GetSQLPeriodField(period, date) + ', '
         # sql = paste(sql, 'DATE_FORMAT (',date,', \'%d %b %Y\') AS date, ')
         sql += fields
         if all_items: fields + ", " + group_field
@@ -139,6 +151,94 @@ class DSQuery(object):
 
         return(sql)
 
+    @staticmethod
+    def _find_top_level(sql, token, start = 0):
+        """ Position of token (in upper case) in sql out of parenthesis
+            and quotes, -1 if it is not found """
+        sql_upper = sql.upper()
+        depth = 0
+        quote = None
+        for pos in range(start, len(sql)):
+            char = sql[pos]
+            if quote is not None:
+                if char == quote: quote = None
+            elif depth == 0 and sql_upper.startswith(token, pos):
+                return pos
+            elif char in ("'", '"'): quote = char
+            elif char == "(": depth += 1
+            elif char == ")": depth -= 1
+        return -1
+
+    @staticmethod
+    def _split_top_level(sql, sep = ","):
+        """ Split sql by sep out of parenthesis and quotes """
+        items = []
+        pos = DSQuery._find_top_level(sql, sep)
+        while pos != -1:
+            items.append(sql[:pos])
+            sql = sql[pos+len(sep):]
+            pos = DSQuery._find_top_level(sql, sep)
+        items.append(sql)
+        return items
+
+    _agg_field_re = re.compile(r"^(COUNT|SUM|MIN|MAX|AVG)\s*\(", re.IGNORECASE)
+    _alias_re = re.compile(r"^\)\s+AS\s+(\w+)\s*$", re.IGNORECASE)
+    _distinct_re = re.compile(r"^\s*DISTINCT\b(.*)$", re.IGNORECASE | re.DOTALL)
+
+    def GetSQLTrends(self, sql, start, end, periods):
+        """ Rewrite an aggregated query to get its metrics in several periods
+
+        sql must be built by GetSQLGlobal for the dates start to end. Each
+        aggregated field "AGG(expr) AS name" is replaced by one conditional
+        aggregation "AGG(CASE WHEN date in period THEN expr END) AS name_suffix"
+        for each (suffix, start, end) in periods, so all the periods are
+        got scanning the data once. Returns None if sql can't be rewritten,
+        i.e. if start is used in other conditions than the dates range: they
+        would use the earliest start for all the periods.
+        """
+        from_pos = DSQuery._find_top_level(sql, " FROM ")
+        if not sql.upper().startswith("SELECT ") or from_pos == -1: return None
+        where_pos = DSQuery._find_top_level(sql, " WHERE ", from_pos)
+        if where_pos == -1: return None
+        date_re = re.compile(" WHERE (.+?)>=" + re.escape(start) +
+                             " AND \\1<" + re.escape(end), re.DOTALL)
+        date_match = date_re.match(sql, where_pos)
+        if date_match is None: return None
+        if sql.count(start) != 1: return None
+        date = date_match.group(1)
+
+        fields = []
+        for field in DSQuery._split_top_level(sql[len("SELECT "):from_pos]):
+            field = field.strip()
+            agg = DSQuery._agg_field_re.match(field)
+            if agg is None:
+                # Group fields in filter all queries
+                if "(" in field: return None
+                fields.append(field)
+                continue
+            # The aggregation must be the whole field: COUNT(x)/COUNT(y) is not supported
+            close_pos = DSQuery._find_top_level(field, ")", agg.end())
+            if close_pos == -1: return None
+            alias = DSQuery._alias_re.match(field[close_pos:])
+            if alias is None: return None
+            expr = field[agg.end():close_pos]
+            distinct = ""
+            distinct_match = DSQuery._distinct_re.match(expr)
+            if distinct_match is not None:
+                distinct = "DISTINCT "
+                expr = distinct_match.group(1)
+            if expr.strip() == "*": expr = "1"
+            for (suffix, period_start, period_end) in periods:
+                fields.append("%s(%sCASE WHEN %s>=%s AND %s<%s THEN %s END) AS %s_%s" %
+                              (agg.group(1), distinct, date, period_start,
+                               date, period_end, expr, alias.group(1), suffix))
+
+        sql_trends = "SELECT " + ", ".join(fields) + sql[from_pos:]
+        # Fields used for ordering filter all queries don't exist anymore
+        order_pos = DSQuery._find_top_level(sql_trends, " ORDER BY ")
+        if order_pos != -1: sql_trends = sql_trends[:order_pos]
+        return sql_trends
+
     def _get_fields_query(self, fields):
         # Returns a string with fields separated by ","
         fields_str = ""
@@ -242,39 +342,187 @@ class DSQuery(object):
                                   startdate, enddate, all_items)
         return(q)
 
-    def __SetDBChannel__ (self, user=None, password=None, database=None,
-                      host="127.0.0.1", port=3306, group=None):
-        if (group == None):
-            db = MySQLdb.connect(user=user, passwd=password,
-                                 db=database, host=host, port=port)
-        else:
-            db = MySQLdb.connect(read_default_group=group, db=database)
+    @staticmethod
+    def set_query_cache(query_cache):
+        """ Use a QueryCache for the results of ExecuteQuery, None to disable it """
+        DSQuery.query_cache = query_cache
 
-        return db
+    @staticmethod
+    def set_query_stats(query_stats):
+        """ Record the stats of the queries in a QueryStats, None to disable it """
+        DSQuery.query_stats = query_stats
 
     def ExecuteQuery (self, sql):
         if sql is None: return {}
+        if DSQuery.query_stats is not None:
+            return DSQuery.query_stats.execute(self.database, sql,
+                                               self._ExecuteCachedQuery,
+                                               self._ExecuteQuery)
+        return self._ExecuteCachedQuery(sql)
+
+    def _ExecuteCachedQuery (self, sql):
+        if DSQuery.query_cache is not None:
+            return DSQuery.query_cache.execute(self.database, sql, self._ExecuteQuery)
+        return self._ExecuteQuery(sql)
+
+    def _ExecuteQuery (self, sql):
         result = {}
-        self.cursor.execute(sql)
-        rows = self.cursor.rowcount
-        columns = self.cursor.description
-
-        if columns is None: return result
-
-        for column in columns:
-            result[column[0]] = []
-        if rows > 1:
-            for value in self.cursor.fetchall():
-                for (index,column) in enumerate(value):
-                    result[columns[index][0]].append(column)
-        elif rows == 1:
-            value = self.cursor.fetchone()
-            for i in range (0, len(columns)):
-                result[columns[i][0]] = value[i]
+        with self.pool.connection() as db:
+            cursor = db.cursor()
+            try:
+                cursor.execute(sql)
+                rows = cursor.rowcount
+                columns = cursor.description
+
+                if columns is None: return result
+
+                for column in columns:
+                    result[column[0]] = []
+                if rows > 1:
+                    for value in cursor.fetchall():
+                        for (index,column) in enumerate(value):
+                            result[columns[index][0]].append(column)
+                elif rows == 1:
+                    value = cursor.fetchone()
+                    for i in range (0, len(columns)):
+                        result[columns[i][0]] = value[i]
+            finally:
+                cursor.close()
+        return result
+
+    # Columns with these MySQL types are stored in typed arrays
+    _int_field_types = [FIELD_TYPE.TINY, FIELD_TYPE.SHORT, FIELD_TYPE.LONG,
+                        FIELD_TYPE.LONGLONG, FIELD_TYPE.INT24, FIELD_TYPE.YEAR]
+    _float_field_types = [FIELD_TYPE.FLOAT, FIELD_TYPE.DOUBLE,
+                          FIELD_TYPE.DECIMAL, FIELD_TYPE.NEWDECIMAL]
+    _fetch_size = 10000
+
+    def ExecuteQueryColumnar (self, sql):
+        """ Execute a query returning one NumPy array per column
+
+        Unlike ExecuteQuery, columns are always arrays, with the same length
+        whatever the number of rows returned, so no scalar checks are needed.
+        Integer columns are int arrays (float64 with NaN if they have NULLs),
+        decimal and float columns are float64 arrays and the rest are object
+        arrays. Rows are fetched in chunks and unboxed into typed buffers, so
+        big results don't keep a Python object per cell.
+        """
+        if sql is None: return {}
+        result = {}
+        with self.pool.connection() as db:
+            cursor = db.cursor()
+            try:
+                cursor.execute(sql)
+                columns = cursor.description
+                if columns is None: return result
+
+                buffers = []
+                for column in columns:
+                    if column[1] in DSQuery._int_field_types: buffers.append(array('l'))
+                    elif column[1] in DSQuery._float_field_types: buffers.append(array('d'))
+                    else: buffers.append([])
+
+                while True:
+                    rows = cursor.fetchmany(DSQuery._fetch_size)
+                    if not rows: break
+                    for (index, values) in enumerate(zip(*rows)):
+                        buffers[index] = DSQuery._append_column(buffers[index], values)
+            finally:
+                cursor.close()
+
+        for (index, column) in enumerate(columns):
+            buf = buffers[index]
+            if isinstance(buf, array):
+                dtype = numpy.dtype(buf.typecode)
+                result[column[0]] = numpy.frombuffer(buf, dtype=dtype) \
+                    if len(buf) > 0 else numpy.array([], dtype=dtype)
+            else:
+                result[column[0]] = numpy.array(buf, dtype=object)
         return result
 
+    def ExecuteQueryStream (self, sql):
+        """ Iterate over the rows of a query as they come from the server
+
+        An unbuffered cursor is used, so the rows are not all kept in
+        memory. The connection is in use until all the rows are read.
+        """
+        with self.pool.connection() as db:
+            cursor = db.cursor(SSCursor)
+            try:
+                cursor.execute(sql)
+                while True:
+                    rows = cursor.fetchmany(DSQuery._fetch_size)
+                    if not rows: break
+                    for row in rows: yield row
+            finally:
+                cursor.close()
+
+    @staticmethod
+    def _append_column(buf, values):
+        """ Append a chunk of values to a column buffer, widening it if needed """
+        if isinstance(buf, array) and None in values:
+            # NULL values: ints become floats so NaN can represent them
+            buf = array('d', buf)
+            values = [float('nan') if v is None else v for v in values]
+        if isinstance(buf, array):
+            if buf.typecode == 'd': values = [float(v) for v in values]
+            buf.extend(values)
+        else:
+            buf.extend(values)
+        return buf
+
     def ExecuteViewQuery(self, sql):
-        self.cursor.execute(sql)
+        if DSQuery.query_stats is not None:
+            return DSQuery.query_stats.execute(self.database, sql,
+                                               self._ExecuteViewQuery)
+        return self._ExecuteViewQuery(sql)
+
+    def _ExecuteViewQuery(self, sql):
+        with self.pool.connection() as db:
+            cursor = db.cursor()
+            try:
+                cursor.execute(sql)
+            finally:
+                cursor.close()
+
+    def ExecuteUpdate(self, sql, rows = None, table = None):
+        """ Execute and commit a statement changing the database
+
+        If rows is given the statement is executed once for each tuple of
+        params in it. Cached results using table are discarded.
+        """
+        with self.pool.connection() as db:
+            cursor = db.cursor()
+            try:
+                if rows is None: cursor.execute(sql)
+                else: cursor.executemany(sql, rows)
+                db.commit()
+            finally:
+                cursor.close()
+        if DSQuery.query_cache is not None and table is not None:
+            DSQuery.query_cache.invalidate(self.database, table)
+
+    @contextmanager
+    def lock(self, name, timeout = 600):
+        """ with db.lock(name): hold a MySQL named lock
+
+        Named locks are owned by a connection, so one is kept checked out
+        while the lock is held. Other processes waiting for the same name
+        get it once released.
+        """
+        with self.pool.connection() as db:
+            cursor = db.cursor()
+            try:
+                cursor.execute("SELECT GET_LOCK(%s, %s)", (name, timeout))
+                if cursor.fetchone()[0] != 1:
+                    raise DBLockTimeout("Lock %s not got after %s secs" % (name, timeout))
+                try:
+                    yield
+                finally:
+                    cursor.execute("SELECT RELEASE_LOCK(%s)", (name,))
+                    cursor.fetchone()
+            finally:
+                cursor.close()
 
     def get_subprojects(self, project):
         """ Return all subprojects ids for a project in a string join by comma """
@@ -302,16 +550,37 @@ class DSQuery(object):
     def get_group_field (filter_type):
         """ Return the name of the field to group by in filter all queries """
 
-        field = None
-        supported = ['people2','company']
+        fields = {'people2': "up.identifier",
+                  'company': "c.name"}
+
+        return fields.get(filter_type)
 
-        analysis = filter_type
+    @staticmethod
+    def get_group_field_name (group_field):
+        """ Return the name of the column with the group field in the results """
 
-        if analysis not in supported: return field
-        if analysis == 'people2': field = "up.identifier"
-        elif analysis == "company": field = "c.name"
+        if " AS " in group_field: return group_field.split(" AS ")[1]
+        return group_field.split('.')[1] # remove table name
 
-        return field
+    def GetSQLProjectsAllFrom (self):
+        # tables needed to group by project in filter all queries
+        tables = Set([])
+        tables.add(self.identities_db + ".projects pj")
+        tables.add(self.identities_db + ".project_repositories pjr")
+
+        return tables
+
+    def GetSQLProjectsAllWhere (self, repository_field, data_source):
+        # repositories of each project and of its subprojects, the same ones
+        # included by the project filter for a single project
+        filters = Set([])
+        filters.add("pjr.repository_name = " + repository_field)
+        filters.add("pjr.data_source = '" + data_source + "'")
+        filters.add("""(pjr.project_id = pj.project_id OR pjr.project_id IN (
+               SELECT subproject_id FROM %s.project_children pjc
+               WHERE pjc.project_id = pj.project_id))""" % (self.identities_db))
+
+        return filters
 
     @staticmethod
     def get_bots_filter_sql (data_source, metric_filters = None):
@@ -328,6 +597,19 @@ class DSQuery(object):
 class SCMQuery(DSQuery):
     """ Specific query builders for source code management system data source """
 
+    @staticmethod
+    def get_group_field (filter_type):
+        """ Return the name of the field to group by in filter all queries """
+
+        fields = {'repository': "r.name",
+                  'company': "c.name",
+                  'country': "c.name",
+                  'domain': "d.name",
+                  'project': "pj.id AS project",
+                  'people2': "up.identifier"}
+
+        return fields.get(filter_type)
+
     def GetSQLRepositoriesFrom (self):
         #tables necessaries for repositories
         tables = Set([])
@@ -338,20 +620,26 @@ class SCMQuery(DSQuery):
     def GetSQLRepositoriesWhere (self, repository):
         #fields necessaries to match info among tables
         fields = Set([])
-        fields.add("r.name ="+ repository)
+        if repository is not None: fields.add("r.name ="+ repository)
         fields.add("r.id = s.repository_id")
 
         return fields
 
-    def GetSQLProjectFrom (self):
+    def GetSQLProjectFrom (self, all_items = False):
         #tables necessaries for repositories
         tables = Set([])
         tables.add("repositories r")
+        if all_items: tables.union_update(self.GetSQLProjectsAllFrom())
 
         return tables
 
     def GetSQLProjectWhere (self, project):
         # include all repositories for a project and its subprojects
+        if project is None:
+            fields = self.GetSQLProjectsAllWhere("r.uri", "scm")
+            fields.add("r.id = s.repository_id")
+            return fields
+
         # Remove '' from project name
         if (project[0] == "'" and project[-1] == "'"):
             project = project[1:-1]
@@ -369,6 +657,24 @@ class SCMQuery(DSQuery):
 
         return fields
 
+    def GetProjectsRepositories (self, project = None):
+        """ Return the ids of the repositories of each project and of its
+            subprojects, for all projects or only for project """
+        tables = self._get_tables_query(self.GetSQLProjectFrom(True))
+        filters = self._get_filters_query(self.GetSQLProjectsAllWhere("r.uri", "scm"))
+        if project is not None:
+            filters += " AND pj.id = '" + project.strip("'") + "'"
+
+        q = "SELECT pj.id AS project, r.id AS repository_id FROM %s WHERE %s" % (tables, filters)
+        res = self.ExecuteQuery(q)
+        if not isinstance(res['project'], list):
+            res = {'project': [res['project']], 'repository_id': [res['repository_id']]}
+
+        projects = {}
+        for (name, repository_id) in zip(res['project'], res['repository_id']):
+            projects.setdefault(name, set()).add(repository_id)
+        return projects
+
     def GetSQLCompaniesFrom (self):
         #tables necessaries for companies
         tables = Set([])
@@ -405,7 +711,7 @@ class SCMQuery(DSQuery):
         fields.add("s."+role+"_id = pup.people_id")
         fields.add("pup.upeople_id = upc.upeople_id")
         fields.add("upc.country_id = c.id")
-        fields.add("c.name ="+ country)
+        if country is not None: fields.add("c.name ="+ country)
 
         return fields
 
@@ -424,7 +730,7 @@ class SCMQuery(DSQuery):
         fields.add("s."+role+"_id = pup.people_id")
         fields.add("pup.upeople_id = upd.upeople_id")
         fields.add("upd.domain_id = d.id")
-        fields.add("d.name ="+ domain)
+        if domain is not None: fields.add("d.name ="+ domain)
 
         return fields
 
@@ -561,6 +867,7 @@ class SCMQuery(DSQuery):
             list_analysis = type_analysis[0].split(",")
 
             analysis = type_analysis[0]
+            all_items = type_analysis[1] is None
 
             # Retrieving tables based on the required type of analysis.
             for analysis in list_analysis:
@@ -568,7 +875,7 @@ class SCMQuery(DSQuery):
                 elif analysis == 'company': From.union_update(self.GetSQLCompaniesFrom())
                 elif analysis == 'country': From.union_update(self.GetSQLCountriesFrom())
                 elif analysis == 'domain': From.union_update(self.GetSQLDomainsFrom())
-                elif analysis == 'project': From.union_update(self.GetSQLProjectFrom())
+                elif analysis == 'project': From.union_update(self.GetSQLProjectFrom(all_items))
                 elif analysis == 'branch': From.union_update(self.GetSQLBranchFrom())
                 elif analysis == 'module': From.union_update(self.GetSQLModuleFrom())
                 elif analysis == 'filetype': From.union_update(self.GetSQLFileTypeFrom())
@@ -687,6 +994,20 @@ class SCMQuery(DSQuery):
 
 class ITSQuery(DSQuery):
     """ Specific query builders for issue tracking system data source """
+
+    @staticmethod
+    def get_group_field (filter_type):
+        """ Return the name of the field to group by in filter all queries """
+
+        fields = {'repository': "t.url",
+                  'company': "c.name",
+                  'country': "cou.name",
+                  'domain': "d.name",
+                  'project': "pj.id AS project",
+                  'people2': "up.identifier"}
+
+        return fields.get(filter_type)
+
     def GetSQLRepositoriesFrom (self):
         # tables necessary for repositories 
         tables = Set([])
@@ -698,19 +1019,25 @@ class ITSQuery(DSQuery):
         # fields necessary to match info among tables
         filters = Set([])
         filters.add("i.tracker_id = t.id")
-        filters.add("t.url = "+repository)
+        if repository is not None: filters.add("t.url = "+repository)
 
         return filters
 
-    def GetSQLProjectsFrom (self):
+    def GetSQLProjectsFrom (self, all_items = False):
         # tables necessary for repositories
         tables = Set([])
         tables.add("trackers t")
+        if all_items: tables.union_update(self.GetSQLProjectsAllFrom())
 
         return tables
 
     def GetSQLProjectsWhere (self, project):
         # include all repositories for a project and its subprojects
+        if project is None:
+            filters = self.GetSQLProjectsAllWhere("t.url", "its")
+            filters.add("t.id = i.tracker_id")
+            return filters
+
         # Remove '' from project name
         filters = Set([])
         if len(project) > 1 :
@@ -770,7 +1097,7 @@ class ITSQuery(DSQuery):
         filters.add("i.submitted_by = pup.people_id")
         filters.add("pup.upeople_id = upcou.upeople_id")
         filters.add("upcou.country_id = cou.id")
-        filters.add("cou.name = "+name)
+        if name is not None: filters.add("cou.name = "+name)
 
         return filters
 
@@ -789,7 +1116,7 @@ class ITSQuery(DSQuery):
         filters.add("i.submitted_by = pup.people_id")
         filters.add("pup.upeople_id = upd.upeople_id")
         filters.add("upd.domain_id = d.id")
-        filters.add("d.name = " + name)
+        if name is not None: filters.add("d.name = " + name)
 
         return filters
 
@@ -832,6 +1159,7 @@ class ITSQuery(DSQuery):
         if type_analysis is not None and len(type_analysis)>1:
             # To be improved... not a very smart way of doing this
             list_analysis = type_analysis[0].split(",")
+            all_items = type_analysis[1] is None
 
             # Retrieving tables based on the required type of analysis.
             for analysis in list_analysis:
@@ -839,7 +1167,7 @@ class ITSQuery(DSQuery):
                 elif analysis == 'company': From.union_update(self.GetSQLCompaniesFrom())
                 elif analysis == 'country': From.union_update(self.GetSQLCountriesFrom())
                 elif analysis == 'domain': From.union_update(self.GetSQLDomainsFrom())
-                elif analysis == 'project': From.union_update(self.GetSQLProjectsFrom())
+                elif analysis == 'project': From.union_update(self.GetSQLProjectsFrom(all_items))
                 elif analysis == 'people2': From.union_update(self.GetSQLPeopleFrom())
                 elif analysis == 'ticket_type': From.union_update(self.GetSQLTicketTypeFrom())
                 else: raise Exception( analysis + " not supported")
@@ -857,7 +1185,7 @@ class ITSQuery(DSQuery):
         return From
 
 
-    def _get_where_type_analysis_set(self, type_analysis):
+    def _get_where_type_analysis_set(self, type_analysis, table = "changes"):
         #"type" is a list of two values: type of analysis and value of
         #such analysis
         where = Set([])
@@ -895,7 +1223,7 @@ class ITSQuery(DSQuery):
     def GetSQLReportWhere (self, filters, table = "changes"):
         #generic function to generate 'where' clauses
 
-        where = self._get_where_type_analysis_set(filters.type_analysis)
+        where = self._get_where_type_analysis_set(filters.type_analysis, table)
 
         return where
 
@@ -994,6 +1322,20 @@ class ITSQuery(DSQuery):
 
 class MLSQuery(DSQuery):
     """ Specific query builders for mailing lists data source """
+
+    @staticmethod
+    def get_group_field (filter_type):
+        """ Return the name of the field to group by in filter all queries """
+
+        fields = {'repository': "m.mailing_list_url",
+                  'company': "c.name",
+                  'country': "c.name",
+                  'domain': "d.name",
+                  'project': "pj.id AS project",
+                  'people2': "up.identifier"}
+
+        return fields.get(filter_type)
+
     def GetSQLRepositoriesFrom (self):
         # tables necessary for repositories
         #return (" messages m ") 
@@ -1003,7 +1345,8 @@ class MLSQuery(DSQuery):
     def GetSQLRepositoriesWhere (self, repository):
         # fields necessary to match info among tables
         filters = Set([])
-        filters.add("m.mailing_list_url = " + repository)
+        if repository is not None:
+            filters.add("m.mailing_list_url = " + repository)
 
         return filters
 
@@ -1050,7 +1393,7 @@ class MLSQuery(DSQuery):
         filters.add("mp.type_of_recipient = \'From\'")
         filters.add("pup.upeople_id = upc.upeople_id")
         filters.add("upc.country_id = c.id")
-        if name <> "":
+        if name <> "" and name is not None:
             filters.add("c.name = " + name)
 
         return filters
@@ -1073,19 +1416,25 @@ class MLSQuery(DSQuery):
         filters.add("upd.domain_id = d.id")
         filters.add("m.first_date >= upd.init")
         filters.add("m.first_date < upd.end")
-        if name <> "":
+        if name <> "" and name is not None:
             filters.add("d.name = " + name)
 
         return filters
 
-    def GetSQLProjectsFrom(self):
+    def GetSQLProjectsFrom(self, all_items = False):
         tables = Set([])
         tables.add("mailing_lists ml")
+        if all_items: tables.union_update(self.GetSQLProjectsAllFrom())
 
         return tables
 
     def GetSQLProjectsWhere(self, project):
         # include all repositories for a project and its subprojects
+        if project is None:
+            repos = self.GetSQLProjectsAllWhere("ml.mailing_list_url", "mls")
+            repos.add("ml.mailing_list_url = m.mailing_list_url")
+            return repos
+
         p = project.replace("'", "") # FIXME: why is "'" needed in the name?
 
         repos = Set([])
@@ -1169,13 +1518,14 @@ class MLSQuery(DSQuery):
         if type_analysis is not None:
             list_analysis = type_analysis[0].split(",") 
             #analysis = type_analysis[0]
+            all_items = type_analysis[1] is None
 
             for analysis in list_analysis:
                 if analysis == 'repository': From.union_update(self.GetSQLRepositoriesFrom())
                 elif analysis == 'company': From.union_update(self.GetSQLCompaniesFrom())
                 elif analysis == 'country': From.union_update(self.GetSQLCountriesFrom())
                 elif analysis == 'domain': From.union_update(self.GetSQLDomainsFrom())
-                elif analysis == 'project': From.union_update(self.GetSQLProjectsFrom())
+                elif analysis == 'project': From.union_update(self.GetSQLProjectsFrom(all_items))
                 elif analysis == 'people2': From.union_update(self.GetSQLPeopleFrom())
                 else: raise Exception( analysis + " not supported")
 
@@ -1323,6 +1673,18 @@ class MLSQuery(DSQuery):
 class SCRQuery(DSQuery):
     """ Specific query builders for source code review source"""
 
+    @staticmethod
+    def get_group_field (filter_type):
+        """ Return the name of the field to group by in filter all queries """
+
+        fields = {'repository': "t.url",
+                  'company': "c.name",
+                  'country': "c.name",
+                  'project': "pj.id AS project",
+                  'people2': "up.identifier"}
+
+        return fields.get(filter_type)
+
     def GetSQLRepositoriesFrom (self):
         #tables necessaries for repositories
         tables = Set([])
@@ -1333,7 +1695,8 @@ class SCRQuery(DSQuery):
     def GetSQLRepositoriesWhere (self, repository):
         #fields necessaries to match info among tables
         filters = Set([])
-        filters.add("t.url = '"+ repository + "'")
+        if repository is not None:
+            filters.add("t.url = '"+ repository + "'")
         filters.add("t.id = i.tracker_id")
 
         return filters
@@ -1360,15 +1723,21 @@ class SCRQuery(DSQuery):
 
         return filters
 
-    def GetSQLProjectFrom (self):
+    def GetSQLProjectFrom (self, all_items = False):
         # projects are mapped to repositories
         tables = Set([])
         tables.add("trackers t")
+        if all_items: tables.union_update(self.GetSQLProjectsAllFrom())
 
         return tables
 
     def GetSQLProjectWhere (self, project):
         # include all repositories for a project and its subprojects
+        if project is None:
+            filters = self.GetSQLProjectsAllWhere("t.url", "scr")
+            filters.add("t.id = i.tracker_id")
+            return filters
+
         filters = Set([])
 
         repos = """t.url IN (
@@ -1439,10 +1808,8 @@ class SCRQuery(DSQuery):
 
         filters = Set([])
 
-        if table == "issues":
-            filters.add("i.submitted_by")
-        else:
-            filters.add("ch.changed_by")
+        field = "ch.changed_by"
+        if table == "issues": field = "i.submitted_by"
 
         filters.add(field + " = pup.people_id")
         filters.add("up.id = pup.upeople_id")
@@ -1465,12 +1832,13 @@ class SCRQuery(DSQuery):
         if (type_analysis is None or len(type_analysis) != 2): return From
 
         analysis = type_analysis[0]
+        all_items = type_analysis[1] is None
 
         if (analysis):
             if analysis == 'repository': From.union_update(self.GetSQLRepositoriesFrom())
             elif analysis == 'company': From.union_update(self.GetSQLCompaniesFrom())
             elif analysis == 'country': From.union_update(self.GetSQLCountriesFrom())
-            elif analysis == 'project': From.union_update(self.GetSQLProjectFrom())
+            elif analysis == 'project': From.union_update(self.GetSQLProjectFrom(all_items))
             elif analysis == 'people2': From.union_update(self.GetSQLPeopleFrom())
 
         return From
@@ -1883,6 +2251,39 @@ class SCRQuery(DSQuery):
            """ % (self.identities_db, filters, quarter, year, limit)
         return (self.ExecuteQuery(q))
 
+    def GetCompaniesQuartersTotals (self, startdate, enddate):
+        """ Stream (year, quarter, total, name, id) merged submissions rows
+            for all the companies and quarters between the dates """
+        q = """
+            SELECT YEAR(submitted_on) AS year, QUARTER(submitted_on) AS quarter,
+                COUNT(i.id) AS total, c.name, c.id
+            FROM issues i, people p , people_upeople pup, %s.upeople_companies upc,%s.companies c
+            WHERE i.submitted_by=p.id AND pup.people_id=p.id
+                AND pup.upeople_id = upc.upeople_id AND upc.company_id = c.id
+                AND status='merged'
+                AND submitted_on >= %s AND submitted_on < %s
+            GROUP BY year, quarter, c.id
+            """ % (self.identities_db, self.identities_db, startdate, enddate)
+        return self.ExecuteQueryStream(q)
+
+    def GetPeopleQuartersTotals (self, startdate, enddate, bots = []):
+        """ Stream (year, quarter, total, name, id) merged submissions rows
+            for all the people and quarters between the dates """
+        filter_bots = ''
+        for bot in bots:
+            filter_bots = filter_bots + " up.identifier<>'"+bot+"' AND "
+
+        q = """
+            SELECT YEAR(submitted_on) AS year, QUARTER(submitted_on) AS quarter,
+                COUNT(i.id) AS total, p.name, pup.upeople_id as id
+            FROM issues i, people p , people_upeople pup, %s.upeople up
+            WHERE %s i.submitted_by=p.id AND pup.people_id=p.id AND pup.upeople_id = up.id
+                AND status='merged'
+                AND submitted_on >= %s AND submitted_on < %s
+            GROUP BY year, quarter, pup.upeople_id
+            """ % (self.identities_db, filter_bots, startdate, enddate)
+        return self.ExecuteQueryStream(q)
+
     def GetPeopleList (self, startdate, enddate, bots):
 
         filter_bots = ""
@@ -1941,6 +2342,18 @@ class SCRQuery(DSQuery):
 
 class IRCQuery(DSQuery):
 
+    @staticmethod
+    def get_group_field (filter_type):
+        """ Return the name of the field to group by in filter all queries """
+
+        fields = {'repository': "c.name",
+                  'company': "c.name",
+                  'country': "c.name",
+                  'domain': "d.name",
+                  'people2': "up.identifier"}
+
+        return fields.get(filter_type)
+
     def GetSQLRepositoriesFrom (self):
         # tables necessary for repositories
         fields = Set([])
@@ -1954,7 +2367,7 @@ class IRCQuery(DSQuery):
         # filters necessaries for repositories
         filters = Set([])
         filters.add("i.channel_id = c.id")
-        filters.add("c.name = " + repository)
+        if repository is not None: filters.add("c.name = " + repository)
 
         return filters
 
@@ -1975,7 +2388,7 @@ class IRCQuery(DSQuery):
         filters.add("upc.company_id = c.id")
         filters.add("i.date >= upc.init")
         filters.add("i.date < upc.end")
-        filters.add("c.name = " + name)
+        if name is not None: filters.add("c.name = " + name)
 
         return filters
 
@@ -1994,7 +2407,7 @@ class IRCQuery(DSQuery):
         filters.add("i.nick = pup.people_id")
         filters.add("pup.upeople_id = upc.upeople_id")
         filters.add("upc.country_id = c.id")
-        filters.add("c.name = " + name)
+        if name is not None: filters.add("c.name = " + name)
 
         return filters
 
@@ -2013,7 +2426,7 @@ class IRCQuery(DSQuery):
         filters.add("i.nick = pup.people_id")
         filters.add("pup.upeople_id = upd.upeople_id")
         filters.add("upd.domain_id = d.id")
-        filters.add("d.name = " + name)
+        if name is not None: filters.add("d.name = " + name)
 
         return filters
 
@@ -2030,6 +2443,7 @@ class IRCQuery(DSQuery):
         filters = Set([])
         filters.add("i.nick = pup.people_id")
         filters.add("pup.upeople_id = up.id")
+        if name is not None: filters.add("up.identifier = " + name)
 
         return filters
 
@@ -0,0 +1,308 @@
+## Copyright (C) 2014 Bitergia
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 3 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+##
+## This file is a part of GrimoireLib
+##  (an Python library for the MetricsGrimoire and vizGrimoire systems)
+##
+##
+## Authors:
+##   Alvaro del Castillo <acs@bitergia.com>
+
+""" Persistent cache of SQL query results invalidated when tables change """
+
+import cPickle
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from GrimoireUtils import check_array_values
+
+
+class QueryCache(object):
+    """ On disk cache of ExecuteQuery results
+
+    Results are stored in a SQLite file, keyed by the normalized SQL and the
+    database it was run against. With each result the state of the tables
+    read by the query is stored: the UPDATE_TIME and AUTO_INCREMENT values
+    from information_schema or, if the server does not provide them, the
+    MAX(id) of the table. A cached result is only used while that state has
+    not changed. Queries reading tables whose state can't be found (views,
+    tables without id) and non deterministic queries are never cached.
+
+    When there are more than max_entries results the least recently used
+    ones are removed.
+    """
+
+    default_max_entries = 50000
+    # Seconds the state of a table is trusted before checking it again
+    default_tables_ttl = 60
+
+    _no_cache_re = re.compile(r"\b(NOW|CURDATE|CURRENT_DATE|CURRENT_TIMESTAMP|"
+                              r"SYSDATE|RAND|UUID)\b", re.IGNORECASE)
+    _select_re = re.compile(r"^\s*\(?\s*SELECT\b", re.IGNORECASE)
+    _name_re = re.compile(r"`?([\w$]+)`?\s*\.\s*`?([\w$]+)`?|`?([\w$]+)`?")
+    _schema_re = re.compile(r"^[\w$]+$")
+    # Quoted strings and identifiers, and the whitespace out of them
+    _quoted_re = re.compile(r"""('(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*"|`[^`]*`)""", re.DOTALL)
+    _space_re = re.compile(r"\s+")
+
+    def __init__(self, path, max_entries = None, tables_ttl = None):
+        self.path = path
+        self.max_entries = max_entries
+        self.tables_ttl = tables_ttl
+        if max_entries is None: self.max_entries = QueryCache.default_max_entries
+        if tables_ttl is None: self.tables_ttl = QueryCache.default_tables_ttl
+        self.hits = 0
+        self.misses = 0
+        self._tables_state = {} # (schema, table): (check time, state)
+        self._schemas_tables = {} # schema: {table: is_view}
+        self._lock = threading.Lock()
+
+        cache_dir = os.path.dirname(os.path.abspath(path))
+        if not os.path.isdir(cache_dir): os.makedirs(cache_dir)
+        self._open()
+
+    def _open(self):
+        self._pid = os.getpid()
+        self._db = sqlite3.connect(self.path, check_same_thread=False, timeout=60)
+        self._db.text_factory = str
+        self._db.execute("""CREATE TABLE IF NOT EXISTS results (
+                                key TEXT PRIMARY KEY,
+                                tables TEXT,
+                                state TEXT,
+                                result BLOB,
+                                last_used REAL)""")
+        self._db.execute("CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)")
+        self._db.commit()
+
+    def _check_pid(self):
+        """ SQLite connections can't be shared with forked processes """
+        if self._pid != os.getpid():
+            self._lock = threading.Lock()
+            self._open()
+
+    @staticmethod
+    def normalize_sql(sql):
+        """ Collapse whitespace so formatting doesn't change the key. Quoted
+            strings are kept as they are: their whitespace is data. """
+        parts = QueryCache._quoted_re.split(sql)
+        # The quoted parts are the odd ones
+        for i in range(0, len(parts), 2):
+            parts[i] = QueryCache._space_re.sub(" ", parts[i])
+        return "".join(parts).strip()
+
+    @staticmethod
+    def get_key(database, sql):
+        return hashlib.sha1(database + "\n" + QueryCache.normalize_sql(sql)).hexdigest()
+
+    def _get_schema_tables(self, schemas, execute):
+        """ Tables and views in each schema: {schema: {name: is_view}} """
+        schemas_tables = {}
+        pending = []
+        self._lock.acquire()
+        try:
+            for schema in schemas:
+                if schema in self._schemas_tables:
+                    schemas_tables[schema] = self._schemas_tables[schema]
+                else:
+                    pending.append(schema)
+        finally:
+            self._lock.release()
+
+        if len(pending) > 0:
+            for schema in pending: schemas_tables[schema] = {}
+            q = """SELECT table_schema, table_name, table_type
+                   FROM information_schema.tables WHERE table_schema IN (%s)
+                """ % (",".join(["'%s'" % schema for schema in pending]))
+            res = check_array_values(execute(q))
+            for (schema, table, table_type) in zip(res.get('table_schema', []),
+                                                   res.get('table_name', []),
+                                                   res.get('table_type', [])):
+                schemas_tables[schema][table] = (table_type == 'VIEW')
+            self._lock.acquire()
+            try:
+                for schema in pending:
+                    self._schemas_tables[schema] = schemas_tables[schema]
+            finally:
+                self._lock.release()
+        return schemas_tables
+
+    def get_tables(self, sql, database, execute):
+        """ Return the (schema, table) pairs read by a query, None if unknown
+
+        All the names in the query that are tables of the database, or of
+        the schema they are qualified with, are used. Names that are also
+        columns or aliases just make the invalidation more conservative.
+        Views are not supported because their base tables are not known.
+        """
+        names = QueryCache._name_re.findall(sql)
+        schemas = set([database])
+        for (schema, table, name) in names:
+            if schema != "" and QueryCache._schema_re.match(schema):
+                schemas.add(schema)
+        schemas_tables = self._get_schema_tables(sorted(schemas), execute)
+
+        tables = set()
+        for (schema, table, name) in names:
+            if schema == "":
+                schema = database
+                table = name
+            if table in schemas_tables.get(schema, {}):
+                if schemas_tables[schema][table]: return None # view
+                tables.add((schema, table))
+        if len(tables) == 0: return None
+        return sorted(tables)
+
+    def is_cacheable(self, sql):
+        if QueryCache._select_re.match(sql) is None: return False
+        if QueryCache._no_cache_re.search(sql) is not None: return False
+        return True
+
+    def _get_tables_state(self, tables, execute):
+        """ State of the tables using execute(sql) to query the database """
+        now = time.time()
+        state = {}
+        pending = []
+        self._lock.acquire()
+        try:
+            for table in tables:
+                if table in self._tables_state:
+                    checked, table_state = self._tables_state[table]
+                    if now - checked < self.tables_ttl:
+                        state[table] = table_state
+                        continue
+                pending.append(table)
+        finally:
+            self._lock.release()
+
+        if len(pending) > 0:
+            where = " OR ".join(["(table_schema='%s' AND table_name='%s')" % table
+                                 for table in pending])
+            q = """SELECT table_schema, table_name, update_time, auto_increment
+                   FROM information_schema.tables WHERE %s""" % (where)
+            res = check_array_values(execute(q))
+            found = {}
+            for row in zip(res.get('table_schema', []), res.get('table_name', []),
+                           res.get('update_time', []), res.get('auto_increment', [])):
+                if row[2] is not None or row[3] is not None:
+                    found[(row[0], row[1])] = "%s:%s" % (row[2], row[3])
+            for table in pending:
+                if table not in found:
+                    found[table] = self._get_max_id(table, execute)
+                state[table] = found[table]
+            self._lock.acquire()
+            try:
+                for table in pending:
+                    self._tables_state[table] = (now, state[table])
+            finally:
+                self._lock.release()
+
+        if None in state.values(): return None
+        return ";".join(["%s.%s=%s" % (table[0], table[1], state[table])
+                         for table in tables])
+
+    @staticmethod
+    def _get_max_id(table, execute):
+        try:
+            res = execute("SELECT MAX(id) AS max_id FROM %s.%s" % table)
+        except Exception:
+            return None
+        if 'max_id' not in res or res['max_id'] is None: return None
+        return "id:%s" % (res['max_id'])
+
+    def execute(self, database, sql, execute):
+        """ Return the result for sql from the cache or running execute(sql) """
+        if not self.is_cacheable(sql): return execute(sql)
+        self._check_pid()
+        tables = self.get_tables(sql, database, execute)
+        if tables is None: return execute(sql)
+        state = self._get_tables_state(tables, execute)
+        if state is None: return execute(sql)
+
+        key = QueryCache.get_key(database, sql)
+        result = self._get(key, state)
+        if result is not None:
+            self.hits += 1
+            return result
+        self.misses += 1
+        result = execute(sql)
+        self._put(key, tables, state, result)
+        return result
+
+    def _get(self, key, state):
+        self._lock.acquire()
+        try:
+            row = self._db.execute("SELECT state, result FROM results WHERE key=?",
+                                   (key,)).fetchone()
+            if row is None: return None
+            if row[0] != state:
+                self._db.execute("DELETE FROM results WHERE key=?", (key,))
+                self._db.commit()
+                return None
+            self._db.execute("UPDATE results SET last_used=? WHERE key=?",
+                             (time.time(), key))
+            self._db.commit()
+            return cPickle.loads(str(row[1]))
+        finally:
+            self._lock.release()
+
+    def _put(self, key, tables, state, result):
+        data = cPickle.dumps(result, cPickle.HIGHEST_PROTOCOL)
+        tables = ",".join(["%s.%s" % table for table in tables])
+        self._lock.acquire()
+        try:
+            self._db.execute("INSERT OR REPLACE INTO results VALUES (?,?,?,?,?)",
+                             (key, tables, state, sqlite3.Binary(data), time.time()))
+            self._evict()
+            self._db.commit()
+        finally:
+            self._lock.release()
+
+    def _evict(self):
+        """ Remove least recently used results. Called with the lock held. """
+        total = self._db.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+        if total <= self.max_entries: return
+        self._db.execute("""DELETE FROM results WHERE key IN
+                            (SELECT key FROM results ORDER BY last_used LIMIT ?)""",
+                         (total - self.max_entries,))
+
+    def invalidate(self, database = None, table = None):
+        """ Remove cached results, all of them or the ones using a table """
+        self._check_pid()
+        self._lock.acquire()
+        try:
+            if table is None:
+                self._db.execute("DELETE FROM results")
+                self._tables_state = {}
+                self._schemas_tables = {}
+            else:
+                name = "%s.%s" % (database, table)
+                self._db.execute("DELETE FROM results WHERE ','||tables||',' LIKE ?",
+                                 ("%," + name + ",%",))
+                self._tables_state.pop((database, table), None)
+            self._db.commit()
+        finally:
+            self._lock.release()
+
+    def close(self):
+        self._check_pid()
+        logging.info("Query cache %s: %i hits %i misses" %
+                     (self.path, self.hits, self.misses))
+        self._db.close()
@@ -0,0 +1,275 @@
+## Copyright (C) 2014 Bitergia
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 3 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+##
+## This file is a part of GrimoireLib
+##  (an Python library for the MetricsGrimoire and vizGrimoire systems)
+##
+##
+## Authors:
+##   Alvaro del Castillo <acs@bitergia.com>
+
+""" Statistics of the SQL queries run and log of the slow ones """
+
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+
+from GrimoireUtils import check_array_values
+
+
+class QueryStats(object):
+    """ Duration, rows and bytes of the queries grouped by fingerprint
+
+    The fingerprint of a query is its SQL with the literals replaced by ?,
+    so the same query for different dates or items is grouped. Each query
+    is also assigned to the metric or study running it. Queries slower than
+    slow_time seconds are logged and, if explain is set, the EXPLAIN of the
+    first slow query of each fingerprint is captured.
+
+    When writing, the summary ranked by total time goes to query_stats.json
+    and the slow queries to slow_queries.log, both in path. Forked processes
+    write their own files, merged in the files of the main process when it
+    writes.
+    """
+
+    default_slow_time = 1.0 # seconds
+    max_slow_queries = 1000
+
+    _string_re = re.compile(r"'(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.)*\"")
+    _number_re = re.compile(r"\b\d+(?:\.\d+)?\b")
+    _list_re = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+    _explain_re = re.compile(r"^\s*\(?\s*SELECT\b", re.IGNORECASE)
+    # Files of the query layer, never reported as the caller
+    _query_files = ["query_stats.py", "query_cache.py", "query_builder.py",
+                    "GrimoireSQL.py"]
+
+    def __init__(self, path, slow_time = None, explain = False):
+        self.path = path
+        self.slow_time = slow_time
+        if slow_time is None: self.slow_time = QueryStats.default_slow_time
+        self.explain = explain
+        self._pid = os.getpid()
+        self.reset()
+        # Files of the processes of a previous report
+        for filename in ["query_stats.json", "slow_queries.log"]:
+            for name in self._get_processes_files(filename): os.remove(name)
+
+    def reset(self):
+        """ Forget the queries recorded, i.e. the ones recorded by the
+            parent of a forked process """
+        self.queries = {} # fingerprint: stats
+        self.slow_queries = []
+        self._explained = set()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def get_fingerprint(sql):
+        sql = QueryStats._string_re.sub("?", sql)
+        sql = QueryStats._number_re.sub("?", sql)
+        sql = " ".join(sql.split())
+        return QueryStats._list_re.sub("(?+)", sql)
+
+    @staticmethod
+    def get_caller():
+        """ Metric or study running the query, else the first function
+            outside the query layer """
+        frame = sys._getframe(1)
+        caller = None
+        while frame is not None:
+            obj = frame.f_locals.get('self')
+            if obj is not None:
+                classes = [c.__name__ for c in type(obj).__mro__]
+                if 'Metrics' in classes or 'Analyses' in classes:
+                    return type(obj).__name__ + "." + frame.f_code.co_name
+            filename = os.path.basename(frame.f_code.co_filename)
+            if caller is None and filename not in QueryStats._query_files:
+                caller = filename.split(".py")[0] + "." + frame.f_code.co_name
+            frame = frame.f_back
+        return caller
+
+    @staticmethod
+    def get_size(result):
+        """ Rows and bytes of the values in an ExecuteQuery result """
+        rows = 0
+        size = 0
+        if result is None: return (rows, size)
+        for values in result.values():
+            if not isinstance(values, list): values = [values]
+            rows = max(rows, len(values))
+            for value in values:
+                if value is None: continue
+                if isinstance(value, basestring): size += len(value)
+                else: size += 8
+        return (rows, size)
+
+    def execute(self, database, sql, execute, explain = None):
+        """ Return execute(sql) recording its stats
+
+        explain(sql) runs the EXPLAIN of slow queries in the same database.
+        """
+        start = time.time()
+        result = execute(sql)
+        duration = time.time() - start
+        (rows, size) = QueryStats.get_size(result)
+        self.record(database, sql, duration, rows, size, explain)
+        return result
+
+    def record(self, database, sql, duration, rows, size, explain = None):
+        fingerprint = QueryStats.get_fingerprint(sql)
+        caller = QueryStats.get_caller()
+
+        self._lock.acquire()
+        try:
+            stats = self._get_stats(fingerprint)
+            stats["count"] += 1
+            stats["time"] += duration
+            stats["rows"] += rows
+            stats["bytes"] += size
+            stats["callers"][caller] = stats["callers"].get(caller, 0) + 1
+            if database not in stats["databases"]:
+                stats["databases"].append(database)
+            if duration > stats["max_time"]:
+                stats["max_time"] = duration
+                stats["sql"] = sql
+
+            if duration < self.slow_time: return
+            if len(self.slow_queries) >= QueryStats.max_slow_queries: return
+            slow = {"date": time.strftime('%Y-%m-%d %H:%M:%S'),
+                    "database": database, "caller": caller, "time": duration,
+                    "rows": rows, "bytes": size, "sql": sql}
+            self.slow_queries.append(slow)
+            if not self.explain or explain is None: return
+            if fingerprint in self._explained: return
+            if QueryStats._explain_re.match(sql) is None: return
+            self._explained.add(fingerprint)
+        finally:
+            self._lock.release()
+
+        # Run while the connection of the query is still the current one
+        try:
+            slow["explain"] = check_array_values(explain("EXPLAIN " + sql))
+        except Exception, e:
+            slow["explain"] = {"error": [str(e)]}
+
+    def _get_stats(self, fingerprint):
+        """ Stats of a fingerprint. Called with the lock held. """
+        if fingerprint not in self.queries:
+            self.queries[fingerprint] = {"fingerprint": fingerprint,
+                                         "count": 0, "time": 0.0,
+                                         "max_time": 0.0, "rows": 0,
+                                         "bytes": 0, "callers": {},
+                                         "databases": []}
+        return self.queries[fingerprint]
+
+    def merge(self, summary):
+        """ Add the stats of a summary written by other process """
+        self._lock.acquire()
+        try:
+            for other in summary:
+                stats = self._get_stats(other["fingerprint"])
+                for field in ["count", "time", "rows", "bytes"]:
+                    stats[field] += other[field]
+                for (caller, count) in other["callers"].items():
+                    stats["callers"][caller] = stats["callers"].get(caller, 0) + count
+                for database in other["databases"]:
+                    if database not in stats["databases"]:
+                        stats["databases"].append(database)
+                if other["max_time"] > stats["max_time"]:
+                    stats["max_time"] = other["max_time"]
+                    stats["sql"] = other["sql"]
+        finally:
+            self._lock.release()
+
+    def get_summary(self):
+        """ Stats of each fingerprint, sorted by total time """
+        self._lock.acquire()
+        try:
+            summary = [dict(stats) for stats in self.queries.values()]
+        finally:
+            self._lock.release()
+        for stats in summary:
+            stats["avg_time"] = stats["time"] / stats["count"]
+        summary.sort(key=lambda stats: stats["time"], reverse=True)
+        return summary
+
+    def _get_filename(self, filename):
+        # Each forked process writes its own files
+        if self._pid != os.getpid():
+            (name, ext) = os.path.splitext(filename)
+            filename = "%s.%i%s" % (name, os.getpid(), ext)
+        return os.path.join(self.path, filename)
+
+    def _get_processes_files(self, filename):
+        """ Files written by the forked processes """
+        if not os.path.isdir(self.path): return []
+        (name, ext) = os.path.splitext(filename)
+        process_re = re.compile(r"^%s\.\d+%s$" % (re.escape(name), re.escape(ext)))
+        return [os.path.join(self.path, f) for f in sorted(os.listdir(self.path))
+                if process_re.match(f)]
+
+    def write(self):
+        """ Write the summary and the slow queries log
+
+        The main process merges the files of the forked ones, which are
+        removed then.
+        """
+        if not os.path.isdir(self.path): os.makedirs(self.path)
+
+        processes_slow = []
+        processes_files = []
+        if self._pid == os.getpid():
+            for name in self._get_processes_files("query_stats.json"):
+                with open(name) as f: self.merge(json.load(f))
+                processes_files.append(name)
+            for name in self._get_processes_files("slow_queries.log"):
+                with open(name) as f: processes_slow.append(f.read())
+                processes_files.append(name)
+
+        summary = self.get_summary()
+        f = open(self._get_filename("query_stats.json"), "w")
+        try:
+            json.dump(summary, f, indent=1, default=str)
+        finally:
+            f.close()
+
+        f = open(self._get_filename("slow_queries.log"), "w")
+        try:
+            for slow in self.slow_queries:
+                f.write("# Time: %s\n" % slow["date"])
+                f.write("# Database: %s Caller: %s\n" % (slow["database"], slow["caller"]))
+                f.write("# Query_time: %.3f Rows: %i Bytes: %i\n" %
+                        (slow["time"], slow["rows"], slow["bytes"]))
+                f.write(slow["sql"].strip() + ";\n")
+                if "explain" in slow:
+                    explain = slow["explain"]
+                    columns = sorted(explain.keys())
+                    f.write("# EXPLAIN: " + "\t".join(columns) + "\n")
+                    for row in zip(*[explain[column] for column in columns]):
+                        f.write("# EXPLAIN: " + "\t".join([str(v) for v in row]) + "\n")
+                f.write("\n")
+            for slow in processes_slow: f.write(slow)
+        finally:
+            f.close()
+        for name in processes_files: os.remove(name)
+
+        total = sum([stats["time"] for stats in summary])
+        logging.info("Query stats %s: %i queries in %.2f secs, %i slow" %
+                     (self.path, sum([stats["count"] for stats in summary]),
+                      total, len(self.slow_queries)))
@@ -28,7 +28,9 @@ import logging
 import MySQLdb
 import numpy
 
-from GrimoireUtils import completePeriodIds, checkListArray, medianAndAvgByPeriod, check_array_values
+from GrimoireUtils import completePeriodIds, check_array_values
+from GrimoireUtils import period_fields
+from distribution import get_distribution, get_distribution_by_period
 from query_builder import DSQuery
 
 from metrics import Metrics
@@ -48,6 +50,7 @@ class Submitted(Metrics):
     name = "Submitted reviews"
     desc = "Number of submitted code review processes"
     data_source = SCR
+    memo = True # used by Pending and BMISCR
 
     def _get_sql(self, evolutionary):
         q = self.db.GetReviewsSQL(self.filters.period, self.filters.startdate,
@@ -60,6 +63,7 @@ class Merged(Metrics):
     name = "Merged changes"
     desc = "Number of changes merged into the source code"
     data_source = SCR
+    memo = True # used by Pending and BMISCR
 
     def _get_sql(self, evolutionary):
         q = self.db.GetReviewsSQL(self.filters.period, self.filters.startdate,
@@ -94,6 +98,7 @@ class Abandoned(Metrics):
     name = "Abandoned reviews"
     desc = "Number of abandoned review processes"
     data_source = SCR
+    memo = True # used by Pending and BMISCR
 
     def _get_sql(self, evolutionary):
         q = self.db.GetReviewsSQL(self.filters.period, self.filters.startdate,
@@ -135,20 +140,14 @@ class BMISCR(Metrics):
         submitted_reviews = Submitted(self.db, self.filters)
 
         abandoned = abandoned_reviews.get_ts()
-        abandoned = completePeriodIds(abandoned, self.filters.period, self.filters.startdate,
-                                      self.filters.enddate)
         # casting the type of the variable in order to use numpy
         # faster way to deal with datasets...
         abandoned_array = numpy.array(abandoned["abandoned"])
 
         merged = merged_reviews.get_ts()
-        merged = completePeriodIds(merged, self.filters.period, self.filters.startdate,
-                                      self.filters.enddate)
         merged_array = numpy.array(merged["merged"])
 
         submitted = submitted_reviews.get_ts()
-        submitted = completePeriodIds(submitted, self.filters.period, self.filters.startdate,
-                                      self.filters.enddate)
         submitted_array = numpy.array(submitted["submitted"])
 
         bmi_array = (abandoned_array.astype(float) + merged_array.astype(float)) / submitted_array.astype(float)
@@ -231,8 +230,8 @@ class Pending(Metrics):
         items = items.pop('name')
 
         from GrimoireUtils import fill_and_order_items
-        id_field = DSQuery.get_group_field(self.filters.type_analysis[0])
-        id_field = id_field.split('.')[1] # remove table name
+        id_field = self.db.get_group_field(self.filters.type_analysis[0])
+        id_field = DSQuery.get_group_field_name(id_field)
         submitted = check_array_values(submitted)
         merged = check_array_values(merged)
         abandoned = check_array_values(abandoned)
@@ -257,27 +256,27 @@ class Pending(Metrics):
 
         return metrics_for_pendig_all
 
+    @staticmethod
+    def _get_pending(metrics):
+        """ submitted - merged - abandoned over the aligned values """
+        pending = numpy.array(metrics["submitted"]) - \
+            numpy.array(metrics["merged"]) - numpy.array(metrics["abandoned"])
+        return pending.tolist()
+
     def get_agg_all(self):
         evol = False
         metrics = self._get_metrics_for_pending_all(evol)
-        id_field = DSQuery.get_group_field(self.filters.type_analysis[0])
-        id_field = id_field.split('.')[1] # remove table name
-        data= \
-            [metrics['submitted'][i]-metrics['merged'][i]-metrics['abandoned'][i] \
-             for i in range(0, len(metrics['submitted']))]
+        id_field = self.db.get_group_field(self.filters.type_analysis[0])
+        id_field = DSQuery.get_group_field_name(id_field)
+        data = self._get_pending(metrics)
         return {id_field:metrics[id_field], "pending":data}
 
     def get_ts_all(self):
         evol = True
         metrics = self._get_metrics_for_pending_all(evol)
-        id_field = DSQuery.get_group_field(self.filters.type_analysis[0])
-        id_field = id_field.split('.')[1] # remove table name
-        pending = {"pending":[]}
-        for i in range(0, len(metrics['submitted'])):
-            pending["pending"].append([])
-            for j in range(0, len(metrics['submitted'][i])):
-                pending_val = metrics["submitted"][i][j] - metrics["merged"][i][j] - metrics["abandoned"][i][j]
-                pending["pending"][i].append(pending_val)
+        id_field = self.db.get_group_field(self.filters.type_analysis[0])
+        id_field = DSQuery.get_group_field_name(id_field)
+        pending = {"pending":self._get_pending(metrics)}
         pending[self.filters.period] = metrics[self.filters.period]
         pending[id_field] = metrics[id_field]
         return pending
@@ -307,9 +306,7 @@ class Pending(Metrics):
         if self.filters.type_analysis is not None and self.filters.type_analysis[1] is None:
             pending = self.get_ts_all()
         else:
-            for i in range(0, len(evol['submitted'])):
-                pending_val = evol["submitted"][i] - evol["merged"][i] - evol["abandoned"][i]
-                pending["pending"].append(pending_val)
+            pending["pending"] = self._get_pending(evol)
             pending[self.filters.period] = evol[self.filters.period]
         return pending
 
@@ -519,77 +516,168 @@ class ReviewsWaitingForReviewerTS(Metrics):
     desc = "Number of preview processes waiting for reviewer"
     data_source = SCR
 
-    def get_ts(self):
-        from datetime import datetime
-
-        def get_date_from_month(monthid):
-            # month format: year*12+month
-            year = (monthid-1) / 12
-            month = monthid - year*12
-            # We need the last day of the month
-            import calendar
-            last_day = calendar.monthrange(year, month)[1]
-            current = str(year)+"-"+str(month)+"-"+str(last_day)
-            return (current)
-
-
-        def get_pending(month, reviewers = False):
-            current = get_date_from_month(month)
-
-            sql_max_patchset = self.db.get_sql_max_patchset_for_reviews (current)
-            sql_reviews_reviewed = self.db.get_sql_reviews_reviewed(self.filters.startdate, current)
-            sql_reviews_closed = self.db.get_sql_reviews_closed(self.filters.startdate, current)
-
-            fields = "COUNT(DISTINCT(i.id)) as pending"
-
-            tables = " issues i "
-            tables = tables + self.db._get_tables_query(self.db.GetSQLReportFrom(type_analysis))
-
-            # Pending (NEW = submitted-merged-abandoned) REVIEWS
-            filters = " i.submitted_on <= '"+current+"' "
-            filters += self.db._get_filters_query(self.db.GetSQLReportWhere(type_analysis))
-            # remove closed reviews
-            filters += " AND i.id NOT IN ("+ sql_reviews_closed +")"
-
-            if reviewers:
-                filters += """ AND i.id NOT IN (%s)
-                """ % (sql_reviews_reviewed)
+    def _get_reviews(self):
+        # Reviews submitted in the period, with their item for filter all
+        fields = Set([])
+        tables = Set([])
+        filters = Set([])
 
-            q = self.db.GetSQLGlobal('i.submitted_on', fields, tables, filters,
-                                     startdate, enddate)
+        fields.add("i.id AS id")
+        fields.add("i.submitted_on AS submitted_on")
+        tables.add("issues i")
+        tables.union_update(self.db.GetSQLReportFrom(self.filters.type_analysis))
+        filters.union_update(self.db.GetSQLReportWhere(self.filters.type_analysis))
+        if self.filters.type_analysis and self.filters.type_analysis[1] is None:
+            fields.add(self.db.get_group_field(self.filters.type_analysis[0]))
 
-            rs = self.db.ExecuteQuery(q)
-            return rs['pending']
+        q = self.db.GetSQLGlobal('i.submitted_on', self.db._get_fields_query(fields),
+                                 self.db._get_tables_query(tables),
+                                 self.db._get_filters_query(filters),
+                                 self.filters.startdate, self.filters.enddate)
+        return check_array_values(self.db.ExecuteQuery(q))
+
+    def _get_closed(self):
+        # Close date of merged and abandoned reviews: {review: date}
+        q = """
+            SELECT i.id AS id, ie.mod_date AS closed_on
+            FROM issues i, issues_ext_gerrit ie
+            WHERE i.id = ie.issue_id
+            AND (status='MERGED' OR status='ABANDONED')
+            AND i.submitted_on >= %s AND i.submitted_on < %s
+        """ % (self.filters.startdate, self.filters.enddate)
+        res = check_array_values(self.db.ExecuteQuery(q))
+        return dict(zip(res.get('id', []), res.get('closed_on', [])))
+
+    def _get_patchsets(self):
+        # Patchsets uploaded to each review, and patchsets reviewed
+        # negatively (-1 or -2 in Code-Review or Verified), at any date
+        q = """
+            SELECT ch.issue_id AS id, ch.changed_on AS changed_on,
+                   CAST(ch.old_value AS UNSIGNED) AS patchset,
+                   ((field = 'Code-Review' OR field = 'Verified')
+                    AND (new_value = -1 OR new_value = -2)) AS negative
+            FROM issues i, changes ch
+            WHERE i.id = ch.issue_id
+            AND ch.old_value <> '' AND ch.old_value <> 'None'
+            AND i.submitted_on >= %s AND i.submitted_on < %s
+        """ % (self.filters.startdate, self.filters.enddate)
+        res = check_array_values(self.db.ExecuteQuery(q))
+        uploads = {}
+        negatives = {}
+        for (review, changed_on, patchset, negative) in \
+            zip(res.get('id', []), res.get('changed_on', []),
+                res.get('patchset', []), res.get('negative', [])):
+            uploads.setdefault(review, []).append((changed_on, patchset))
+            if negative: negatives.setdefault(review, set()).add(patchset)
+        return (uploads, negatives)
+
+    @staticmethod
+    def _get_review_events(submitted_on, closed_on, uploads, negatives):
+        # Changes in the (pending, waiting for reviewer) state of a review:
+        # [(date, pending delta, waiting delta)]. A review is pending from
+        # its submission till it is closed, and it is waiting for reviewer
+        # while its last patchset has no negative review.
+        changes = [(submitted_on, 'submitted', None)]
+        if closed_on is not None: changes.append((closed_on, 'closed', None))
+        for (changed_on, patchset) in uploads:
+            changes.append((changed_on, 'upload', patchset))
+        changes.sort()
+
+        events = []
+        submitted = closed = False
+        max_patchset = None
+        pending = waiting = 0
+        for pos in range(0, len(changes)):
+            (date, change, patchset) = changes[pos]
+            if change == 'submitted': submitted = True
+            elif change == 'closed': closed = True
+            elif max_patchset is None or patchset > max_patchset:
+                max_patchset = patchset
+            # The state at a date includes all changes at that date
+            if pos+1 < len(changes) and changes[pos+1][0] == date: continue
+            new_pending = int(submitted and not closed)
+            reviewed = max_patchset is not None and max_patchset in negatives
+            new_waiting = int(new_pending == 1 and not reviewed)
+            if new_pending != pending or new_waiting != waiting:
+                events.append((date, new_pending - pending, new_waiting - waiting))
+                pending, waiting = new_pending, new_waiting
+        return events
+
+    @staticmethod
+    def _get_period_end(period, period_id, unixtime):
+        # Last day of a period
+        import calendar
+        from datetime import datetime, timedelta
+        if period == "year": return datetime(period_id / 12, 12, 31)
+        if period == "month":
+            # month format: year*12+month
+            year = (period_id - 1) / 12
+            month = period_id - year * 12
+            return datetime(year, month, calendar.monthrange(year, month)[1])
+        start = datetime.utcfromtimestamp(int(unixtime))
+        if period == "week": return start + timedelta(days=6)
+        return start
 
-        pending = {"month":[],
-                   "ReviewsWaiting_ts":[],
-                   "ReviewsWaitingForReviewer_ts":[]}
+    def get_ts(self):
+        # Reviews pending and waiting for reviewer at the end of each period
+        # (its last day) from the submission, close and review events of all
+        # reviews, accumulated in one sweep over the periods.
+        from GrimoireUtils import getPeriodAxis, getPeriodDates, period_fields
 
-        startdate = self.filters.startdate
-        enddate = self.filters.enddate
         period = self.filters.period
-        identities_db = self.db.identities_db
-        type_analysis =  self.filters.type_analysis
-
-        start = datetime.strptime(startdate, "'%Y-%m-%d'")
-        end = datetime.strptime(enddate, "'%Y-%m-%d'")
-
-        if (period != "month"):
-            logging.error("Period not supported in " + self.id  + " " + period)
-            return {}
-
-        start_month = start.year*12 + start.month
-        end_month = end.year*12 + end.month
-        months = end_month - start_month
-
-        for i in range(0, months+1):
-            pending['month'].append(start_month+i)
-            pending_month = get_pending(start_month+i)
-            pending_reviewers_month = get_pending(start_month+i, True)
-            pending['ReviewsWaiting_ts'].append(pending_month)
-            pending['ReviewsWaitingForReviewer_ts'].append(pending_reviewers_month)
-
-        return pending
+        period_field = period_fields[period]
+        start, end = getPeriodDates(self.filters.startdate, self.filters.enddate)
+        periods, unixtimes, labels = getPeriodAxis(period, start, end)
+        ends = [self._get_period_end(period, period_id, unixtime)
+                for (period_id, unixtime) in zip(periods, unixtimes)]
+
+        id_field = None
+        if self.filters.type_analysis and self.filters.type_analysis[1] is None:
+            id_field = self.db.get_group_field(self.filters.type_analysis[0])
+            id_field = DSQuery.get_group_field_name(id_field)
+
+        reviews = self._get_reviews()
+        closed = self._get_closed()
+        uploads, negatives = self._get_patchsets()
+
+        items = reviews.get(id_field, [None] * len(reviews.get('id', [])))
+        events = []
+        done = set()
+        for (review, submitted_on, item) in zip(reviews.get('id', []),
+                                                reviews.get('submitted_on', []), items):
+            # Reviews are counted once in each item
+            if (review, item) in done: continue
+            done.add((review, item))
+            for event in self._get_review_events(submitted_on, closed.get(review),
+                                                 uploads.get(review, []),
+                                                 negatives.get(review, set())):
+                events.append(event + (item,))
+        events.sort(key=lambda event: event[0])
+
+        data = {period_field: [],
+                "ReviewsWaiting_ts": [], "ReviewsWaitingForReviewer_ts": []}
+        if id_field is not None: data[id_field] = []
+        pending = {}
+        waiting = {}
+        pos = 0
+        for (period_id, period_end) in zip(periods, ends):
+            while pos < len(events) and events[pos][0] <= period_end:
+                (date, pending_delta, waiting_delta, item) = events[pos]
+                pending[item] = pending.get(item, 0) + pending_delta
+                waiting[item] = waiting.get(item, 0) + waiting_delta
+                pos += 1
+            for item in pending:
+                if id_field is not None and pending[item] == 0: continue
+                data[period_field].append(period_id)
+                if id_field is not None: data[id_field].append(item)
+                data["ReviewsWaiting_ts"].append(pending[item])
+                data["ReviewsWaitingForReviewer_ts"].append(waiting[item])
+
+        if id_field is None:
+            return completePeriodIds(data, period, self.filters.startdate,
+                                     self.filters.enddate)
+        return Metrics._get_items_ts(data, id_field, period,
+                                     self.filters.startdate, self.filters.enddate)
 
 
 class ReviewsWaitingForReviewer(Metrics):
@@ -1089,48 +1177,33 @@ class TimeToReview(Metrics):
     desc = "Time to review"
     data_source = SCR
 
-    def _get_sql(self):
-        if self.filters.period != "month": return None
+    # Like [75, 90, 95]. The review times are in the SCR report data, which
+    # only has the median and avg.
+    percentiles = []
+
+    def _get_sql(self, evolutionary):
         bots = []
         q = self.db.GetTimeToReviewQuerySQL (self.filters.startdate, self.filters.enddate,
                                              self.filters.type_analysis, bots)
-        return q
+        fields = "revtime"
+        if evolutionary:
+            fields = self.db.GetSQLPeriodField(self.filters.period, "changed_on") + \
+                ", " + fields
+        return "SELECT " + fields + " FROM (" + q + ") reviews"
 
     def get_agg(self):
-        from numpy import median, average
-        from GrimoireUtils import removeDecimals
-
-        q = self._get_sql()
-        if q is None: return {}
-        data = self.db.ExecuteQuery(q)
-        data = data['revtime']
-        if (isinstance(data, list) == False): data = [data]
-        # ttr_median = sorted(data)[len(data)//2]
-        if (len(data) == 0):
-            ttr_median = float("nan")
-            ttr_avg = float("nan")
-        else:
-            ttr_median = float(median(removeDecimals(data)))
-            ttr_avg = float(average(removeDecimals(data)))
-        return {"review_time_days_median":ttr_median, "review_time_days_avg":ttr_avg}
+        """ Median, avg and percentiles of the review time in days """
+        rows = self.db.ExecuteQueryStream(self._get_sql(False))
+        data = get_distribution((row[0] for row in rows), self.percentiles)
+        return dict([("review_time_days_" + field, value) for (field, value) in data.items()])
 
     def get_ts(self):
-        q = self._get_sql()
-        if q is None: return {}
-        review_list = self.db.ExecuteQuery(q)
-        checkListArray(review_list)
-        metrics_list = {}
-
-
-        med_avg_list = medianAndAvgByPeriod(self.filters.period, review_list['changed_on'], review_list['revtime'])
-        if (med_avg_list != None):
-            metrics_list['review_time_days_median'] = med_avg_list['median']
-            metrics_list['review_time_days_avg'] = med_avg_list['avg']
-            metrics_list['month'] = med_avg_list['month']
-        else:
-            metrics_list['review_time_days_median'] = []
-            metrics_list['review_time_days_avg'] = []
-            metrics_list['month'] = []
+        period_field = period_fields[self.filters.period]
+        rows = self.db.ExecuteQueryStream(self._get_sql(True))
+        data = get_distribution_by_period(rows, period_field, self.percentiles)
+        metrics_list = {period_field: data.pop(period_field)}
+        for (field, value) in data.items():
+            metrics_list["review_time_days_" + field] = value
 
         metrics_list = completePeriodIds(metrics_list, self.filters.period,
                           self.filters.startdate, self.filters.enddate)
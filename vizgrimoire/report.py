@@ -19,7 +19,7 @@
 ##   Alvaro del Castillo <acs@bitergia.com>
 
 
-from GrimoireSQL import SetDBChannel
+from GrimoireSQL import SetDBChannel, SetQueryCache, SetQueryStats
 from GrimoireUtils import read_main_conf
 import logging, time
 import SCM, ITS, MLS, SCR, Mediawiki, IRC, DownloadsDS, QAForums, ReleasesDS
@@ -28,23 +28,33 @@ from metrics import Metrics
 from metrics_filter import MetricFilters
 from analyses import Analyses
 from query_builder import DSQuery
+from db_pool import DBPool
+from query_cache import QueryCache
+from query_stats import QueryStats
 
 class Report(object):
     """Basic class for a Grimoire automator based dashboard"""
 
     _filters = []
     _items = None
+    _shard = None # (shard, shards) of the filters items generated in this host
+    _shard_part = None # (part, parts) of the host shard generated in this process
     _all_data_sources = []
     _all_studies = []
     _on_studies = []
     _automator = None
     _automator_file = None
+    _query_cache = None
+    _query_stats = None
 
     @staticmethod
     def init(automator_file, metrics_path = None):
         Report._automator_file = automator_file
         Report._automator = read_main_conf(automator_file)
         Report._init_filters()
+        Report._init_db_pool()
+        Report._init_query_cache()
+        Report._init_query_stats()
         Report._init_data_sources()
         if metrics_path is not None:
             Report._init_metrics(metrics_path)
@@ -65,6 +75,70 @@ class Report(object):
                 logging.error("Wrong filter " + name + ", review " + Report._automator_file)
                 raise Exception('Wrong automator config file')
 
+    @staticmethod
+    def _init_db_pool():
+        """ Size of the connections pools shared by all the query builders """
+        generic = Report._automator['generic']
+        if 'db_pool_min' in generic:
+            DBPool.default_min_size = int(generic['db_pool_min'])
+        if 'db_pool_max' in generic:
+            DBPool.default_max_size = int(generic['db_pool_max'])
+
+    @staticmethod
+    def _init_query_cache():
+        """ Persistent cache for query results, activated with query_cache = path """
+        if 'query_cache' not in Report._automator['r']: return
+        path = Report._automator['r']['query_cache']
+        max_entries = None
+        if 'query_cache_entries' in Report._automator['r']:
+            max_entries = int(Report._automator['r']['query_cache_entries'])
+        logging.info("Using query cache " + path)
+        Report._query_cache = QueryCache(path, max_entries)
+        DSQuery.set_query_cache(Report._query_cache)
+        SetQueryCache(Report._query_cache)
+
+    @staticmethod
+    def _init_query_stats():
+        """ Stats of the queries run, written to the query_stats dir on close """
+        if 'query_stats' not in Report._automator['r']: return
+        path = Report._automator['r']['query_stats']
+        slow_time = None
+        if 'query_stats_slow' in Report._automator['r']:
+            slow_time = float(Report._automator['r']['query_stats_slow'])
+        explain = False
+        if 'query_stats_explain' in Report._automator['r']:
+            explain = Report._automator['r']['query_stats_explain'].lower() == 'true'
+        logging.info("Recording query stats in " + path)
+        Report._query_stats = QueryStats(path, slow_time, explain)
+        DSQuery.set_query_stats(Report._query_stats)
+        SetQueryStats(Report._query_stats)
+
+    @staticmethod
+    def reset_query_stats():
+        """ Forked workers only record the queries they run """
+        if Report._query_stats is not None:
+            Report._query_stats.reset()
+
+    @staticmethod
+    def write_query_stats():
+        if Report._query_stats is not None:
+            Report._query_stats.write()
+
+    @staticmethod
+    def close():
+        """ Release the resources used while generating the report """
+        if Report._query_stats is not None:
+            Report._query_stats.write()
+            DSQuery.set_query_stats(None)
+            SetQueryStats(None)
+            Report._query_stats = None
+        if Report._query_cache is not None:
+            DSQuery.set_query_cache(None)
+            SetQueryCache(None)
+            Report._query_cache.close()
+            Report._query_cache = None
+        DBPool.close_pools()
+
     @staticmethod
     def _init_data_sources():
         Report._all_data_sources = [SCM.SCM, ITS.ITS, MLS.MLS, SCR.SCR, 
@@ -235,6 +309,22 @@ class Report(object):
     def set_items(items):
         Report._items = items
 
+    @staticmethod
+    def get_shard():
+        return Report._shard
+
+    @staticmethod
+    def set_shard(shard):
+        Report._shard = shard
+
+    @staticmethod
+    def get_shard_part():
+        return Report._shard_part
+
+    @staticmethod
+    def set_shard_part(part):
+        Report._shard_part = part
+
     @staticmethod
     def get_studies():
         return Report._on_studies